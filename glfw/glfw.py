@@ -181,6 +181,23 @@ else:   # not Windows -> Linux or Mac
         _glfw = None
 
 
+    # then the one the system loader knows about
+    if _glfw == None:
+        import ctypes.util
+        for library_name in ['glfw', 'glfw3']:
+            filename = ctypes.util.find_library(library_name)
+            if not filename:
+                continue
+            try:
+                library_handle = ctypes.CDLL(filename)
+                version = [ctypes.c_int(0) for i in range(3)]
+                library_handle.glfwGetVersion(*[ctypes.pointer(v) for v in version])
+            except (OSError, AttributeError):
+                continue
+            if version[0].value >= 3:
+                _glfw = library_handle
+                break
+
     # if failed search it on the system (slower)
     if _glfw == None:
         _glfw = _load_library(['glfw', 'glfw3'], ['.so', '.dylib'],
@@ -1,2 +1,2 @@
-from .piio import read, write, read_buffer, write_buffer_uint8, minmax, read_tiled_buffers
+from .piio import read, write, read_buffer, write_buffer_uint8, minmax, set_threads, tile_stats, image_stats, build_pyramid, read_tiled_buffers_cached, read_tiled_buffers, map_buffer, read_region, read_region_buffer, TILE_SIZE, to_half, half_values, c_half
 
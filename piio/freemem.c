@@ -1,40 +1,270 @@
 #include <stdio.h>
 #include <stdlib.h>
+#include <string.h>
 #include <math.h>
 #include <stdint.h>
+#ifndef PIIO_NO_THREADS
+#include <pthread.h>
+#endif
 
 void freemem(void *ptr){
    free(ptr);
 }
 
-void minmax(float *p, int N, float *vmin, float *vmax) {
+// The loops below (and those of piio_copy_tile_mapped and piio_minmax_mapped
+// in stream.c) split their rows in contiguous blocks, one per thread.  The
+// number of threads is chosen by piio with piio_set_num_threads, small jobs
+// are always run in the calling thread.
+#define PIIO_MAX_THREADS 64
+#define PIIO_MIN_BLOCK_WORK (1<<16)
+
+static int piio_num_threads = 1;
+
+void piio_set_num_threads(int n) {
+   piio_num_threads = n < 1 ? 1 : n > PIIO_MAX_THREADS ? PIIO_MAX_THREADS : n;
+}
+
+int piio_get_num_threads(void) {
+   return piio_num_threads;
+}
+
+typedef void (*piio_block_fn)(void *ctx, int k, size_t i0, size_t i1);
+
+struct piio_block {
+   piio_block_fn fn;
+   void *ctx;
+   int k;
+   size_t i0, i1;
+};
+
+static void *run_block(void *p) {
+   struct piio_block *b = p;
+   b->fn(b->ctx, b->k, b->i0, b->i1);
+   return NULL;
+}
+
+// call fn(ctx, k, i0, i1) on contiguous blocks [i0,i1) covering [0,n), with
+// about work/n operations per item.  Returns the number of blocks (at most
+// PIIO_MAX_THREADS), fn gets the block index k
+int piio_parallel_for(size_t n, size_t work, piio_block_fn fn, void *ctx) {
+   int nb = piio_num_threads;
+   if (work / PIIO_MIN_BLOCK_WORK < (size_t)nb)
+      nb = work / PIIO_MIN_BLOCK_WORK;
+   if ((size_t)nb > n)
+      nb = n;
+   if (nb <= 1) {
+      fn(ctx, 0, 0, n);
+      return 1;
+   }
+   struct piio_block b[PIIO_MAX_THREADS];
+   for (int k=0;k<nb;k++) {
+      b[k].fn = fn;
+      b[k].ctx = ctx;
+      b[k].k = k;
+      b[k].i0 = n*k/nb;
+      b[k].i1 = n*(k+1)/nb;
+   }
+#ifndef PIIO_NO_THREADS
+   pthread_t t[PIIO_MAX_THREADS];
+   int started[PIIO_MAX_THREADS];
+   for (int k=1;k<nb;k++)
+      started[k] = !pthread_create(t+k, NULL, run_block, b+k);
+   run_block(b);
+   for (int k=1;k<nb;k++)
+      if (started[k]) pthread_join(t[k], NULL);
+      else run_block(b+k);
+#else
+   for (int k=0;k<nb;k++)
+      run_block(b+k);
+#endif
+   return nb;
+}
+
+struct minmax_ctx {
+   float *p;
+   float vmin[PIIO_MAX_THREADS], vmax[PIIO_MAX_THREADS];
+};
+
+static void minmax_block(void *c, int k, size_t i0, size_t i1) {
+   struct minmax_ctx *m = c;
    float imin = +INFINITY;
    float imax = -INFINITY;
-   for ( int i=0;i<N;i++ ) {
-      float pp = p[i];
+   for ( size_t i=i0;i<i1;i++ ) {
+      float pp = m->p[i];
       if ( isfinite(pp) ) {
-         imin = fmin(imin, pp); 
-         imax = fmax(imax, pp); 
+         if (pp < imin) imin = pp;
+         if (pp > imax) imax = pp;
       }
    }
+   m->vmin[k] = imin;
+   m->vmax[k] = imax;
+}
+
+void minmax(float *p, int N, float *vmin, float *vmax) {
+   struct minmax_ctx m = {p};
+   int nb = piio_parallel_for(N > 0 ? N : 0, N > 0 ? N : 0, minmax_block, &m);
+   float imin = +INFINITY;
+   float imax = -INFINITY;
+   for (int k=0;k<nb;k++) {
+      imin = fmin(imin, m.vmin[k]);
+      imax = fmax(imax, m.vmax[k]);
+   }
    *vmin = imin;
    *vmax = imax;
 }
 
+struct copy_tile_ctx {
+   float *src, *dst;
+   int nc, nr, nch, x0, y0, w, dst_nch;
+};
+
+static void copy_tile_block(void *c, int k, size_t j0, size_t j1) {
+   struct copy_tile_ctx *t = c;
+   int nch = t->nch, dst_nch = t->dst_nch, w = t->w, x0 = t->x0;
+   // columns [i0,i1) of the tile are inside the image
+   int i0 = x0 < 0 ? -x0 : 0;
+   int i1 = t->nc - x0 < w ? t->nc - x0 : w;
+   int n = nch < dst_nch ? nch : dst_nch;
+   for (size_t j=j0;j<j1;j++) {
+      float *d = t->dst + (size_t)dst_nch*w*j;
+      int jj = t->y0 + j;
+      if (jj < 0 || jj >= t->nr || i0 >= i1) {
+         memset(d, 0, sizeof*d*dst_nch*w);
+         continue;
+      }
+      memset(d, 0, sizeof*d*dst_nch*i0);
+      memset(d + dst_nch*i1, 0, sizeof*d*dst_nch*(w-i1));
+      const float *s = t->src + nch*((size_t)(x0+i0) + (size_t)jj*t->nc);
+      if (nch == dst_nch) {
+         memcpy(d + dst_nch*i0, s, sizeof*d*nch*(i1-i0));
+         continue;
+      }
+      for (int i=i0;i<i1;i++, s+=nch) {
+         for (int c=0;c<n;c++)
+            d[dst_nch*i+c] = s[c];
+         for (int c=n;c<dst_nch;c++)
+            d[dst_nch*i+c] = 0;
+      }
+   }
+}
+
 void copy_tile(float *src, int nc, int nr, int nch, float *dst, int x0, int y0, int w, int h, int dst_nch) {
-   for (int j=0;j<h;j++) {
-   for (int i=0;i<w;i++) {
-   for (int c=0;c<dst_nch;c++) {
-      float v=0;
-      int ii = x0+i;
-      int jj = y0+j;
-      if(ii>=0 && jj>=0 && ii < nc && jj < nr && c < nch) {
-         v = src[ nch*(ii + jj*nc)+c ];
+   struct copy_tile_ctx t = {src, dst, nc, nr, nch, x0, y0, w, dst_nch};
+   if (w <= 0 || h <= 0) return;
+   piio_parallel_for(h, (size_t)h*w*dst_nch, copy_tile_block, &t);
+}
+
+struct downsample_ctx {
+   const void *src;
+   int type, w, h, nch;
+   void *dst;
+   int dst_w, x0, y0;
+};
+
+static float sample_at(const void *p, int type, size_t i) {
+   if (type == 2) return ((const uint8_t*)p)[i];
+   if (type == 4) return ((const uint16_t*)p)[i];
+   return ((const float*)p)[i];
+}
+
+static void downsample_rows(void *c, int k, size_t j0, size_t j1) {
+   struct downsample_ctx *t = c;
+   int nch = t->nch, w = t->w, h = t->h;
+   for (size_t j=j0;j<j1;j++)
+   for (int i=0;i<(w+1)/2;i++)
+   for (int c=0;c<nch;c++) {
+      float s = 0, first = sample_at(t->src, t->type, nch*((size_t)2*i + 2*j*w) + c);
+      int n = 0;
+      for (int dj=0;dj<2 && 2*j+dj<h;dj++)
+      for (int di=0;di<2 && 2*i+di<w;di++) {
+         float v = sample_at(t->src, t->type, nch*((size_t)2*i+di + (2*j+dj)*w) + c);
+         if (isfinite(v)) {
+            s += v;
+            n++;
+         }
       }
-      dst[ dst_nch*(i + j*w)+c ] = v;
+      size_t o = nch*((size_t)t->x0+i + (t->y0+j)*t->dst_w) + c;
+      if (t->type == 2)
+         ((uint8_t*)t->dst)[o] = (s + n/2) / n;
+      else if (t->type == 4)
+         ((uint16_t*)t->dst)[o] = (s + n/2) / n;
+      else
+         ((float*)t->dst)[o] = n ? s / n : first;
    }
+}
+
+// halves the resolution of a w x h buffer of type 2 (uint8), 4 (uint16) or 7
+// (float) by averaging the finite samples of each 2x2 block (a block without
+// any keeps its first sample), the ceil(w/2) x ceil(h/2) result is written at
+// (x0,y0) of dst, a buffer of the same type with dst_w pixels per row
+void piio_downsample2(const void *src, int type, int w, int h, int nch, void *dst, int dst_w, int x0, int y0) {
+   struct downsample_ctx t = {src, type, w, h, nch, dst, dst_w, x0, y0};
+   if (w <= 0 || h <= 0) return;
+   piio_parallel_for((h+1)/2, (size_t)w*h*nch, downsample_rows, &t);
+}
+
+// IEEE half floats, the samples of the tiles of piio.to_half
+static uint16_t float_to_half(float f) {
+   uint32_t u;
+   memcpy(&u, &f, sizeof u);
+   uint16_t sign = (u >> 16) & 0x8000;
+   uint32_t a = u & 0x7fffffff;
+   if (a >= 0x7f800000) // inf and nan (which stays a nan)
+      return sign | 0x7c00 | (a > 0x7f800000 ? 0x200 | (a >> 13 & 0x3ff) : 0);
+   if (a >= 0x477ff000) // rounds above 65504
+      return sign | 0x7c00;
+   // rounding to nearest, ties to even
+   if (a < 0x38800000) { // subnormal half
+      if (a < 0x33000000)
+         return sign;
+      int shift = 126 - (int)(a >> 23);
+      uint32_t m = (a & 0x7fffff) | 0x800000;
+      uint32_t h = m >> shift, r = m & ((1u << shift) - 1), half = 1u << (shift - 1);
+      return sign | (h + (r > half || (r == half && (h & 1))));
    }
+   uint32_t h = (a - 0x38000000) >> 13, r = a & 0x1fff;
+   return sign | (h + (r > 0x1000 || (r == 0x1000 && (h & 1))));
+}
+
+static float half_to_float(uint16_t h) {
+   uint32_t sign = (uint32_t)(h & 0x8000) << 16;
+   uint32_t e = h >> 10 & 0x1f, m = h & 0x3ff;
+   if (!e) {
+      float f = ldexpf(m, -24);
+      return sign ? -f : f;
    }
+   uint32_t u = sign | (e == 31 ? 0x7f800000 : (e + 112) << 23) | m << 13;
+   float f;
+   memcpy(&f, &u, sizeof f);
+   return f;
+}
+
+struct half_ctx {
+   const void *src;
+   void *dst;
+};
+
+static void to_half_block(void *c, int k, size_t i0, size_t i1) {
+   struct half_ctx *t = c;
+   for (size_t i=i0;i<i1;i++)
+      ((uint16_t*)t->dst)[i] = float_to_half(((const float*)t->src)[i]);
+}
+
+static void from_half_block(void *c, int k, size_t i0, size_t i1) {
+   struct half_ctx *t = c;
+   for (size_t i=i0;i<i1;i++)
+      ((float*)t->dst)[i] = half_to_float(((const uint16_t*)t->src)[i]);
+}
+
+// converts n floats to half floats, and back
+void piio_float_to_half(const float *src, uint16_t *dst, size_t n) {
+   struct half_ctx t = {src, dst};
+   piio_parallel_for(n, n, to_half_block, &t);
+}
+
+void piio_half_to_float(const uint16_t *src, float *dst, size_t n) {
+   struct half_ctx t = {src, dst};
+   piio_parallel_for(n, n, from_half_block, &t);
 }
 
 #define swap_uint8(x,y) {uint8_t t = x; x = y; y = t;}
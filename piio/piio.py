@@ -17,7 +17,7 @@
 # along with pvflip.  If not, see <http://www.gnu.org/licenses/>.
 
 
-import os,sys,ctypes,platform
+import os,sys,ctypes,platform,threading
 
 #if sys.platform.startswith('win'):
 #   lib_ext = '.dll'
@@ -44,25 +44,37 @@ else:      # linux
    lib_basename = 'libiio'
    lib_ext = '.so'
 
-libiiofile= os.path.join(here, lib_basename+lib_ext)
+### the precompiled library, or the one built by setup.py if it is not usable
+libiio = None
+for basename in (lib_basename+lib_ext, 'libiio.so'):
+   try:
+      libiio = ctypes.CDLL(os.path.join(here, basename))
+      break
+   except OSError:
+      pass
 
-### fallback if precompiled libraries are not usable
-try:
-   os.stat(libiiofile)
-except OSError:
-   lib_basename = 'libiio'
-   lib_ext = '.so'
-   libiiofile= os.path.join(here, lib_basename+lib_ext)
-
-### HACK TO BUILD libiio ON THE FLY
-try:
-   os.stat(libiiofile)
-except OSError:
+### HACK TO BUILD libiio ON THE FLY (only the first time)
+### a library built before stream.c and stats.c is rebuilt as well
+def _build_libiio(stale=None):
    print('BUILDING PIIO...')
-   os.system('cd %s; python setup.py build'%here)
+   if stale is not None:   # drop the mapping before setup.py replaces it
+      import _ctypes
+      _ctypes.dlclose(stale._handle)
+   os.system('cd "%s"; "%s" setup.py build'%(here or '.', sys.executable))
+   return ctypes.CDLL(os.path.join(here, 'libiio.so'))
 
-libiio   = ctypes.CDLL(libiiofile)
-del libiiofile, here, lib_ext
+if libiio is None:
+   libiio = _build_libiio()
+elif not hasattr(libiio, 'piio_stream_open') and not sys.platform.startswith('win'):
+   try:
+      libiio = _build_libiio(libiio)
+   except OSError:
+      pass
+if not hasattr(libiio, 'piio_stream_open'):
+   print('PIIO WARNING: %s is outdated (no piio_stream_open), rebuild it '
+         'with stream.c and stats.c (setup.py or compile.mingw.win32); '
+         'tiled reading, streaming and stats are unavailable'%libiio._name)
+del here, lib_ext, lib_basename, basename, _build_libiio
 
 
 
@@ -80,7 +92,8 @@ def read(filename):
    nch=c_int()
    
    iioread.restype = c_void_p  # it's like this
-   tptr = iioread(str(filename).encode('ascii'),byref(w),byref(h),byref(nch))
+   with IIO_LOCK:
+      tptr = iioread(str(filename).encode('ascii'),byref(w),byref(h),byref(nch))
    if (tptr == None):
       raise IOError('PIIO: the file %s cannot be read'%(filename))
    c_float_p = POINTER(c_float)       # define a new type of pointer
@@ -143,7 +156,8 @@ def read_buffer(filename):
    nch=c_int()
    
    iioread.restype = c_void_p  # it's like this
-   tptr = iioread(str(filename).encode('ascii'),byref(w),byref(h),byref(nch))
+   with IIO_LOCK:
+      tptr = iioread(str(filename).encode('ascii'),byref(w),byref(h),byref(nch))
    if (tptr == None):
       raise IOError('PIIO: the file %s cannot be read'%(filename))
    c_float_p = POINTER(c_float)       # define a new type of pointer
@@ -165,9 +179,727 @@ def read_buffer(filename):
 
 
 
-def read_tiled_buffers(filename):
+TILE_SIZE = 1024
+
+# iio keeps the file being read (and its error recovery point) in globals, so
+# only one thread at a time may call its readers and writers; the streaming
+# readers below have no such state and run concurrently
+IIO_LOCK = threading.Lock()
+
+### streaming readers (not available in the older precompiled libraries)
+if hasattr(libiio, 'piio_stream_open'):
+   libiio.piio_stream_open.restype  = ctypes.c_void_p
+   libiio.piio_stream_open.argtypes = [ctypes.c_char_p] + [ctypes.POINTER(ctypes.c_int)]*3
+   libiio.piio_stream_read_rows.restype  = ctypes.c_int
+   libiio.piio_stream_read_rows.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int]
+   libiio.piio_stream_close.restype  = None
+   libiio.piio_stream_close.argtypes = [ctypes.c_void_p]
+   libiio.piio_stream_read_region.restype  = ctypes.c_int
+   libiio.piio_stream_read_region.argtypes = [ctypes.c_void_p] + [ctypes.c_int]*4 + [ctypes.c_void_p]
+   libiio.piio_stream_type.restype  = ctypes.c_int
+   libiio.piio_stream_type.argtypes = [ctypes.c_void_p]
+   libiio.piio_stream_read_rows_native.restype  = ctypes.c_int
+   libiio.piio_stream_read_rows_native.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int]
+if hasattr(libiio, 'piio_stream_layout'):
+   libiio.piio_stream_layout.restype  = ctypes.c_int
+   libiio.piio_stream_layout.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_longlong)] + [ctypes.POINTER(ctypes.c_int)]*2
+   libiio.piio_copy_tile_mapped.restype  = None
+   libiio.piio_copy_tile_mapped.argtypes = [ctypes.c_void_p] + [ctypes.c_int]*5 + [ctypes.c_void_p] + [ctypes.c_int]*5
+   libiio.piio_copy_tile_mapped_native.restype  = None
+   libiio.piio_copy_tile_mapped_native.argtypes = libiio.piio_copy_tile_mapped.argtypes
+   libiio.piio_minmax_mapped.restype  = None
+   libiio.piio_minmax_mapped.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_int, ctypes.c_size_t] + [ctypes.POINTER(ctypes.c_float)]*2
+
+### image statistics (not available in the older precompiled libraries)
+if hasattr(libiio, 'piio_tile_stats'):
+   libiio.piio_tile_stats.restype  = ctypes.c_int
+   libiio.piio_tile_stats.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_size_t, ctypes.c_int] + [ctypes.c_void_p]*4
+   libiio.piio_hist_compact.restype  = ctypes.c_int
+   libiio.piio_hist_compact.argtypes = [ctypes.c_void_p, ctypes.c_int] + [ctypes.c_void_p]*3
+   libiio.piio_hist_merge.restype  = None
+   libiio.piio_hist_merge.argtypes = [ctypes.c_void_p]*3 + [ctypes.c_int] + [ctypes.c_void_p]*3
+   libiio.piio_hist_sum.restype  = None
+   libiio.piio_hist_sum.argtypes = [ctypes.c_void_p]*3 + [ctypes.c_int]
+   libiio.piio_hist_percentiles.restype  = None
+   libiio.piio_hist_percentiles.argtypes = [ctypes.c_void_p]*3 + [ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_float, ctypes.c_float, ctypes.c_void_p]
+   libiio.piio_block_minmax.restype  = None
+   libiio.piio_block_minmax.argtypes = [ctypes.c_void_p] + [ctypes.c_int]*5 + [ctypes.c_void_p]*2
+   libiio.piio_block_hist.restype  = ctypes.c_int
+   libiio.piio_block_hist.argtypes = [ctypes.c_void_p] + [ctypes.c_int]*5 + [ctypes.c_void_p]*3
+   libiio.piio_region_hist.restype  = None
+   libiio.piio_region_hist.argtypes = [ctypes.c_void_p] + [ctypes.c_int]*5 + [ctypes.c_void_p]*5 + [ctypes.c_int]*4 + [ctypes.c_void_p]*6
+   HIST_BINS = libiio.piio_hist_bins()
+
+def set_threads(n=None):
    '''
-   IIO: float_buffer, w, h, nch = read_buffer(filename)
+   IIO: set_threads(n)   run the copy and minmax loops of libiio on n threads
+        set_threads()    use $PIIO_THREADS threads, or one per processor
+   '''
+   if not hasattr(libiio, 'piio_set_num_threads'):
+      return
+   if n is None:
+      n = os.environ.get('PIIO_THREADS')
+   if n is None:
+      import multiprocessing
+      try:
+         n = multiprocessing.cpu_count()
+      except NotImplementedError:
+         n = 1
+   libiio.piio_set_num_threads(int(n))
+
+set_threads()
+
+if hasattr(libiio, 'piio_downsample2'):
+   libiio.piio_downsample2.restype  = None
+   libiio.piio_downsample2.argtypes = [ctypes.c_void_p] + [ctypes.c_int]*4 + [ctypes.c_void_p] + [ctypes.c_int]*3
+
+if hasattr(libiio, 'piio_float_to_half'):
+   libiio.piio_float_to_half.restype  = None
+   libiio.piio_float_to_half.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t]
+   libiio.piio_half_to_float.restype  = None
+   libiio.piio_half_to_float.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t]
+
+# side of the blocks of tile_stats (at most 255, see piio_block_hist)
+STATS_BLOCK_SIZE = 128
+
+# sample type of the half floats of to_half in stats.c
+STATS_TYPE_HALF = 16
+
+# sample types of piio_stream_layout (IIO_TYPE_* numbering) as numpy type codes
+MAPPED_TYPES = {1:'i1', 2:'u1', 3:'i2', 4:'u2', 5:'i4', 6:'u4', 7:'f4', 8:'f8'}
+
+# sample types kept by read_tiled_buffers(native=True), the others are float
+NATIVE_TYPES = {2: ctypes.c_uint8, 4: ctypes.c_uint16}
+
+
+
+def tile_stats(data, w, h, nch):
+   '''
+   IIO: stats = tile_stats(data, w, h, nch)
+   summary of a w x h tile buffer (of floats or of one of the NATIVE_TYPES):
+   a list [vmin, vmax, nonfinite, bins, counts, offsets, bmin, bmax,
+   bbins, bcounts, boffsets] of ctypes arrays with the minimum, maximum and
+   number of non-finite samples of each channel, the non-empty bins of their
+   histograms (channel c has the bins and counts in offsets[c]:offsets[c+1]),
+   the minimum and maximum of each channel in the STATS_BLOCK_SIZE blocks of
+   the tile (bmin[c + nch*(bx + by*nbx)], with nbx blocks in a row) and the
+   histograms of the blocks (channel c of block k in
+   boffsets[c + nch*k]:boffsets[c + nch*k + 1])
+   returns None if libiio can not compute it, or for c_half tiles (the
+   stats of the tiles of to_half are those of their float samples)
+   '''
+   if not hasattr(libiio, 'piio_tile_stats') or data._type_ == c_half:
+      return None
+   typ = stats_type(data)
+   vmin      = (ctypes.c_float*nch)()
+   vmax      = (ctypes.c_float*nch)()
+   nonfinite = (ctypes.c_longlong*nch)()
+   hist      = (ctypes.c_uint32*(nch*HIST_BINS))()
+   if libiio.piio_tile_stats(data, typ, w*h, nch, vmin, vmax, nonfinite, hist) != 0:
+      return None
+   offsets = (ctypes.c_int*(nch+1))()
+   nbins   = libiio.piio_hist_compact(hist, nch, None, None, None)
+   bins    = (ctypes.c_uint16*nbins)()
+   counts  = (ctypes.c_uint32*nbins)()
+   libiio.piio_hist_compact(hist, nch, bins, counts, offsets)
+   nblocks = -(-w//STATS_BLOCK_SIZE) * -(-h//STATS_BLOCK_SIZE)
+   bmin    = (ctypes.c_float*(nblocks*nch))()
+   bmax    = (ctypes.c_float*(nblocks*nch))()
+   libiio.piio_block_minmax(data, typ, w, h, nch, STATS_BLOCK_SIZE, bmin, bmax)
+   boffsets = (ctypes.c_int*(nblocks*nch+1))()
+   room    = nblocks*nch*STATS_BLOCK_SIZE**2
+   bbins, bcounts = (ctypes.c_uint16*room)(), (ctypes.c_uint16*room)()
+   nbins   = libiio.piio_block_hist(data, typ, w, h, nch, STATS_BLOCK_SIZE, boffsets, bbins, bcounts)
+   if nbins < 0:
+      return None
+   bbins   = (ctypes.c_uint16*nbins).from_buffer_copy(bbins)
+   bcounts = (ctypes.c_uint16*nbins).from_buffer_copy(bcounts)
+   return [vmin, vmax, nonfinite, bins, counts, offsets, bmin, bmax, bbins, bcounts, boffsets]
+
+
+def stats_type(data):
+   '''
+   IIO: the sample type of a tile buffer for stats.c
+   '''
+   if data._type_ == c_half:
+      return STATS_TYPE_HALF
+   for t in NATIVE_TYPES:
+      if data._type_ == NATIVE_TYPES[t]:
+         return t
+   return 7
+
+
+
+# the histograms merged by image_stats, one set per thread and number of
+# channels: they are left empty by piio_hist_percentiles, ready for reuse
+HIST_BUFFERS = threading.local()
+
+
+def hist_buffers(nch):
+   '''
+   IIO: hist, used, nused = hist_buffers(nch)
+   the empty full histograms of the nch channels and of all of them, and
+   the lists of their used bins (see piio_hist_merge in stats.c)
+   '''
+   buffers = HIST_BUFFERS.__dict__.setdefault('buffers', {})
+   if nch not in buffers:
+      buffers[nch] = ((ctypes.c_longlong*(HIST_BINS*(nch+1)))(),
+                      (ctypes.c_uint16*(HIST_BINS*(nch+1)))(), (ctypes.c_int*(nch+1))())
+   return buffers[nch]
+
+
+def image_stats(tiles, percentiles=(1,99), region=None):
+   '''
+   IIO: stats = image_stats(tiles, percentiles=(1,99), region=None)
+   merges the summaries (tile[7]) of the tiles of read_tiled_buffers
+   stats is a dict of per channel lists 'min', 'max', 'nonfinite' and
+   'count' (of the finite samples), and 'percentiles', a dict with the
+   list of each requested percentile; 'percentiles_all' has the
+   percentiles of all the channels together
+   the percentiles are approximate (within 1/128 of their value)
+   with region=(x0,y0,x1,y1) only the samples in [x0,x1)x[y0,y1) are
+   counted: the tiles and the blocks of the tiles inside it are merged
+   from their summaries, the samples of the blocks on its border are read
+   only the non-empty bins are merged and searched for the percentiles
+   returns None if the tiles have no summaries or none is in the region
+   '''
+   tiles = [t for t in tiles if len(t) > 7 and t[7] is not None]
+   if region is not None:
+      x0, y0, x1, y1 = region
+      tiles = [t for t in tiles if t[1] < x1 and t[2] < y1 and t[1]+t[3] > x0 and t[2]+t[4] > y0]
+   if not tiles:
+      return None
+   nch = tiles[0][5]
+   hists, used, nused = hist_buffers(nch)
+   stats = {'min': [float('inf')]*nch, 'max': [float('-inf')]*nch,
+            'nonfinite': [0]*nch, 'count': [0]*nch}
+   try:
+      for t in tiles:
+         vmin, vmax, nonfinite, bins, counts, offsets, bmin, bmax = t[7][:8]
+         if region is not None and not (x0 <= t[1] and y0 <= t[2] and t[1]+t[3] <= x1 and t[2]+t[4] <= y1):
+            bbins, bcounts, boffsets = t[7][8:]
+            rmin = (ctypes.c_float*nch)(*stats['min'])
+            rmax = (ctypes.c_float*nch)(*stats['max'])
+            count = (ctypes.c_longlong*nch)()
+            libiio.piio_region_hist(t[0], stats_type(t[0]), t[3], t[4], nch, STATS_BLOCK_SIZE,
+                                    bmin, bmax, boffsets, bbins, bcounts,
+                                    x0-t[1], y0-t[2], x1-t[1], y1-t[2], hists, used, nused,
+                                    rmin, rmax, count)
+            area = (min(x1, t[1]+t[3]) - max(x0, t[1])) * (min(y1, t[2]+t[4]) - max(y0, t[2]))
+            for c in range(nch):
+               stats['min'][c], stats['max'][c] = rmin[c], rmax[c]
+               stats['count'][c] += count[c]
+               stats['nonfinite'][c] += area - count[c]
+            continue
+         for c in range(nch):
+            stats['min'][c] = min(stats['min'][c], vmin[c])
+            stats['max'][c] = max(stats['max'][c], vmax[c])
+            stats['nonfinite'][c] += nonfinite[c]
+            stats['count'][c] += t[3]*t[4] - nonfinite[c]
+         libiio.piio_hist_merge(hists, used, nused, nch, bins, counts, offsets)
+   except:
+      # leave the buffers empty for the next call
+      ctypes.memset(hists, 0, ctypes.sizeof(hists))
+      ctypes.memset(nused, 0, ctypes.sizeof(nused))
+      raise
+
+   q = (ctypes.c_double*len(percentiles))(*percentiles)
+   out = (ctypes.c_float*len(percentiles))()
+   def search(c, vmin, vmax):
+      libiio.piio_hist_percentiles(hists, used, nused, c, q, len(q), vmin, vmax, out)
+      return list(out)
+   libiio.piio_hist_sum(hists, used, nused, nch)
+   everything = search(nch, min(stats['min']), max(stats['max']))
+   channels = [search(c, stats['min'][c], stats['max'][c]) for c in range(nch)]
+   stats['percentiles'] = dict((p, [v[k] for v in channels]) for k, p in enumerate(percentiles))
+   stats['percentiles_all'] = dict(zip(percentiles, everything))
+   return stats
+
+
+
+def build_pyramid(tiles, w, h, nch):
+   '''
+   IIO: levels = build_pyramid(tiles, w, h, nch)
+   halves the resolution of the tiles of read_tiled_buffers until the
+   image fits in a single tile, levels[k-1] has the tiles of the image
+   reduced 2^k times (x, y, w and h are in pixels of the level)
+   each pixel is the mean of the finite samples of a 2x2 block of the
+   previous level, returns [] if libiio can not compute it
+   '''
+   if not hasattr(libiio, 'piio_downsample2') or not tiles:
+      return []
+   ctype = tiles[0][0]._type_
+   typ = 7
+   for t in NATIVE_TYPES:
+      if ctype == NATIVE_TYPES[t]:
+         typ = t
+
+   levels = []
+   while w > TILE_SIZE or h > TILE_SIZE:
+      lw, lh = (w+1)//2, (h+1)//2
+      index = dict(((t[1],t[2]), t) for t in tiles)
+      level = []
+      for y in range(0, lh, TILE_SIZE):
+         for x in range(0, lw, TILE_SIZE):
+            ww = min (lw - x, TILE_SIZE)
+            hh = min (lh - y, TILE_SIZE)
+            data = ctypes.ARRAY(ctype, ww*hh*nch)()
+            # each tile of the level comes from 2x2 tiles of the previous one
+            for dy in (0, TILE_SIZE):
+               for dx in (0, TILE_SIZE):
+                  t = index.get((2*x+dx, 2*y+dy))
+                  if t:
+                     libiio.piio_downsample2(t[0], typ, t[3], t[4], nch, data, ww, dx//2, dy//2)
+            level.append( [data, x, y, ww,hh, nch, -1] )
+      levels.append(level)
+      tiles, w, h = level, lw, lh
+   return levels
+
+
+
+class c_half(ctypes.c_uint16):
+   '''
+   the bits of an IEEE half float, the samples of the tiles of to_half
+   '''
+
+
+
+def to_half(tiles):
+   '''
+   IIO: tiles = to_half(tiles)
+   the tiles of read_tiled_buffers (or of a level of build_pyramid) with
+   their float samples rounded to half floats (c_half arrays of half the
+   size), the other tiles are kept as they are, and so are all of them
+   if libiio can not convert them
+   '''
+   if not hasattr(libiio, 'piio_float_to_half'):
+      return tiles
+   out = []
+   for t in tiles:
+      if t[0]._type_ == ctypes.c_float:
+         data = ctypes.ARRAY(c_half, len(t[0]))()
+         libiio.piio_float_to_half(t[0], data, len(t[0]))
+         t = [data] + list(t[1:])
+      out.append(t)
+   return out
+
+
+
+def half_values(data, i, n):
+   '''
+   IIO: values = half_values(data, i, n)
+   the n samples of the c_half array data starting at i, as floats
+   '''
+   values = (ctypes.c_float*n)()
+   libiio.piio_half_to_float(ctypes.byref(data, i*ctypes.sizeof(c_half)), values, n)
+   return list(values)
+
+
+
+def map_file(filename):
+   '''
+   IIO: mapping, offset, w, h, nch, type, swap = map_file(filename)
+   maps (read-only) a file whose samples are stored uncompressed:
+   PFM, FLO, binary PNM, RAW[...]: and uncompressed stripped TIFF
+   the samples start at byte offset of the mapping, type is a key of
+   MAPPED_TYPES and swap tells if the samples are byte swapped
+   returns None if the file can not be mapped
+   '''
+   import mmap
+   from ctypes import c_int, c_longlong, byref
+
+   if not hasattr(libiio, 'piio_stream_layout'):
+      return None
+
+   w=c_int()
+   h=c_int()
+   nch=c_int()
+   typ=c_int()
+   swap=c_int()
+   offset=c_longlong()
+   stream = libiio.piio_stream_open(str(filename).encode('ascii'),byref(w),byref(h),byref(nch))
+   if not stream:
+      return None
+   try:
+      if libiio.piio_stream_layout(stream, byref(offset), byref(typ), byref(swap)):
+         return None
+   finally:
+      libiio.piio_stream_close(stream)
+
+   path = str(filename)
+   if path.startswith('RAW['):  # RAW[description]:filename
+      path = path[path.index(':')+1:]
+   try:
+      with open(path, 'rb') as f:
+         mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+   except (EnvironmentError, ValueError):
+      return None
+   return mapping, offset.value, w.value, h.value, nch.value, typ.value, swap.value
+
+
+
+class BufferAddress:
+   '''
+   address of the memory of a (possibly read-only) buffer object such as
+   a mmap, without numpy.  The buffer stays exported until release()
+   '''
+   class Py_buffer(ctypes.Structure):
+      _fields_ = [('buf', ctypes.c_void_p), ('obj', ctypes.c_void_p),
+                  ('len', ctypes.c_ssize_t), ('itemsize', ctypes.c_ssize_t),
+                  ('readonly', ctypes.c_int), ('ndim', ctypes.c_int),
+                  ('format', ctypes.c_char_p), ('shape', ctypes.c_void_p),
+                  ('strides', ctypes.c_void_p), ('suboffsets', ctypes.c_void_p),
+                  ('internal', ctypes.c_void_p)]
+
+   def __init__(self, obj):
+      api = ctypes.pythonapi
+      if sys.version_info.major >= 3:
+         self.view = BufferAddress.Py_buffer()
+         api.PyObject_GetBuffer.argtypes = [ctypes.py_object, ctypes.POINTER(BufferAddress.Py_buffer), ctypes.c_int]
+         if api.PyObject_GetBuffer(obj, ctypes.byref(self.view), 0):
+            raise BufferError('PIIO: cannot access the buffer')
+         self.address = self.view.buf
+      else:
+         self.view = None
+         address, size = ctypes.c_void_p(), ctypes.c_ssize_t()
+         api.PyObject_AsReadBuffer.argtypes = [ctypes.py_object, ctypes.POINTER(ctypes.c_void_p), ctypes.POINTER(ctypes.c_ssize_t)]
+         if api.PyObject_AsReadBuffer(obj, ctypes.byref(address), ctypes.byref(size)):
+            raise BufferError('PIIO: cannot access the buffer')
+         self.address = address.value
+         self.obj = obj   # keep it alive
+
+   def release(self):
+      if self.view is not None:
+         ctypes.pythonapi.PyBuffer_Release.argtypes = [ctypes.POINTER(BufferAddress.Py_buffer)]
+         ctypes.pythonapi.PyBuffer_Release(ctypes.byref(self.view))
+         self.view = None
+
+
+
+def map_buffer(filename):
+   '''
+   IIO: buffer, w, h, nch, dtype = map_buffer(filename)
+   read-only view of the samples of the file, without copying them
+   (see map_file for the accepted files)
+   dtype is a numpy type string such as '<f4' or '>u2', so that
+   numpy.frombuffer(buffer, dtype).reshape((h,w,nch)) gives the image
+   '''
+   m = map_file(filename)
+   if m is None:
+      raise IOError('PIIO: the file %s cannot be mapped'%(filename))
+   mapping, offset, w, h, nch, typ, swap = m
+
+   code = MAPPED_TYPES[typ]
+   little = (sys.byteorder == 'little') != bool(swap)
+   if code[1] == '1':
+      dtype = '|' + code
+   else:
+      dtype = ('<' if little else '>') + code
+   nbytes = w*h*nch*int(code[1])
+   if sys.version_info.major >= 3:
+      buffer_ = memoryview(mapping)[offset:offset+nbytes]
+   else:
+      buffer_ = buffer(mapping, offset, nbytes)
+   return buffer_, w, h, nch, dtype
+
+
+
+def read_tiled_buffers(filename, native=False):
+   '''
+   IIO: tiles, w, h, nch, vmin, vmax = read_tiled_buffers(filename, native=False)
+   each tile is a list [float_buffer, x, y, w, h, nch, -1, stats]
+   with the tile_stats of the tile, computed as it is copied
+   PNG, JPEG, TIFF, PNM, PFM and FLO files are decoded one band of tiles
+   at a time, so the full float image is never held in memory, and the
+   uncompressed ones are read directly from a mapping of the file
+   with native=True the 8 and 16 bit unsigned samples are not converted:
+   the buffers are then arrays of the ctypes given in NATIVE_TYPES
+   '''
+   from ctypes import c_int, c_float, byref
+
+   if not hasattr(libiio, 'piio_stream_open'):
+      return read_tiled_buffers_whole(filename)
+
+   r = read_tiled_buffers_mapped(filename, native)
+   if r is not None:
+      return r
+
+   w=c_int()
+   h=c_int()
+   nch=c_int()
+   stream = libiio.piio_stream_open(str(filename).encode('ascii'),byref(w),byref(h),byref(nch))
+   if not stream:
+      return read_tiled_buffers_whole(filename)
+   w,h,nch=w.value,h.value,nch.value
+
+   try:
+      typ = libiio.piio_stream_type(stream)
+      if not native or typ not in NATIVE_TYPES:
+         typ = None
+      tiles   = []
+      vmin,vmax = float('inf'),float('-inf')
+      out_nch = min(nch,4)
+      if(nch != out_nch):
+         print("piio_read: the input image have %d channels, only the first 4 are loaded\n"%nch)
+      ctype = NATIVE_TYPES[typ] if typ else ctypes.c_float
+      band = ctypes.ARRAY(ctype, w*min(h,TILE_SIZE)*nch)()
+      for y in range(0,h, TILE_SIZE):
+         hh = min (h - y, TILE_SIZE)
+         if typ:
+            n = libiio.piio_stream_read_rows_native(stream, band, hh)
+         else:
+            n = libiio.piio_stream_read_rows(stream, band, hh)
+         if n != hh:
+            raise IOError('PIIO: the file %s cannot be read'%(filename))
+         if typ:
+            bmin,bmax = c_float(),c_float()
+            libiio.piio_minmax_mapped(band, typ, 0, w*hh*nch, byref(bmin), byref(bmax))
+            bmin,bmax = bmin.value,bmax.value
+         else:
+            bmin,bmax = minmax(band, w*hh*nch)
+         vmin,vmax = min(vmin,bmin),max(vmax,bmax)
+         # split the band in tiles
+         for x in range(0,w, TILE_SIZE):
+            ww = min (w - x, TILE_SIZE)
+            data = ctypes.ARRAY(ctype, ww*hh*out_nch)()
+            if typ:
+               libiio.piio_copy_tile_mapped_native(band, typ, 0, w, hh, nch, data, x, 0, ww, hh, out_nch)
+            else:
+               libiio.copy_tile(band, w, hh, nch, data, x, 0, ww, hh, out_nch)  # only allow up to 4 channels
+            tiles.append( [data, x, y, ww,hh, out_nch, -1, tile_stats(data, ww, hh, out_nch)] )  # -1 is a placeholder for the textureID
+   finally:
+      libiio.piio_stream_close(stream)
+
+   return (tiles,w,h,out_nch,vmin,vmax)
+
+
+
+def read_tiled_buffers_mapped(filename, native=False):
+   '''
+   IIO: tiles, w, h, nch, vmin, vmax = read_tiled_buffers_mapped(filename, native=False)
+   same as read_tiled_buffers but the tiles are converted directly from
+   the mapped file, returns None if the file can not be mapped
+   '''
+   from ctypes import c_float, byref
+
+   m = map_file(filename)
+   if m is None:
+      return None
+   mapping, offset, w, h, nch, typ, swap = m
+
+   view = BufferAddress(mapping)
+   try:
+      src = view.address + offset
+
+      vmin=c_float()
+      vmax=c_float()
+      libiio.piio_minmax_mapped(src, typ, swap, w*h*nch, byref(vmin), byref(vmax))
+      vmin,vmax=vmin.value,vmax.value
+
+      tiles   = []
+      out_nch = min(nch,4)
+      if(nch != out_nch):
+         print("piio_read: the input image have %d channels, only the first 4 are loaded\n"%nch)
+      for y in range(0,h, TILE_SIZE):
+         for x in range(0,w, TILE_SIZE):
+            ww = min (w - x, TILE_SIZE)
+            hh = min (h - y, TILE_SIZE)
+            if native and typ in NATIVE_TYPES:
+               data = ctypes.ARRAY(NATIVE_TYPES[typ], ww*hh*out_nch)()
+               libiio.piio_copy_tile_mapped_native(src, typ, swap, w, h, nch, data, x, y, ww, hh, out_nch)
+            else:
+               data = ctypes.ARRAY(ctypes.c_float, ww*hh*out_nch)()
+               libiio.piio_copy_tile_mapped(src, typ, swap, w, h, nch, data, x, y, ww, hh, out_nch)
+            tiles.append( [data, x, y, ww,hh, out_nch, -1, tile_stats(data, ww, hh, out_nch)] )  # -1 is a placeholder for the textureID
+   finally:
+      view.release()
+      mapping.close()
+
+   return (tiles,w,h,out_nch,vmin,vmax)
+
+
+
+# default size limit of the tile cache of read_tiled_buffers_cached
+CACHE_MAX_BYTES = 4<<30
+
+# sample types of the tile buffers, as stored in the cache files
+CACHE_TYPES = {'f': ctypes.c_float, 'B': ctypes.c_uint8, 'H': ctypes.c_uint16}
+CACHE_MAGIC = b'PIIOTILES2\n'
+
+
+def read_tiled_buffers_cached(filename, cachedir, native=False, max_bytes=CACHE_MAX_BYTES):
+   '''
+   IIO: tiles, w, h, nch, vmin, vmax, levels = read_tiled_buffers_cached(filename, cachedir, native=False, max_bytes=CACHE_MAX_BYTES)
+   read_tiled_buffers followed by build_pyramid, keeping the result in a
+   file of cachedir: the next time the tiles are mapped from that file
+   the entries are keyed by the path, size and modification time of the
+   file, and the least recently used ones are deleted to keep the size
+   of the cache below max_bytes
+   '''
+   try:
+      st = os.stat(filename)
+      import stat
+      if not stat.S_ISREG(st.st_mode):
+         raise OSError
+   except OSError:
+      tiles,w,h,nch,vmin,vmax = read_tiled_buffers(filename, native)
+      return tiles,w,h,nch,vmin,vmax,build_pyramid(tiles,w,h,nch)
+
+   import hashlib
+   key = '%s|%d|%r|%d|%d'%(os.path.abspath(filename), st.st_size, st.st_mtime, bool(native), TILE_SIZE)
+   path = os.path.join(cachedir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.tiles')
+
+   r = cache_load(path, key)
+   if r is not None:
+      try:
+         os.utime(path, None)   # most recently used
+      except OSError:
+         pass
+      return r
+
+   tiles,w,h,nch,vmin,vmax = read_tiled_buffers(filename, native)
+   levels = build_pyramid(tiles,w,h,nch)
+   try:
+      if not os.path.isdir(cachedir):
+         os.makedirs(cachedir)
+      cache_store(path, key, (tiles,w,h,nch,vmin,vmax,levels))
+      cache_evict(cachedir, max_bytes, keep=path)
+   except (OSError, IOError, ValueError) as e:
+      print('PIIO: cannot write the cache %s: %s'%(path, e))
+   return tiles,w,h,nch,vmin,vmax,levels
+
+
+
+def cache_store(path, key, image):
+   '''
+   IIO: cache_store(path, key, (tiles, w, h, nch, vmin, vmax, levels))
+   writes the tiles, their summaries and the pyramid levels in the cache
+   file path: a json header followed by the raw buffers, page aligned
+   raises ValueError if there are no tiles or their type is not one of
+   the CACHE_TYPES (as the c_half tiles of to_half)
+   '''
+   import json
+   tiles,w,h,nch,vmin,vmax,levels = image
+   code = [c for c in CACHE_TYPES if tiles and CACHE_TYPES[c] == tiles[0][0]._type_]
+   if not code:
+      raise ValueError('no tiles of a cached type (%s) to store in %s'%
+                       (', '.join(sorted(CACHE_TYPES)), path))
+   code = code[0]
+
+   # layout of the buffers: (offset, array)
+   buffers = []
+   def place(arr, align=8):
+      offset = buffers[-1][0] + ctypes.sizeof(buffers[-1][1]) if buffers else 0
+      offset = -(-offset//align)*align
+      buffers.append((offset, arr))
+      return offset
+
+   def entry(t):
+      e = [t[1], t[2], t[3], t[4], place(t[0], 4096)]
+      if len(t) > 7 and t[7] is not None:
+         e.append([place(a) for a in t[7]] + [len(t[7][3]), len(t[7][8])])
+      return e
+
+   header = {'key': key, 'w': w, 'h': h, 'nch': nch, 'vmin': vmin, 'vmax': vmax,
+             'type': code, 'tiles': [entry(t) for t in tiles],
+             'levels': [[entry(t) for t in level] for level in levels]}
+   header = json.dumps(header).encode('utf-8')
+   start = -(-(len(CACHE_MAGIC) + 16 + len(header))//4096)*4096
+
+   tmp = path + '.%d.%d'%(os.getpid(), threading.current_thread().ident)
+   with open(tmp, 'wb') as f:
+      f.write(CACHE_MAGIC + ('%15d\n'%len(header)).encode('ascii') + header)
+      for offset, arr in buffers:
+         f.seek(start + offset)
+         f.write(arr)
+   try:
+      os.rename(tmp, path)
+   except OSError:
+      os.remove(tmp)
+      raise
+
+
+
+def cache_load(path, key):
+   '''
+   IIO: image = cache_load(path, key)
+   maps a file written by cache_store (the buffers of the tiles are
+   copy-on-write views of the mapping), None if it is missing or stale
+   '''
+   import json, mmap
+   try:
+      with open(path, 'rb') as f:
+         if f.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+            return None
+         size = int(f.read(16))
+         header = json.loads(f.read(size).decode('utf-8'))
+         if header['key'] != key:
+            return None
+         nch, ctype = header['nch'], CACHE_TYPES[header['type']]
+         mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+   except (OSError, IOError, ValueError, KeyError, IndexError, TypeError):
+      return None   # missing, or a damaged header
+
+   start = -(-(len(CACHE_MAGIC) + 16 + size)//4096)*4096
+   def array(t, n, offset):
+      return (t*n).from_buffer(mapping, start + offset)
+
+   def tile(e):
+      x, y, ww, hh, offset = e[:5]
+      t = [array(ctype, ww*hh*nch, offset), x, y, ww, hh, nch, -1]
+      if len(e) > 5:
+         o, nbins, nbbins = e[5][:-2], e[5][-2], e[5][-1]
+         nblocks = -(-ww//STATS_BLOCK_SIZE) * -(-hh//STATS_BLOCK_SIZE)
+         t.append([array(ctypes.c_float, nch, o[0]), array(ctypes.c_float, nch, o[1]),
+                   array(ctypes.c_longlong, nch, o[2]), array(ctypes.c_uint16, nbins, o[3]),
+                   array(ctypes.c_uint32, nbins, o[4]), array(ctypes.c_int, nch+1, o[5]),
+                   array(ctypes.c_float, nblocks*nch, o[6]), array(ctypes.c_float, nblocks*nch, o[7]),
+                   array(ctypes.c_uint16, nbbins, o[8]), array(ctypes.c_uint16, nbbins, o[9]),
+                   array(ctypes.c_int, nblocks*nch+1, o[10])])
+      return t
+
+   try:
+      tiles  = [tile(e) for e in header['tiles']]
+      levels = [[tile(e) for e in level] for level in header['levels']]
+      return tiles, header['w'], header['h'], nch, header['vmin'], header['vmax'], levels
+   except (ValueError, KeyError, IndexError, TypeError):   # truncated or damaged file
+      return None
+
+
+
+def cache_evict(cachedir, max_bytes, keep=None):
+   '''
+   IIO: cache_evict(cachedir, max_bytes, keep=None)
+   deletes the least recently used files of the tile cache until it takes
+   less than max_bytes (never deleting keep)
+   '''
+   entries = []
+   for name in os.listdir(cachedir):
+      if name.endswith('.tiles'):
+         p = os.path.join(cachedir, name)
+         try:
+            st = os.stat(p)
+         except OSError:
+            continue
+         entries.append((st.st_mtime, st.st_size, p))
+   total = sum(e[1] for e in entries)
+   for mtime, size, p in sorted(entries):
+      if total <= max_bytes:
+         break
+      if p == keep:
+         continue
+      try:
+         os.remove(p)
+         total -= size
+      except OSError:
+         pass
+
+
+
+def read_tiled_buffers_whole(filename):
+   '''
+   IIO: tiles, w, h, nch, vmin, vmax = read_tiled_buffers_whole(filename)
+   same as read_tiled_buffers but decodes the whole image with iio first
    '''
    from ctypes import c_int, c_float, c_void_p, POINTER, cast, byref, c_char, memmove, create_string_buffer, sizeof
    
@@ -176,7 +908,8 @@ def read_tiled_buffers(filename):
    nch=c_int()
    
    libiio.iio_read_image_float_vec.restype = c_void_p  # it's like this
-   tptr = libiio.iio_read_image_float_vec(str(filename).encode('ascii'),byref(w),byref(h),byref(nch))
+   with IIO_LOCK:
+      tptr = libiio.iio_read_image_float_vec(str(filename).encode('ascii'),byref(w),byref(h),byref(nch))
    if (tptr == None):
       raise IOError('PIIO: the file %s cannot be read'%(filename))
    c_float_p = POINTER(c_float)       # define a new type of pointer
@@ -198,15 +931,15 @@ def read_tiled_buffers(filename):
    if(nch != out_nch):
       print("piio_read: the input image have %d channels, only the first 4 are loaded\n"%nch)
    # generate several buffers, one for each tile
-   for y in range(0,h, 1024):
-      for x in range(0,w, 1024):
-         ww = min (w - x, 1024)
-         hh = min (h - y, 1024)
+   for y in range(0,h, TILE_SIZE):
+      for x in range(0,w, TILE_SIZE):
+         ww = min (w - x, TILE_SIZE)
+         hh = min (h - y, TILE_SIZE)
          N=ww*hh*out_nch
          # generate the interlan memory to copy the tile
          data = ctypes.ARRAY(ctypes.c_float, N)()
          libiio.copy_tile(ptr, w, h, nch, data, x, y, ww, hh, out_nch)  # only allow up to 4 channels
-         tiles.append( [data, x, y, ww,hh, out_nch, -1] )  # -1 (the last field is a placeholder for the textureID)
+         tiles.append( [data, x, y, ww,hh, out_nch, -1, tile_stats(data, ww, hh, out_nch)] )  # -1 is a placeholder for the textureID
          
 
    # free the memory
@@ -215,9 +948,79 @@ def read_tiled_buffers(filename):
    return (tiles,w,h,out_nch,vmin,vmax)
 
 
-def minmax(data):
+def read_region_buffer(filename, x, y, w, h):
+   '''
+   IIO: float_buffer, nch = read_region_buffer(filename, x, y, w, h)
+   decodes only the rectangle [x,x+w)x[y,y+h) of the image: the tiff
+   tiles or strips intersecting it, the rows up to its last one for PNG
+   and JPEG, and just the required bytes of the uncompressed files
+   the pixels outside the image are 0
+   '''
+   from ctypes import c_int, c_float, c_void_p, POINTER, cast, byref
+
+   if w <= 0 or h <= 0:
+      raise ValueError('PIIO: empty region %dx%d'%(w,h))
+
+   # uncompressed files: copy the region from the mapping
+   m = map_file(filename)
+   if m is not None:
+      mapping, offset, iw, ih, nch, typ, swap = m
+      data = ctypes.ARRAY(ctypes.c_float, w*h*nch)()
+      view = BufferAddress(mapping)
+      try:
+         libiio.piio_copy_tile_mapped(view.address + offset, typ, swap, iw, ih, nch, data, x, y, w, h, nch)
+      finally:
+         view.release()
+         mapping.close()
+      return data, nch
+
+   if hasattr(libiio, 'piio_stream_read_region'):
+      iw=c_int()
+      ih=c_int()
+      nch=c_int()
+      stream = libiio.piio_stream_open(str(filename).encode('ascii'),byref(iw),byref(ih),byref(nch))
+      if stream:
+         try:
+            data = ctypes.ARRAY(ctypes.c_float, w*h*nch.value)()
+            if libiio.piio_stream_read_region(stream, x, y, w, h, data) != 0:
+               raise IOError('PIIO: the file %s cannot be read'%(filename))
+         finally:
+            libiio.piio_stream_close(stream)
+         return data, nch.value
+
+   # other formats: decode the whole image and copy the region
+   iw=c_int()
+   ih=c_int()
+   nch=c_int()
+   libiio.iio_read_image_float_vec.restype = c_void_p  # it's like this
+   with IIO_LOCK:
+      tptr = libiio.iio_read_image_float_vec(str(filename).encode('ascii'),byref(iw),byref(ih),byref(nch))
+   if (tptr == None):
+      raise IOError('PIIO: the file %s cannot be read'%(filename))
+   ptr = cast(tptr, POINTER(c_float))
+   data = ctypes.ARRAY(ctypes.c_float, w*h*nch.value)()
+   libiio.copy_tile(ptr, iw, ih, nch, data, x, y, w, h, nch)
+   libiio.freemem(ptr)
+   return data, nch.value
+
+
+
+def read_region(filename, x, y, w, h):
+   '''
+   IIO: numpyarray = read_region(filename, x, y, w, h)
+   the h x w x nch window of the image starting at column x and row y,
+   see read_region_buffer
+   '''
+   from numpy import ctypeslib
+   data, nch = read_region_buffer(filename, x, y, w, h)
+   return ctypeslib.as_array(data).reshape((h,w,nch))
+
+
+
+def minmax(data, N=None):
    '''
    : minmax(data)
+   : minmax(data, N)  only looks at the first N samples
    '''
    from ctypes import c_int, c_float, POINTER, cast, byref, c_void_p
 
@@ -226,7 +1029,8 @@ def minmax(data):
    vmin=c_float()
    vmax=c_float()
 
-   N = len(data)
+   if N is None:
+      N = len(data)
    dataptr = cast(data,c_float_p)
 
    libiio.minmax.restype = c_void_p  # it's like this
@@ -264,7 +1068,8 @@ def write(filename,data):
 
    iiowrite.restype = None
    iiowrite.argtypes = [c_char_p, ndpointer(c_float),c_int,c_int,c_int]
-   iiowrite(str(filename).encode('ascii'), data.astype('float32'), w, h, nch)
+   with IIO_LOCK:
+      iiowrite(str(filename).encode('ascii'), data.astype('float32'), w, h, nch)
 
 
 def write_buffer_uint8(filename,data,w,h,nch):
@@ -280,7 +1085,8 @@ def write_buffer_uint8(filename,data,w,h,nch):
 
    iiowrite.restype = None
    iiowrite.argtypes = [c_char_p, c_char_p,c_int,c_int,c_int]
-   iiowrite(str(filename).encode('ascii'), data, w, h, nch)
+   with IIO_LOCK:
+      iiowrite(str(filename).encode('ascii'), data, w, h, nch)
 
 #d = piio.read('testimg.tif')
 #print d.shape
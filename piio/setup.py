@@ -7,17 +7,17 @@ def getmodulesetup():
    if os.path.exists('/usr/local/include/libraw') or os.path.exists('/usr/include/libraw'):
       print('LIBRAW detected')
       iiomodule = Extension('libiio',  
-          libraries = ['png','jpeg','tiff','raw'],
+          libraries = ['png','jpeg','tiff','raw','pthread'],
           #language=['c'],
           extra_compile_args = ['-DNDEBUG','-O3', '-DI_USE_LIBRAW'], 
-          sources = ['iio.c','freemem.c','libraw_interface.cpp']
+          sources = ['iio.c','freemem.c','stream.c','stats.c','libraw_interface.cpp']
          )
    else: 
       iiomodule = Extension('libiio',  
-          libraries = ['png','jpeg','tiff'],
+          libraries = ['png','jpeg','tiff','pthread'],
           #language=['c'],
           extra_compile_args = ['-std=gnu99','-DNDEBUG','-O3'], 
-          sources = ['iio.c','freemem.c']
+          sources = ['iio.c','freemem.c','stream.c','stats.c']
          )
    return [iiomodule]
 
@@ -31,14 +31,19 @@ class post_build_ext(build_ext):
       # Call parent build_ext
       build_ext.run(self)
 
-      print "running post_build_ext (copy libiio.so to piio)"
+      print("running post_build_ext (copy libiio.so to piio)")
       # Recover the produced library and copy it to the piio directory
       files = self.get_outputs()
       # the current dir
       import shutil
       current_dir = os.path.dirname(os.path.abspath(__file__))
       for fname in files:
-         shutil.copy(fname, current_dir)
+         # python3 tags the name (libiio.cpython-XY-....so), piio loads libiio.so
+         # replace, don't overwrite: a running process may still map the old one
+         dst = os.path.join(current_dir, 'libiio.so')
+         if os.path.exists(dst):
+            os.remove(dst)
+         shutil.copy(fname, dst)
 
 
 setup(
@@ -0,0 +1,498 @@
+// Image statistics used by piio
+//
+// piio_tile_stats summarizes the samples of a tile (float, or the uint8 and
+// uint16 samples kept by read_tiled_buffers(native=True)): per channel
+// minimum, maximum, number of non-finite samples and a histogram of the
+// finite samples.  The bins of the histograms are the top 16 bits of the
+// samples seen as ordered floats, so all the histograms share the same bins
+// (merging them is adding their counts) and each bin spans less than 1/128
+// of its value, which is plenty for estimating percentiles.
+//
+// A tile only has a few non-empty bins, piio_hist_compact keeps those.
+// piio_hist_merge accumulates them in a full histogram that also lists the
+// bins it uses, so that piio_hist_percentiles reads the percentiles out of
+// those bins only, and leaves the histogram empty for the next merge.
+//
+// piio_block_minmax gives the range of the blocks of a tile, and
+// piio_block_hist their histograms, so that piio_region_hist gets the
+// statistics of any rectangle of the image from the blocks inside it, and
+// only looks at the samples of the blocks on its border.
+
+#include <stdlib.h>
+#include <string.h>
+#include <stdint.h>
+#include <math.h>
+
+#define PIIO_HIST_BINS 65536
+
+// sample types, same numbering as IIO_TYPE_* in iio.c
+#define STATS_TYPE_UINT8 2
+#define STATS_TYPE_UINT16 4
+#define STATS_TYPE_FLOAT 7
+// (not an iio type: the half floats of piio.to_half, see freemem.c)
+#define STATS_TYPE_HALF 16
+void piio_half_to_float(const uint16_t *src, float *dst, size_t n);
+
+// the loops run in parallel, with the row blocks of freemem.c
+#define PIIO_MAX_THREADS 64 // same as freemem.c
+typedef void (*piio_block_fn)(void *ctx, int k, size_t i0, size_t i1);
+int piio_parallel_for(size_t n, size_t work, piio_block_fn fn, void *ctx);
+
+// bin of a finite sample
+static uint32_t hist_bin(float v)
+{
+   uint32_t u;
+   memcpy(&u, &v, sizeof u);
+   u = u & 0x80000000 ? ~u : u | 0x80000000;
+   return u >> 16;
+}
+
+// smallest value of a bin
+static float bin_value(uint32_t b)
+{
+   uint32_t u = b << 16;
+   u = u & 0x80000000 ? u & 0x7fffffff : ~u;
+   float v;
+   memcpy(&v, &u, sizeof v);
+   return v;
+}
+
+int piio_hist_bins(void)
+{
+   return PIIO_HIST_BINS;
+}
+
+struct tile_stats {
+   const void *data;
+   int type, nch;
+   size_t nvalues;   // size of the per channel counts of a block
+   uint32_t *count[PIIO_MAX_THREADS];
+   float *vmin, *vmax;
+   long long *nonfinite;
+};
+
+static void tile_stats_block(void *c, int k, size_t i0, size_t i1)
+{
+   struct tile_stats *t = c;
+   int nch = t->nch;
+   uint32_t *count = t->count[k] = calloc(nch*t->nvalues, sizeof*count);
+   float *vmin = t->vmin + k*nch;
+   float *vmax = t->vmax + k*nch;
+   long long *nonfinite = t->nonfinite + k*nch;
+   if (!count) return;
+   for (int c=0;c<nch;c++) {
+      vmin[c] = +INFINITY;
+      vmax[c] = -INFINITY;
+      nonfinite[c] = 0;
+   }
+   // the integer samples are counted by value (their range and histogram
+   // come out of the counts)
+   if (t->type == STATS_TYPE_UINT8) {
+      const uint8_t *p = (const uint8_t*)t->data + nch*i0;
+      for (size_t i=i0;i<i1;i++)
+      for (int c=0;c<nch;c++)
+         count[c*t->nvalues + *p++]++;
+      return;
+   }
+   if (t->type == STATS_TYPE_UINT16) {
+      const uint16_t *p = (const uint16_t*)t->data + nch*i0;
+      for (size_t i=i0;i<i1;i++)
+      for (int c=0;c<nch;c++)
+         count[c*t->nvalues + *p++]++;
+      return;
+   }
+   const float *p = (const float*)t->data + nch*i0;
+   for (size_t i=i0;i<i1;i++)
+   for (int c=0;c<nch;c++) {
+      float v = *p++;
+      if (!isfinite(v)) {
+         nonfinite[c]++;
+         continue;
+      }
+      if (v < vmin[c]) vmin[c] = v;
+      if (v > vmax[c]) vmax[c] = v;
+      count[c*t->nvalues + hist_bin(v)]++;
+   }
+}
+
+// statistics of the n pixels of a buffer of nch channels, of type 2 (uint8),
+// 4 (uint16) or 7 (float): per channel vmin, vmax and nonfinite, and the
+// histogram of each channel in hist[c*PIIO_HIST_BINS + bin]
+// returns 0, or -1 if out of memory or for the half floats (not read here)
+int piio_tile_stats(const void *data, int type, size_t n, int nch,
+      float *vmin, float *vmax, long long *nonfinite, uint32_t *hist)
+{
+   struct tile_stats t = {data, type, nch};
+   if (type == STATS_TYPE_HALF) return -1;
+   t.nvalues = type == STATS_TYPE_UINT8 ? 256 :
+               type == STATS_TYPE_UINT16 ? 65536 : PIIO_HIST_BINS;
+   t.vmin = malloc(PIIO_MAX_THREADS*nch*sizeof*t.vmin);
+   t.vmax = malloc(PIIO_MAX_THREADS*nch*sizeof*t.vmax);
+   t.nonfinite = malloc(PIIO_MAX_THREADS*nch*sizeof*t.nonfinite);
+   int r = t.vmin && t.vmax && t.nonfinite ? 0 : -1;
+   int nb = r ? 0 : piio_parallel_for(n, n*nch, tile_stats_block, &t);
+
+   memset(hist, 0, nch*PIIO_HIST_BINS*sizeof*hist);
+   for (int c=0;c<nch;c++) {
+      vmin[c] = +INFINITY;
+      vmax[c] = -INFINITY;
+      nonfinite[c] = 0;
+   }
+   for (int k=0;k<nb;k++) {
+      uint32_t *count = t.count[k];
+      if (!count) {
+         r = -1;
+         continue;
+      }
+      for (int c=0;c<nch;c++) {
+         uint32_t *cc = count + c*t.nvalues;
+         uint32_t *h = hist + c*PIIO_HIST_BINS;
+         if (type == STATS_TYPE_FLOAT) {
+            for (int b=0;b<PIIO_HIST_BINS;b++)
+               h[b] += cc[b];
+            vmin[c] = fmin(vmin[c], t.vmin[k*nch+c]);
+            vmax[c] = fmax(vmax[c], t.vmax[k*nch+c]);
+            nonfinite[c] += t.nonfinite[k*nch+c];
+            continue;
+         }
+         for (size_t v=0;v<t.nvalues;v++)
+            if (cc[v]) {
+               h[hist_bin(v)] += cc[v];
+               if (v < vmin[c]) vmin[c] = v;
+               if (v > vmax[c]) vmax[c] = v;
+            }
+      }
+      free(count);
+   }
+   free(t.vmin);
+   free(t.vmax);
+   free(t.nonfinite);
+   return r;
+}
+
+// non-empty bins of the histograms of piio_tile_stats: those of channel c are
+// bins[offsets[c]:offsets[c+1]] with counts[offsets[c]:offsets[c+1]]
+// returns their number (call it with bins = NULL to get only that)
+int piio_hist_compact(const uint32_t *hist, int nch,
+      uint16_t *bins, uint32_t *counts, int *offsets)
+{
+   int n = 0;
+   for (int c=0;c<nch;c++) {
+      if (offsets) offsets[c] = n;
+      const uint32_t *h = hist + c*PIIO_HIST_BINS;
+      for (int b=0;b<PIIO_HIST_BINS;b++)
+         if (h[b]) {
+            if (bins) {
+               bins[n] = b;
+               counts[n] = h[b];
+            }
+            n++;
+         }
+   }
+   if (offsets) offsets[nch] = n;
+   return n;
+}
+
+// the full histograms of piio_hist_merge and piio_region_hist: channel c
+// (and nch for all the channels together) counts its samples in
+// hist[c*PIIO_HIST_BINS + bin], and lists the bins it uses in
+// used[c*PIIO_HIST_BINS + i] for i < nused[c]; all zero when empty
+static void hist_count(long long *hist, uint16_t *used, int *nused, int c,
+      uint32_t b, long long n)
+{
+   long long *h = hist + (size_t)c*PIIO_HIST_BINS;
+   if (!h[b] && n)
+      used[(size_t)c*PIIO_HIST_BINS + nused[c]++] = b;
+   h[b] += n;
+}
+
+// add the histograms of the nch channels of a tile (see piio_hist_compact) to
+// the full histograms of each channel
+void piio_hist_merge(long long *hist, uint16_t *used, int *nused, int nch,
+      const uint16_t *bins, const uint32_t *counts, const int *offsets)
+{
+   for (int c=0;c<nch;c++)
+      for (int i=offsets[c];i<offsets[c+1];i++)
+         hist_count(hist, used, nused, c, bins[i], counts[i]);
+}
+
+// the full histogram of all the channels (channel nch) as the sum of those
+// of the nch channels, call it before piio_hist_percentiles clears them
+void piio_hist_sum(long long *hist, uint16_t *used, int *nused, int nch)
+{
+   for (int c=0;c<nch;c++)
+      for (int i=0;i<nused[c];i++) {
+         uint16_t b = used[(size_t)c*PIIO_HIST_BINS + i];
+         hist_count(hist, used, nused, nch, b, hist[(size_t)c*PIIO_HIST_BINS + b]);
+      }
+}
+
+static int compare_bins(const void *a, const void *b)
+{
+   return *(const uint16_t*)a - *(const uint16_t*)b;
+}
+
+// approximate q[i]-th percentiles (q in [0,100]) of the samples counted in
+// the full histogram of channel c, interpolated within their bin and clamped
+// to [vmin,vmax], in out[i] (NAN for an empty histogram); only the used bins
+// are visited, and they are cleared, so the histogram is empty afterwards
+void piio_hist_percentiles(long long *hist, uint16_t *used, int *nused, int c,
+      const double *q, int nq, float vmin, float vmax, float *out)
+{
+   long long *h = hist + (size_t)c*PIIO_HIST_BINS;
+   uint16_t *u = used + (size_t)c*PIIO_HIST_BINS;
+   int n = nused[c];
+   qsort(u, n, sizeof*u, compare_bins);
+   long long total = 0;
+   for (int i=0;i<n;i++)
+      total += h[u[i]];
+
+   for (int k=0;k<nq;k++) {
+      if (!total) {
+         out[k] = NAN;
+         continue;
+      }
+      double rank = fmin(fmax(q[k], 0), 100) / 100 * total;
+      long long acc = 0;
+      int i = 0;
+      for (;i<n-1;i++) {
+         if (acc + h[u[i]] >= rank)
+            break;
+         acc += h[u[i]];
+      }
+      int b = u[i];
+      double f = (rank - acc) / h[b];
+      double lo = bin_value(b);
+      double hi = b+1 < PIIO_HIST_BINS ? bin_value(b+1) : vmax;
+      if (!isfinite(lo)) lo = vmin;
+      if (!isfinite(hi)) hi = vmax;
+      float v = lo + f*(hi - lo);
+      out[k] = v < vmin ? vmin : v > vmax ? vmax : v;
+   }
+
+   for (int i=0;i<n;i++)
+      h[u[i]] = 0;
+   nused[c] = 0;
+}
+
+struct block_minmax {
+   const void *data;
+   int type, w, h, nch, bs;
+   float *bmin, *bmax;
+};
+
+static float sample_value(const void *data, int type, size_t i)
+{
+   if (type == STATS_TYPE_UINT8) return ((const uint8_t*)data)[i];
+   if (type == STATS_TYPE_UINT16) return ((const uint16_t*)data)[i];
+   return ((const float*)data)[i];
+}
+
+static void block_minmax_rows(void *c, int k, size_t by0, size_t by1)
+{
+   struct block_minmax *t = c;
+   int nch = t->nch, bs = t->bs;
+   int nbx = (t->w + bs - 1) / bs;
+   for (size_t by=by0;by<by1;by++)
+   for (int bx=0;bx<nbx;bx++) {
+      float *bmin = t->bmin + nch*(bx + by*nbx);
+      float *bmax = t->bmax + nch*(bx + by*nbx);
+      for (int c=0;c<nch;c++) {
+         bmin[c] = +INFINITY;
+         bmax[c] = -INFINITY;
+      }
+      int j1 = (by+1)*bs < (size_t)t->h ? (by+1)*bs : t->h;
+      int i1 = (bx+1)*bs < t->w ? (bx+1)*bs : t->w;
+      for (int j=by*bs;j<j1;j++)
+      for (int i=bx*bs;i<i1;i++)
+      for (int c=0;c<nch;c++) {
+         float v = sample_value(t->data, t->type, nch*((size_t)i + (size_t)j*t->w) + c);
+         if (!isfinite(v)) continue;
+         if (v < bmin[c]) bmin[c] = v;
+         if (v > bmax[c]) bmax[c] = v;
+      }
+   }
+}
+
+// minimum and maximum of the finite samples of each channel in the bs x bs
+// blocks of a w x h buffer (same types as piio_tile_stats), in
+// bmin[c + nch*(bx + by*nbx)], where nbx is the number of blocks in a row
+void piio_block_minmax(const void *data, int type, int w, int h, int nch,
+      int bs, float *bmin, float *bmax)
+{
+   struct block_minmax t = {data, type, w, h, nch, bs, bmin, bmax};
+   if (w <= 0 || h <= 0 || bs <= 0 || type == STATS_TYPE_HALF) return;
+   int nby = (h + bs - 1) / bs;
+   piio_parallel_for(nby, (size_t)w*h*nch, block_minmax_rows, &t);
+}
+
+struct block_hist {
+   const void *data;
+   int type, w, h, nch, bs;
+   int *offsets;
+   uint16_t *bins, *counts;
+   const uint16_t *lut;   // bin of each value of the integer types
+   uint16_t *scratch[PIIO_MAX_THREADS];
+};
+
+// counts the samples of each channel of a block by bin: channel c of block k
+// writes its bins from (k*nch+c)*bs*bs, and their number in offsets[k*nch+c+1]
+static void block_hist_rows(void *c, int k, size_t by0, size_t by1)
+{
+   struct block_hist *t = c;
+   int nch = t->nch, bs = t->bs;
+   int nbx = (t->w + bs - 1) / bs;
+   // count[ch*PIIO_HIST_BINS + bin] and the list of the bins seen in the
+   // block, seen[ch*bs*bs + l] for l < n[ch]
+   uint16_t *count = t->scratch[k] = calloc((size_t)nch*(PIIO_HIST_BINS + bs*bs), sizeof*count);
+   uint16_t *seen = count + (size_t)nch*PIIO_HIST_BINS;
+   int *n = malloc(nch*sizeof*n);
+   if (!count || !n) {
+      free(n);
+      return;
+   }
+   for (size_t by=by0;by<by1;by++)
+   for (int bx=0;bx<nbx;bx++) {
+      int j1 = (by+1)*bs < (size_t)t->h ? (by+1)*bs : t->h;
+      int i1 = (bx+1)*bs < t->w ? (bx+1)*bs : t->w;
+      for (int ch=0;ch<nch;ch++)
+         n[ch] = 0;
+      for (int j=by*bs;j<j1;j++) {
+         size_t first = nch*((size_t)bx*bs + (size_t)j*t->w), last = nch*((size_t)i1 + (size_t)j*t->w);
+         for (size_t i=first, ch=0;i<last;i++, ch = ch+1 < (size_t)nch ? ch+1 : 0) {
+            uint32_t b;
+            if (t->type == STATS_TYPE_UINT8)
+               b = t->lut[((const uint8_t*)t->data)[i]];
+            else if (t->type == STATS_TYPE_UINT16)
+               b = t->lut[((const uint16_t*)t->data)[i]];
+            else {
+               float v = ((const float*)t->data)[i];
+               if (!isfinite(v)) continue;
+               b = hist_bin(v);
+            }
+            if (!count[ch*PIIO_HIST_BINS + b]++)
+               seen[ch*bs*bs + n[ch]++] = b;
+         }
+      }
+      for (int ch=0;ch<nch;ch++) {
+         size_t kc = (bx + by*nbx)*nch + ch;
+         uint16_t *cc = count + ch*PIIO_HIST_BINS, *sc = seen + ch*bs*bs;
+         t->offsets[kc+1] = n[ch];
+         for (int l=0;l<n[ch];l++) {
+            t->bins[kc*bs*bs+l] = sc[l];
+            t->counts[kc*bs*bs+l] = cc[sc[l]];
+            cc[sc[l]] = 0;
+         }
+      }
+   }
+   free(n);
+}
+
+// histograms of the bs x bs blocks of a w x h buffer (same types and bins as
+// piio_tile_stats, and same block numbering as piio_block_minmax): channel c
+// of block k has the bins and counts in offsets[k*nch+c]:offsets[k*nch+c+1]
+// bins and counts must have room for nblocks*nch*bs*bs values (they are
+// packed at the beginning); bs is at most 255, so that the counts of a block
+// fit in 16 bits
+// returns the number of bins, or -1 if out of memory (or bs is too large, or
+// the samples are half floats)
+int piio_block_hist(const void *data, int type, int w, int h, int nch, int bs,
+      int *offsets, uint16_t *bins, uint16_t *counts)
+{
+   struct block_hist t = {data, type, w, h, nch, bs, offsets, bins, counts};
+   if (bs <= 0 || bs > 255 || type == STATS_TYPE_HALF) return -1;
+   offsets[0] = 0;
+   if (w <= 0 || h <= 0) return 0;
+   int nby = (h + bs - 1) / bs;
+   int nblocks = (w + bs - 1) / bs * nby;
+   uint16_t *lut = NULL;
+   if (type == STATS_TYPE_UINT8 || type == STATS_TYPE_UINT16) {
+      int nvalues = type == STATS_TYPE_UINT8 ? 256 : 65536;
+      if (!(lut = malloc(nvalues*sizeof*lut))) return -1;
+      for (int v=0;v<nvalues;v++)
+         lut[v] = hist_bin(v);
+      t.lut = lut;
+   }
+   int nb = piio_parallel_for(nby, (size_t)w*h*nch, block_hist_rows, &t);
+   free(lut);
+   int r = 0;
+   for (int k=0;k<nb;k++) {
+      if (!t.scratch[k]) r = -1;
+      free(t.scratch[k]);
+   }
+   if (r) return r;
+   for (int kc=0;kc<nblocks*nch;kc++) {
+      memmove(bins + offsets[kc], bins + (size_t)kc*bs*bs, offsets[kc+1]*sizeof*bins);
+      memmove(counts + offsets[kc], counts + (size_t)kc*bs*bs, offsets[kc+1]*sizeof*counts);
+      offsets[kc+1] += offsets[kc];
+   }
+   return offsets[nblocks*nch];
+}
+
+// adds the samples of the rectangle [x0,x1)x[y0,y1) of a w x h tile (of one
+// of the types of piio_tile_stats, or of half floats) to the full histograms
+// of each channel (see piio_hist_merge), and updates the per channel vmin,
+// vmax and count of
+// finite samples: the blocks inside the rectangle are taken from bmin, bmax
+// (piio_block_minmax) and from their histograms (piio_block_hist), only the
+// samples of the blocks on its border are read
+void piio_region_hist(const void *data, int type, int w, int h, int nch, int bs,
+      const float *bmin, const float *bmax, const int *offsets,
+      const uint16_t *bins, const uint16_t *counts,
+      int x0, int y0, int x1, int y1, long long *hist, uint16_t *used,
+      int *nused, float *vmin, float *vmax, long long *count)
+{
+   x0 = x0 < 0 ? 0 : x0;   x1 = x1 > w ? w : x1;
+   y0 = y0 < 0 ? 0 : y0;   y1 = y1 > h ? h : y1;
+   if (x0 >= x1 || y0 >= y1 || bs <= 0) return;
+   int nbx = (w + bs - 1) / bs;
+   float *row = malloc(bs*nch*sizeof*row);
+   if (!row) return;
+   for (int by=y0/bs;by<=(y1-1)/bs;by++)
+   for (int bx=x0/bs;bx<=(x1-1)/bs;bx++) {
+      int bi0 = bx*bs, bi1 = bi0+bs < w ? bi0+bs : w;
+      int bj0 = by*bs, bj1 = bj0+bs < h ? bj0+bs : h;
+      size_t k = bx + (size_t)by*nbx;
+      if (x0 <= bi0 && bi1 <= x1 && y0 <= bj0 && bj1 <= y1) {
+         for (int c=0;c<nch;c++) {
+            for (int l=offsets[k*nch+c];l<offsets[k*nch+c+1];l++) {
+               hist_count(hist, used, nused, c, bins[l], counts[l]);
+               count[c] += counts[l];
+            }
+            if (bmin[k*nch+c] < vmin[c]) vmin[c] = bmin[k*nch+c];
+            if (bmax[k*nch+c] > vmax[c]) vmax[c] = bmax[k*nch+c];
+         }
+         continue;
+      }
+      // a block on the border: its samples inside the rectangle
+      int i0 = bi0 > x0 ? bi0 : x0, i1 = bi1 < x1 ? bi1 : x1;
+      int j0 = bj0 > y0 ? bj0 : y0, j1 = bj1 < y1 ? bj1 : y1;
+      for (int j=j0;j<j1;j++) {
+         size_t first = nch*((size_t)i0 + (size_t)j*w), n = (size_t)nch*(i1-i0);
+         if (type == STATS_TYPE_HALF)
+            piio_half_to_float((const uint16_t*)data + first, row, n);
+         else if (type == STATS_TYPE_UINT8)
+            for (size_t i=0;i<n;i++) row[i] = ((const uint8_t*)data)[first + i];
+         else if (type == STATS_TYPE_UINT16)
+            for (size_t i=0;i<n;i++) row[i] = ((const uint16_t*)data)[first + i];
+         else
+            memcpy(row, (const float*)data + first, n*sizeof*row);
+         for (int c=0;c<nch;c++) {
+            long long cnt = 0;
+            float lo = vmin[c], hi = vmax[c];
+            for (size_t i=c;i<n;i+=nch) {
+               float v = row[i];
+               if (!isfinite(v)) continue;
+               hist_count(hist, used, nused, c, hist_bin(v), 1);
+               cnt++;
+               lo = v < lo ? v : lo;
+               hi = v > hi ? v : hi;
+            }
+            count[c] += cnt;
+            vmin[c] = lo;
+            vmax[c] = hi;
+         }
+      }
+   }
+   free(row);
+}
@@ -0,0 +1,940 @@
+// Streaming (band by band) image readers used by piio
+//
+// The iio readers decode the whole image into a single buffer.  For very
+// large images piio only needs a few rows at a time (one band of tiles), so
+// the formats that can be decoded in scanline order (PNG, JPEG, TIFF, the
+// binary PNM/PFM, FLO and explicit RAW[...]: files) are read here row by row.
+// Any other file is rejected by piio_stream_open and the caller falls back to
+// the iio readers.
+//
+// piio_stream_read_region decodes only a rectangle of the image: the tiff
+// strips or tiles that intersect it, or the rows up to its last one for the
+// other formats (skipping the rows above it when the format allows it).
+//
+// When the rows are stored verbatim in the file (PNM, PFM, FLO, RAW and
+// uncompressed stripped TIFF) piio_stream_layout tells where, so that piio can
+// map the file instead of reading it.  piio_copy_tile_mapped and
+// piio_minmax_mapped work directly on such a mapping.
+//
+// The samples produced are the same as those of iio_read_image_float_vec.
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <strings.h> // strcasecmp, strncasecmp
+#include <stdint.h>
+#include <ctype.h>
+#include <setjmp.h>
+#include <math.h>
+
+//
+// editable configuration (same switches as iio.c)
+//
+#define I_CAN_HAS_LIBPNG
+#define I_CAN_HAS_LIBJPEG
+#define I_CAN_HAS_LIBTIFF
+
+#ifdef IIO_DISABLE_IMGLIBS
+#undef I_CAN_HAS_LIBPNG
+#undef I_CAN_HAS_LIBJPEG
+#undef I_CAN_HAS_LIBTIFF
+#endif
+
+#ifdef I_CAN_HAS_LIBPNG
+#  include <png.h>
+#endif
+#ifdef I_CAN_HAS_LIBJPEG
+#  include <jpeglib.h>
+#endif
+#ifdef I_CAN_HAS_LIBTIFF
+#  include <tiffio.h>
+#endif
+
+// sample types, same numbering as IIO_TYPE_* in iio.c
+#define STREAM_TYPE_INT8 1
+#define STREAM_TYPE_UINT8 2
+#define STREAM_TYPE_INT16 3
+#define STREAM_TYPE_UINT16 4
+#define STREAM_TYPE_INT32 5
+#define STREAM_TYPE_UINT32 6
+#define STREAM_TYPE_FLOAT 7
+#define STREAM_TYPE_DOUBLE 8
+
+#define STREAM_PNG 1
+#define STREAM_JPEG 2
+#define STREAM_TIFF 3
+#define STREAM_PNM 4
+#define STREAM_PFM 5
+#define STREAM_FLO 6
+#define STREAM_RAW 7
+
+#ifdef I_CAN_HAS_LIBJPEG
+struct stream_jpeg_error {
+   struct jpeg_error_mgr pub;
+   jmp_buf jmp;
+};
+#endif
+
+struct piio_stream {
+   int format;          // STREAM_*
+   int w, h, nch;       // image size and samples per pixel
+   int type;            // STREAM_TYPE_* of the decoded samples
+   int swap;            // the samples must be byte swapped
+   int row;             // index of the next row to be decoded
+   size_t rowbytes;     // size of one decoded row
+   uint8_t *raw;        // one decoded row
+   FILE *f;
+   long offset;         // position of the first row in f (-1 if unknown)
+
+#ifdef I_CAN_HAS_LIBPNG
+   png_structp png;
+   png_infop pnginfo;
+#endif
+#ifdef I_CAN_HAS_LIBJPEG
+   struct jpeg_decompress_struct jpeg;
+   struct stream_jpeg_error jerr;
+   int jpeg_started;
+   int jpeg_x0;         // first column of the decoded rows (when cropped)
+#endif
+#ifdef I_CAN_HAS_LIBTIFF
+   TIFF *tif;
+   int tile_w, tile_h;  // tiled tiff: size of the tiles
+   uint8_t *tile;       // tiled tiff: one tile
+   uint8_t *band;       // tiled tiff: one row of tiles
+   int band_y0;         // tiled tiff: first row stored in band (-1 if none)
+#endif
+};
+
+static int host_is_little_endian(void)
+{
+   uint16_t x = 1;
+   return *(uint8_t*)&x;
+}
+
+static size_t stream_type_size(int type)
+{
+   switch (type) {
+   case STREAM_TYPE_INT8:   case STREAM_TYPE_UINT8:  return 1;
+   case STREAM_TYPE_INT16:  case STREAM_TYPE_UINT16: return 2;
+   case STREAM_TYPE_INT32:  case STREAM_TYPE_UINT32: return 4;
+   case STREAM_TYPE_FLOAT:  return 4;
+   case STREAM_TYPE_DOUBLE: return 8;
+   }
+   return 0;
+}
+
+static uint16_t swap_2bytes(uint16_t v)
+{
+   return (uint16_t)((v >> 8) | (v << 8));
+}
+
+static uint32_t swap_4bytes(uint32_t v)
+{
+   return (v >> 24) | ((v >> 8) & 0xff00) | ((v << 8) & 0xff0000) | (v << 24);
+}
+
+static uint64_t swap_8bytes(uint64_t v)
+{
+   return ((uint64_t)swap_4bytes((uint32_t)v) << 32) | swap_4bytes((uint32_t)(v >> 32));
+}
+
+static void swap_samples(uint8_t *p, int n, size_t ss)
+{
+   for (int i = 0; i < n; i++, p += ss)
+      for (size_t k = 0; k < ss/2; k++) {
+         uint8_t t = p[k];
+         p[k] = p[ss-1-k];
+         p[ss-1-k] = t;
+      }
+}
+
+// the source samples may be unaligned (they can come from a mapped file)
+static void convert_row_to_float(float *dst, const uint8_t *src, int n,
+      int type, int swap)
+{
+   switch (type) {
+   case STREAM_TYPE_UINT8:
+      for (int i=0;i<n;i++) dst[i] = src[i];
+      break;
+   case STREAM_TYPE_INT8:
+      for (int i=0;i<n;i++) dst[i] = (int8_t)src[i];
+      break;
+   case STREAM_TYPE_UINT16:
+   case STREAM_TYPE_INT16:
+      for (int i=0;i<n;i++) {
+         uint16_t v;
+         memcpy(&v, src + 2*i, 2);
+         if (swap) v = swap_2bytes(v);
+         dst[i] = type == STREAM_TYPE_UINT16 ? (float)v : (float)(int16_t)v;
+      }
+      break;
+   case STREAM_TYPE_UINT32:
+   case STREAM_TYPE_INT32:
+      for (int i=0;i<n;i++) {
+         uint32_t v;
+         memcpy(&v, src + 4*i, 4);
+         if (swap) v = swap_4bytes(v);
+         dst[i] = type == STREAM_TYPE_UINT32 ? (float)v : (float)(int32_t)v;
+      }
+      break;
+   case STREAM_TYPE_FLOAT:
+      memcpy(dst, src, n*sizeof(float));
+      if (swap)
+         for (int i=0;i<n;i++) {
+            uint32_t v;
+            memcpy(&v, dst + i, 4);
+            v = swap_4bytes(v);
+            memcpy(dst + i, &v, 4);
+         }
+      break;
+   case STREAM_TYPE_DOUBLE:
+      for (int i=0;i<n;i++) {
+         uint64_t v;
+         double d;
+         memcpy(&v, src + 8*i, 8);
+         if (swap) v = swap_8bytes(v);
+         memcpy(&d, &v, 8);
+         dst[i] = d;
+      }
+      break;
+   }
+}
+
+
+// PNM and PFM (binary variants only)
+
+static int pnm_skip_spaces_and_comments(FILE *f)
+{
+   int c;
+   while ((c = fgetc(f)) != EOF) {
+      if (c == '#')
+         while ((c = fgetc(f)) != EOF && c != '\n');
+      else if (!isspace(c))
+         return ungetc(c, f);
+   }
+   return EOF;
+}
+
+static int open_pnm(struct piio_stream *s, int kind)
+{
+   int maxval;
+   if (pnm_skip_spaces_and_comments(s->f) == EOF || 1 != fscanf(s->f, "%d", &s->w)) return -1;
+   if (pnm_skip_spaces_and_comments(s->f) == EOF || 1 != fscanf(s->f, "%d", &s->h)) return -1;
+   if (pnm_skip_spaces_and_comments(s->f) == EOF || 1 != fscanf(s->f, "%d", &maxval)) return -1;
+   if (!isspace(fgetc(s->f))) return -1;
+   s->nch  = kind == '6' ? 3 : 1;
+   s->type = maxval < 256 ? STREAM_TYPE_UINT8 : STREAM_TYPE_UINT16;
+   s->swap = s->type == STREAM_TYPE_UINT16 && host_is_little_endian(); // big endian samples
+   s->offset = ftell(s->f);
+   return 0;
+}
+
+static int open_pfm(struct piio_stream *s, int kind)
+{
+   // same parsing as read_beheaded_pfm, the rows are delivered as stored
+   float scale;
+   if (!isspace(fgetc(s->f))) return -1;
+   if (3 != fscanf(s->f, "%d %d\n%g", &s->w, &s->h, &scale)) return -1;
+   if (!isspace(fgetc(s->f))) return -1;
+   s->nch  = kind == 'F' ? 3 : 1;
+   s->type = STREAM_TYPE_FLOAT;
+   s->offset = ftell(s->f);
+   return 0;
+}
+
+static int open_flo(struct piio_stream *s)
+{
+   // "PIEH", then width and height as little endian 32 bit integers
+   uint8_t b[12];
+   if (1 != fread(b, 12, 1, s->f)) return -1;
+   s->w = b[4] | b[5] << 8 | b[6] << 16 | (uint32_t)b[7] << 24;
+   s->h = b[8] | b[9] << 8 | b[10] << 16 | (uint32_t)b[11] << 24;
+   s->nch  = 2;
+   s->type = STREAM_TYPE_FLOAT;
+   s->offset = 12;
+   return 0;
+}
+
+static int raw_type(const char *name, size_t n)
+{
+   static const struct { const char *name; int type; } t[] = {
+      {"INT8",   STREAM_TYPE_INT8},   {"UINT8",  STREAM_TYPE_UINT8},
+      {"INT16",  STREAM_TYPE_INT16},  {"UINT16", STREAM_TYPE_UINT16},
+      {"INT32",  STREAM_TYPE_INT32},  {"UINT32", STREAM_TYPE_UINT32},
+      {"FLOAT",  STREAM_TYPE_FLOAT},  {"DOUBLE", STREAM_TYPE_DOUBLE},
+   };
+   for (size_t i = 0; i < sizeof t / sizeof *t; i++)
+      if (strlen(t[i].name) == n && !strncasecmp(name, t[i].name, n))
+         return t[i].type;
+   return 0;
+}
+
+// explicit raw files "RAW[w640,h480,p3,tuint16]:file" as read_raw_named_image
+// only the fields w, h, p (or d), o, e and t are handled here, the
+// descriptions using any other field are left to iio
+static int open_raw(struct piio_stream *s, const char *desc, size_t ndesc)
+{
+   int w = -1, h = -1, pd = 1, e = 0, o = -1;
+   int type = STREAM_TYPE_UINT8;
+   const char *p = desc, *end = desc + ndesc;
+   while (p < end) {
+      size_t n = strcspn(p, ",]");
+      if (n > (size_t)(end - p)) n = end - p;
+      if (n < 2) return -1;
+      if (*p == 't') {
+         if (!(type = raw_type(p + 1, n - 1))) return -1;
+      } else {
+         char *q;
+         long v = strtol(p + 1, &q, 10);
+         if (q != p + n) return -1;
+         switch (*p) {
+         case 'w': w  = v; break;
+         case 'h': h  = v; break;
+         case 'd':
+         case 'p': pd = v; break;
+         case 'o': o  = v; break;
+         case 'e': e  = v; break;
+         default: return -1;
+         }
+      }
+      p += n + 1;
+   }
+
+   // estimate the missing dimensions, as in read_raw_named_image
+   long ss = stream_type_size(type);
+   if (fseek(s->f, 0, SEEK_END)) return -1;
+   long file_size = ftell(s->f);
+   if (pd <= 0) return -1;
+   if (o < 0 && w > 0 && h > 0)
+      o = file_size - (long)w * h * pd * ss;
+   if (w < 0 && o > 0 && h > 0)
+      w = (file_size - o)/(h * pd * ss);
+   if (h < 0 && o > 0 && w > 0)
+      h = (file_size - o)/(w * pd * ss);
+   if (o < 0) o = 0;
+   if (h < 0 && w > 0) h = file_size/(w * pd * ss);
+   if (w < 0 && h > 0) w = file_size/(h * pd * ss);
+   if (w <= 0 || h <= 0) return -1;
+   if (o + (long)w * h * pd * ss > file_size) return -1;
+   // iio swaps the 8 byte samples as two 4 byte halves
+   if (e && type == STREAM_TYPE_DOUBLE) return -1;
+
+   s->w = w;
+   s->h = h;
+   s->nch = pd;
+   s->type = type;
+   s->swap = e && ss > 1;
+   s->offset = o;
+   return fseek(s->f, o, SEEK_SET);
+}
+
+static int read_row_file(struct piio_stream *s, uint8_t *out)
+{
+   return 1 == fread(out, s->rowbytes, 1, s->f) ? 0 : -1;
+}
+
+
+// PNG
+
+#ifdef I_CAN_HAS_LIBPNG
+static int open_png(struct piio_stream *s)
+{
+   s->png = png_create_read_struct(PNG_LIBPNG_VER_STRING, 0, 0, 0);
+   if (!s->png) return -1;
+   s->pnginfo = png_create_info_struct(s->png);
+   if (!s->pnginfo) return -1;
+   if (setjmp(png_jmpbuf(s->png))) return -1;
+   png_init_io(s->png, s->f);
+   png_read_info(s->png, s->pnginfo);
+   // interlaced images can not be decoded one row at a time
+   if (png_get_interlace_type(s->png, s->pnginfo) != PNG_INTERLACE_NONE)
+      return -1;
+   // same transforms as read_beheaded_png: PNG_TRANSFORM_EXPAND|PACKING
+   png_set_expand(s->png);
+   png_set_packing(s->png);
+   if (png_get_bit_depth(s->png, s->pnginfo) == 16 && host_is_little_endian())
+      png_set_swap(s->png);
+   png_read_update_info(s->png, s->pnginfo);
+   s->w    = png_get_image_width(s->png, s->pnginfo);
+   s->h    = png_get_image_height(s->png, s->pnginfo);
+   s->nch  = png_get_channels(s->png, s->pnginfo);
+   s->type = png_get_bit_depth(s->png, s->pnginfo) == 16 ?
+                STREAM_TYPE_UINT16 : STREAM_TYPE_UINT8;
+   if (png_get_rowbytes(s->png, s->pnginfo) != (size_t)s->w*s->nch*stream_type_size(s->type))
+      return -1;
+   return 0;
+}
+
+static int read_row_png(struct piio_stream *s, uint8_t *out)
+{
+   if (setjmp(png_jmpbuf(s->png))) return -1;
+   png_read_row(s->png, out, NULL);
+   return 0;
+}
+#endif//I_CAN_HAS_LIBPNG
+
+
+// JPEG
+
+#ifdef I_CAN_HAS_LIBJPEG
+static void on_stream_jpeg_error(j_common_ptr cinfo)
+{
+   struct stream_jpeg_error *e = (struct stream_jpeg_error *)cinfo->err;
+   (*cinfo->err->output_message)(cinfo);
+   longjmp(e->jmp, 1);
+}
+
+static int open_jpeg(struct piio_stream *s)
+{
+   s->jpeg.err = jpeg_std_error(&s->jerr.pub);
+   s->jerr.pub.error_exit = on_stream_jpeg_error;
+   if (setjmp(s->jerr.jmp)) return -1;
+   jpeg_create_decompress(&s->jpeg);
+   s->jpeg_started = 1;
+   jpeg_stdio_src(&s->jpeg, s->f);
+   jpeg_read_header(&s->jpeg, 1);
+   jpeg_start_decompress(&s->jpeg);
+   s->w    = s->jpeg.output_width;
+   s->h    = s->jpeg.output_height;
+   s->nch  = s->jpeg.output_components;
+   s->type = STREAM_TYPE_UINT8;
+   return 0;
+}
+
+static int read_row_jpeg(struct piio_stream *s, uint8_t *out)
+{
+   if (setjmp(s->jerr.jmp)) return -1;
+   JSAMPROW scanline[1] = { out };
+   return 1 == jpeg_read_scanlines(&s->jpeg, scanline, 1) ? 0 : -1;
+}
+
+// restrict the decoding to the columns [x0,x0+w) and the rows from y0
+// (libjpeg-turbo only, otherwise the whole rows are decoded)
+static int crop_jpeg(struct piio_stream *s, int x0, int w, int y0)
+{
+#ifdef LIBJPEG_TURBO_VERSION_NUMBER
+   if (setjmp(s->jerr.jmp)) return -1;
+   // one more iMCU on the right, so that the upsampling of the last column
+   // sees the same neighbours as in the full decoding
+   int x1 = x0 + w + s->jpeg.max_h_samp_factor * DCTSIZE;
+   JDIMENSION xoffset = x0, width = (x1 < s->w ? x1 : s->w) - x0;
+   jpeg_crop_scanline(&s->jpeg, &xoffset, &width);
+   s->jpeg_x0 = xoffset;
+   if (y0 > s->row)
+      s->row += jpeg_skip_scanlines(&s->jpeg, y0 - s->row);
+#endif
+   return 0;
+}
+#endif//I_CAN_HAS_LIBJPEG
+
+
+// TIFF
+
+#ifdef I_CAN_HAS_LIBTIFF
+static int open_tiff(struct piio_stream *s, const char *fname)
+{
+   uint32_t w, h;
+   uint16_t spp, bps, fmt, planarity;
+   TIFFSetWarningHandler(NULL);//suppress warnings
+   s->tif = TIFFOpen(fname, "r");
+   if (!s->tif) return -1;
+   if (!TIFFGetField(s->tif, TIFFTAG_IMAGEWIDTH, &w)) return -1;
+   if (!TIFFGetField(s->tif, TIFFTAG_IMAGELENGTH, &h)) return -1;
+   if (!TIFFGetField(s->tif, TIFFTAG_SAMPLESPERPIXEL, &spp)) spp = 1;
+   if (!TIFFGetField(s->tif, TIFFTAG_BITSPERSAMPLE, &bps)) bps = 1;
+   if (!TIFFGetField(s->tif, TIFFTAG_SAMPLEFORMAT, &fmt)) fmt = SAMPLEFORMAT_UINT;
+   if (!TIFFGetField(s->tif, TIFFTAG_PLANARCONFIG, &planarity))
+      planarity = PLANARCONFIG_CONTIG;
+
+   // the separate planes and the packed bits are left to read_whole_tiff
+   if (planarity != PLANARCONFIG_CONTIG || bps < 8) return -1;
+
+   // complex samples are read as pairs of reals, as in read_whole_tiff
+   if (fmt == SAMPLEFORMAT_COMPLEXINT || fmt == SAMPLEFORMAT_COMPLEXIEEEFP) {
+      spp *= 2;
+      bps /= 2;
+   }
+   if (fmt == SAMPLEFORMAT_COMPLEXINT   ) fmt = SAMPLEFORMAT_INT;
+   if (fmt == SAMPLEFORMAT_COMPLEXIEEEFP) fmt = SAMPLEFORMAT_IEEEFP;
+
+   if      (fmt == SAMPLEFORMAT_UINT   && bps ==  8) s->type = STREAM_TYPE_UINT8;
+   else if (fmt == SAMPLEFORMAT_UINT   && bps == 16) s->type = STREAM_TYPE_UINT16;
+   else if (fmt == SAMPLEFORMAT_UINT   && bps == 32) s->type = STREAM_TYPE_UINT32;
+   else if (fmt == SAMPLEFORMAT_INT    && bps ==  8) s->type = STREAM_TYPE_INT8;
+   else if (fmt == SAMPLEFORMAT_INT    && bps == 16) s->type = STREAM_TYPE_INT16;
+   else if (fmt == SAMPLEFORMAT_INT    && bps == 32) s->type = STREAM_TYPE_INT32;
+   else if (fmt == SAMPLEFORMAT_IEEEFP && bps == 32) s->type = STREAM_TYPE_FLOAT;
+   else if (fmt == SAMPLEFORMAT_IEEEFP && bps == 64) s->type = STREAM_TYPE_DOUBLE;
+   else return -1;
+
+   s->w = w;
+   s->h = h;
+   s->nch = spp;
+
+   if (TIFFIsTiled(s->tif)) {
+      uint32_t tw, th;
+      TIFFGetField(s->tif, TIFFTAG_TILEWIDTH, &tw);
+      TIFFGetField(s->tif, TIFFTAG_TILELENGTH, &th);
+      s->tile_w = tw;
+      s->tile_h = th;
+      if (TIFFTileSize(s->tif) != (tmsize_t)tw*th*spp*(bps/8)) return -1;
+      s->rowbytes = (size_t)w*spp*(bps/8);
+      s->tile = malloc(TIFFTileSize(s->tif));
+      s->band = malloc(s->rowbytes*th);
+      s->band_y0 = -1;
+      if (!s->tile || !s->band) return -1;
+   } else if (TIFFScanlineSize(s->tif) != (tmsize_t)w*spp*(bps/8))
+      return -1;
+   return 0;
+}
+
+// decode the row of tiles containing row j
+static int load_tiff_band(struct piio_stream *s, int j)
+{
+   int y0 = j - j % s->tile_h;
+   size_t ps = (size_t)s->nch * stream_type_size(s->type);
+   for (int x0 = 0; x0 < s->w; x0 += s->tile_w) {
+      if (TIFFReadTile(s->tif, s->tile, x0, y0, 0, 0) < 0) return -1;
+      int cw = s->w - x0 < s->tile_w ? s->w - x0 : s->tile_w;
+      for (int i = 0; i < s->tile_h && y0 + i < s->h; i++)
+         memcpy(s->band + i*s->rowbytes + x0*ps,
+                s->tile + (size_t)i*s->tile_w*ps, cw*ps);
+   }
+   s->band_y0 = y0;
+   return 0;
+}
+
+static int read_row_tiff(struct piio_stream *s, uint8_t *out)
+{
+   if (!s->tile)
+      return TIFFReadScanline(s->tif, out, s->row, 0) < 0 ? -1 : 0;
+   if (s->band_y0 < 0 || s->row >= s->band_y0 + s->tile_h)
+      if (load_tiff_band(s, s->row)) return -1;
+   memcpy(out, s->band + (s->row - s->band_y0)*s->rowbytes, s->rowbytes);
+   return 0;
+}
+
+// decode the tiles or strips intersecting [cx0,cx1)x[cy0,cy1) into the
+// region [x0,x0+w)x(y0,...) stored at dst
+static int read_region_tiff(struct piio_stream *s, float *dst, int x0, int y0,
+      int w, int cx0, int cy0, int cx1, int cy1)
+{
+   size_t ps = (size_t)s->nch * stream_type_size(s->type);
+   if (s->tile) {
+      int tw = s->tile_w, th = s->tile_h;
+      for (int ty = cy0 - cy0 % th; ty < cy1; ty += th)
+      for (int tx = cx0 - cx0 % tw; tx < cx1; tx += tw) {
+         if (TIFFReadTile(s->tif, s->tile, tx, ty, 0, 0) < 0) return -1;
+         int ix0 = tx > cx0 ? tx : cx0, ix1 = tx + tw < cx1 ? tx + tw : cx1;
+         int iy0 = ty > cy0 ? ty : cy0, iy1 = ty + th < cy1 ? ty + th : cy1;
+         for (int j = iy0; j < iy1; j++)
+            convert_row_to_float(dst + ((size_t)(j - y0)*w + ix0 - x0)*s->nch,
+                  s->tile + ((size_t)(j - ty)*tw + ix0 - tx)*ps,
+                  (ix1 - ix0)*s->nch, s->type, 0);
+      }
+      return 0;
+   }
+
+   uint32_t rps;
+   if (!TIFFGetField(s->tif, TIFFTAG_ROWSPERSTRIP, &rps) || rps > (uint32_t)s->h)
+      rps = s->h;
+   uint8_t *strip = malloc(TIFFStripSize(s->tif));
+   if (!strip) return -1;
+   for (int j0 = cy0 - cy0 % rps; j0 < cy1; j0 += rps) {
+      if (TIFFReadEncodedStrip(s->tif, TIFFComputeStrip(s->tif, j0, 0),
+               strip, (tmsize_t)-1) < 0)
+         return (free(strip), -1);
+      int iy0 = j0 > cy0 ? j0 : cy0, iy1 = j0 + (int)rps < cy1 ? j0 + rps : cy1;
+      for (int j = iy0; j < iy1; j++)
+         convert_row_to_float(dst + ((size_t)(j - y0)*w + cx0 - x0)*s->nch,
+               strip + (j - j0)*s->rowbytes + cx0*ps,
+               (cx1 - cx0)*s->nch, s->type, 0);
+   }
+   free(strip);
+   return 0;
+}
+#endif//I_CAN_HAS_LIBTIFF
+
+
+// API
+
+void piio_stream_close(void *p)
+{
+   struct piio_stream *s = p;
+   if (!s) return;
+#ifdef I_CAN_HAS_LIBPNG
+   if (s->png) png_destroy_read_struct(&s->png, &s->pnginfo, NULL);
+#endif
+#ifdef I_CAN_HAS_LIBJPEG
+   if (s->jpeg_started) jpeg_destroy_decompress(&s->jpeg);
+#endif
+#ifdef I_CAN_HAS_LIBTIFF
+   if (s->tif) TIFFClose(s->tif);
+   free(s->tile);
+   free(s->band);
+#endif
+   if (s->f) fclose(s->f);
+   free(s->raw);
+   free(s);
+}
+
+// returns NULL if the file can not be streamed (the caller must fall back to
+// the iio readers), otherwise a handle for piio_stream_read_rows
+void *piio_stream_open(const char *fname, int *w, int *h, int *nch)
+{
+   uint8_t b[8] = {0};
+   if (!fname || !strcmp(fname, "-")) return NULL;
+   struct piio_stream *s = calloc(1, sizeof*s);
+   if (!s) return NULL;
+   s->offset = -1;
+
+   int r = -1;
+   const char *colon = strchr(fname, ':');
+   if (!strncmp(fname, "RAW[", 4) && colon && colon[-1] == ']') {
+      s->format = STREAM_RAW;
+      s->f = fopen(colon + 1, "rb");
+      if (!s->f) goto fail;
+      r = open_raw(s, fname + 4, colon - fname - 5);
+      goto opened;
+   }
+
+   s->f = fopen(fname, "rb");
+   if (!s->f || 8 != fread(b, 1, 8, s->f)) goto fail;
+   rewind(s->f);
+
+   if (b[0] == 'P' && (b[1] == '5' || b[1] == '6')) {
+      s->format = STREAM_PNM;
+      fseek(s->f, 2, SEEK_SET);
+      r = open_pnm(s, b[1]);
+   } else if (b[0] == 'P' && (b[1] == 'F' || b[1] == 'f')) {
+      s->format = STREAM_PFM;
+      fseek(s->f, 2, SEEK_SET);
+      r = open_pfm(s, b[1]);
+   } else if (!memcmp(b, "PIEH", 4)) {
+      s->format = STREAM_FLO;
+      r = open_flo(s);
+   }
+#ifdef I_CAN_HAS_LIBPNG
+   else if (!png_sig_cmp(b, 0, 8)) {
+      s->format = STREAM_PNG;
+      r = open_png(s);
+   }
+#endif
+#ifdef I_CAN_HAS_LIBJPEG
+   else if (b[0] == 0xff && b[1] == 0xd8 && b[2] == 0xff) {
+      s->format = STREAM_JPEG;
+      r = open_jpeg(s);
+   }
+#endif
+#ifdef I_CAN_HAS_LIBTIFF
+   else if ((b[0] == 'I' && b[1] == 'I') || (b[0] == 'M' && b[1] == 'M')) {
+#ifdef I_USE_LIBRAW
+      // many camera raw files are tiff files, let libraw have them
+      const char *ext = strrchr(fname, '.');
+      if (!ext || (strcasecmp(ext, ".tif") && strcasecmp(ext, ".tiff")))
+         goto fail;
+#endif
+      s->format = STREAM_TIFF;
+      fclose(s->f);
+      s->f = NULL;
+      r = open_tiff(s, fname);
+   }
+#endif
+opened:
+   if (r || s->w <= 0 || s->h <= 0 || s->nch <= 0) goto fail;
+
+   s->rowbytes = (size_t)s->w * s->nch * stream_type_size(s->type);
+   s->raw = malloc(s->rowbytes);
+   if (!s->raw) goto fail;
+   *w = s->w;
+   *h = s->h;
+   *nch = s->nch;
+   return s;
+
+fail:
+   piio_stream_close(s);
+   return NULL;
+}
+
+static int stream_read_row(struct piio_stream *s, uint8_t *out)
+{
+   switch (s->format) {
+   case STREAM_PNM:
+   case STREAM_PFM:
+   case STREAM_FLO:
+   case STREAM_RAW:  return read_row_file(s, out);
+#ifdef I_CAN_HAS_LIBPNG
+   case STREAM_PNG:  return read_row_png(s, out);
+#endif
+#ifdef I_CAN_HAS_LIBJPEG
+   case STREAM_JPEG: return read_row_jpeg(s, out);
+#endif
+#ifdef I_CAN_HAS_LIBTIFF
+   case STREAM_TIFF: return read_row_tiff(s, out);
+#endif
+   }
+   return -1;
+}
+
+// decode the next nrows rows of the image into dst (float samples, the
+// pixels are interleaved as in iio_read_image_float_vec)
+// returns the number of rows actually read
+int piio_stream_read_rows(void *p, float *dst, int nrows)
+{
+   struct piio_stream *s = p;
+   int n = 0;
+   for (; n < nrows && s->row < s->h; n++, s->row++) {
+      if (stream_read_row(s, s->raw)) break;
+      convert_row_to_float(dst + (size_t)n*s->w*s->nch, s->raw,
+            s->w*s->nch, s->type, s->swap);
+   }
+   return n;
+}
+
+// type of the samples of the stream (STREAM_TYPE_*, same as IIO_TYPE_*)
+int piio_stream_type(void *p)
+{
+   struct piio_stream *s = p;
+   return s->type;
+}
+
+// same as piio_stream_read_rows but the samples keep the type given by
+// piio_stream_type (in the byte order of the host)
+int piio_stream_read_rows_native(void *p, void *dst, int nrows)
+{
+   struct piio_stream *s = p;
+   size_t ss = stream_type_size(s->type);
+   int n = 0;
+   for (; n < nrows && s->row < s->h; n++, s->row++) {
+      uint8_t *out = (uint8_t*)dst + n*s->rowbytes;
+      if (stream_read_row(s, out)) break;
+      if (s->swap) swap_samples(out, s->w*s->nch, ss);
+   }
+   return n;
+}
+
+// decode the rectangle [x0,x0+w)x[y0,y0+h) of the image into dst (float
+// samples, as piio_stream_read_rows), the pixels outside the image are 0.
+// The stream can not be used for reading anything else afterwards.
+// returns 0 on success
+int piio_stream_read_region(void *p, int x0, int y0, int w, int h, float *dst)
+{
+   struct piio_stream *s = p;
+   memset(dst, 0, (size_t)w*h*s->nch*sizeof*dst);
+   int cx0 = x0 > 0 ? x0 : 0, cx1 = x0 + w < s->w ? x0 + w : s->w;
+   int cy0 = y0 > 0 ? y0 : 0, cy1 = y0 + h < s->h ? y0 + h : s->h;
+   if (cx0 >= cx1 || cy0 >= cy1) return 0;
+   size_t ps = (size_t)s->nch * stream_type_size(s->type);
+   int rx0 = 0;         // first column stored in s->raw
+
+#ifdef I_CAN_HAS_LIBTIFF
+   if (s->format == STREAM_TIFF)
+      return read_region_tiff(s, dst, x0, y0, w, cx0, cy0, cx1, cy1);
+#endif
+#ifdef I_CAN_HAS_LIBJPEG
+   if (s->format == STREAM_JPEG && s->row == 0) {
+      if (crop_jpeg(s, cx0, cx1 - cx0, cy0)) return -1;
+      rx0 = s->jpeg_x0;
+   }
+#endif
+   // the other formats are decoded sequentially
+   if (s->row > cy0) return -1;
+   for (; s->row < cy1; s->row++) {
+      if (s->offset >= 0) {
+         // uncompressed rows, seek to the required part
+         if (s->row < cy0) continue;
+         long o = s->offset + (long)s->row*s->rowbytes + (long)cx0*ps;
+         if (fseek(s->f, o, SEEK_SET)) return -1;
+         if (1 != fread(s->raw, (cx1 - cx0)*ps, 1, s->f)) return -1;
+         rx0 = cx0;
+      } else if (stream_read_row(s, s->raw))
+         return -1;
+      if (s->row >= cy0)
+         convert_row_to_float(dst + ((size_t)(s->row - y0)*w + cx0 - x0)*s->nch,
+               s->raw + (cx0 - rx0)*ps, (cx1 - cx0)*s->nch, s->type, s->swap);
+   }
+   return 0;
+}
+
+// when the rows of the image are stored verbatim and contiguously in the file,
+// give the position of the first one, the type of the samples and whether
+// they must be byte swapped.  Only valid before reading any row.
+// returns 0 if the file can be mapped instead of being read
+int piio_stream_layout(void *p, long long *offset, int *type, int *swap)
+{
+   struct piio_stream *s = p;
+   long long o = s->offset;
+   if (s->row) return -1;
+#ifdef I_CAN_HAS_LIBTIFF
+   if (s->format == STREAM_TIFF) {
+      uint16_t compression;
+      uint32_t rps;
+      toff_t *offsets, *counts;
+      if (s->tile) return -1;
+      if (!TIFFGetField(s->tif, TIFFTAG_COMPRESSION, &compression)
+            || compression != COMPRESSION_NONE) return -1;
+      if (!TIFFGetField(s->tif, TIFFTAG_ROWSPERSTRIP, &rps) || rps > (uint32_t)s->h)
+         rps = s->h;
+      if (!TIFFGetField(s->tif, TIFFTAG_STRIPOFFSETS, &offsets)) return -1;
+      if (!TIFFGetField(s->tif, TIFFTAG_STRIPBYTECOUNTS, &counts)) return -1;
+      // the strips must follow each other in the file
+      uint32_t nstrips = TIFFNumberOfStrips(s->tif);
+      for (uint32_t i = 0; i < nstrips; i++) {
+         uint32_t rows = (i + 1)*rps > (uint32_t)s->h ? s->h - i*rps : rps;
+         if (offsets[i] != offsets[0] + (toff_t)i*rps*s->rowbytes
+               || counts[i] < rows*s->rowbytes) return -1;
+      }
+      o = offsets[0];
+      *swap = TIFFIsByteSwapped(s->tif) && stream_type_size(s->type) > 1;
+   } else
+#endif
+   if (s->format == STREAM_PNM || s->format == STREAM_PFM
+         || s->format == STREAM_FLO || s->format == STREAM_RAW)
+      *swap = s->swap;
+   else
+      return -1;
+   if (o < 0) return -1;
+   *offset = o;
+   *type = s->type;
+   return 0;
+}
+
+// the mapped copies run in parallel, with the row blocks of freemem.c
+#define PIIO_MAX_THREADS 64 // same as freemem.c
+typedef void (*piio_block_fn)(void *ctx, int k, size_t i0, size_t i1);
+int piio_parallel_for(size_t n, size_t work, piio_block_fn fn, void *ctx);
+
+struct mapped_tile {
+   const uint8_t *src;
+   int type, swap, nc, nr, nch;
+   void *dst;
+   int x0, y0, w, dst_nch;
+};
+
+static void copy_tile_mapped_block(void *c, int k, size_t j0, size_t j1)
+{
+   struct mapped_tile *t = c;
+   int type = t->type, swap = t->swap, nch = t->nch, dst_nch = t->dst_nch;
+   int w = t->w;
+   size_t ss = stream_type_size(type);
+   // columns [i0,i1) of the tile are inside the image
+   int i0 = t->x0 < 0 ? -t->x0 : 0;
+   int i1 = t->nc - t->x0 < w ? t->nc - t->x0 : w;
+   int n = nch < dst_nch ? nch : dst_nch;
+   for (size_t j=j0;j<j1;j++) {
+      float *d = (float*)t->dst + (size_t)dst_nch*w*j;
+      int jj = t->y0 + j;
+      if (jj < 0 || jj >= t->nr || i0 >= i1) {
+         memset(d, 0, sizeof*d*dst_nch*w);
+         continue;
+      }
+      memset(d, 0, sizeof*d*dst_nch*i0);
+      memset(d + dst_nch*i1, 0, sizeof*d*dst_nch*(w-i1));
+      const uint8_t *s = t->src + ss*nch*((size_t)(t->x0+i0) + (size_t)jj*t->nc);
+      if (nch == dst_nch) {
+         convert_row_to_float(d + dst_nch*i0, s, (i1-i0)*nch, type, swap);
+         continue;
+      }
+      for (int i=i0;i<i1;i++, s+=ss*nch) {
+         convert_row_to_float(d + dst_nch*i, s, n, type, swap);
+         for (int c=n;c<dst_nch;c++)
+            d[dst_nch*i+c] = 0;
+      }
+   }
+}
+
+// copy a tile out of the samples of a mapped file (with the layout given by
+// piio_stream_layout), same arguments as copy_tile
+void piio_copy_tile_mapped(const uint8_t *src, int type, int swap,
+      int nc, int nr, int nch, float *dst, int x0, int y0, int w, int h,
+      int dst_nch)
+{
+   struct mapped_tile t = {src, type, swap, nc, nr, nch, dst, x0, y0, w, dst_nch};
+   if (w <= 0 || h <= 0) return;
+   piio_parallel_for(h, (size_t)h*w*dst_nch, copy_tile_mapped_block, &t);
+}
+
+static void copy_tile_mapped_native_block(void *c, int k, size_t j0, size_t j1)
+{
+   struct mapped_tile *t = c;
+   int nch = t->nch, dst_nch = t->dst_nch, w = t->w;
+   size_t ss = stream_type_size(t->type);
+   int i0 = t->x0 < 0 ? -t->x0 : 0;
+   int i1 = t->nc - t->x0 < w ? t->nc - t->x0 : w;
+   int n = nch < dst_nch ? nch : dst_nch;
+   for (size_t j=j0;j<j1;j++) {
+      uint8_t *d = (uint8_t*)t->dst + ss*dst_nch*w*j;
+      int jj = t->y0 + j;
+      if (jj < 0 || jj >= t->nr || i0 >= i1) {
+         memset(d, 0, ss*dst_nch*w);
+         continue;
+      }
+      memset(d, 0, ss*dst_nch*i0);
+      memset(d + ss*dst_nch*i1, 0, ss*dst_nch*(w-i1));
+      const uint8_t *s = t->src + ss*nch*((size_t)(t->x0+i0) + (size_t)jj*t->nc);
+      uint8_t *p = d + ss*dst_nch*i0;
+      if (nch == dst_nch) {
+         memcpy(p, s, ss*nch*(i1-i0));
+         if (t->swap) swap_samples(p, nch*(i1-i0), ss);
+         continue;
+      }
+      for (int i=i0;i<i1;i++, s+=ss*nch, p+=ss*dst_nch) {
+         memcpy(p, s, ss*n);
+         memset(p + ss*n, 0, ss*(dst_nch - n));
+         if (t->swap) swap_samples(p, n, ss);
+      }
+   }
+}
+
+// same as piio_copy_tile_mapped but keeping the type of the samples (they
+// are only byte swapped if needed)
+void piio_copy_tile_mapped_native(const uint8_t *src, int type, int swap,
+      int nc, int nr, int nch, void *dst, int x0, int y0, int w, int h,
+      int dst_nch)
+{
+   struct mapped_tile t = {src, type, swap, nc, nr, nch, dst, x0, y0, w, dst_nch};
+   if (w <= 0 || h <= 0) return;
+   piio_parallel_for(h, (size_t)h*w*dst_nch, copy_tile_mapped_native_block, &t);
+}
+
+struct mapped_minmax {
+   const uint8_t *src;
+   int type, swap;
+   float vmin[PIIO_MAX_THREADS], vmax[PIIO_MAX_THREADS];
+};
+
+static void minmax_mapped_block(void *c, int b, size_t k0, size_t k1)
+{
+   struct mapped_minmax *m = c;
+   float imin = +INFINITY;
+   float imax = -INFINITY;
+   float buf[4096];
+   size_t ss = stream_type_size(m->type);
+   for (size_t k = k0; k < k1; k += 4096) {
+      int n = k1 - k < 4096 ? k1 - k : 4096;
+      convert_row_to_float(buf, m->src + ss*k, n, m->type, m->swap);
+      for (int i=0;i<n;i++)
+         if (isfinite(buf[i])) {
+            if (buf[i] < imin) imin = buf[i];
+            if (buf[i] > imax) imax = buf[i];
+         }
+   }
+   m->vmin[b] = imin;
+   m->vmax[b] = imax;
+}
+
+// minimum and maximum of the finite samples of a mapped file
+void piio_minmax_mapped(const uint8_t *src, int type, int swap, size_t n,
+      float *vmin, float *vmax)
+{
+   struct mapped_minmax m = {src, type, swap};
+   int nb = piio_parallel_for(n, n, minmax_mapped_block, &m);
+   float imin = +INFINITY;
+   float imax = -INFINITY;
+   for (int b=0;b<nb;b++) {
+      imin = fmin(imin, m.vmin[b]);
+      imax = fmax(imax, m.vmax[b]);
+   }
+   *vmin = imin;
+   *vmax = imax;
+}
@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+# checks the tiled readers of piio against piio.read and numpy, for each of
+# the formats streamed by stream.c
+# run it with pytest, or from this directory: python test_tiles.py
+from __future__ import print_function
+import os, struct, shutil, tempfile, atexit
+import numpy as np
+import piio
+
+W, H = 1300, 1100     # 2 x 2 tiles of piio.TILE_SIZE
+FAILED = []
+
+
+def check(name, ok, detail=''):
+   if not ok:
+      FAILED.append(name)
+      print('FAIL %s %s'%(name, detail))
+
+
+def same(a, b):
+   ''' equal arrays, the nans at the same places '''
+   a, b = np.asarray(a, np.float64), np.asarray(b, np.float64)
+   return a.shape == b.shape and np.array_equal(np.isnan(a), np.isnan(b)) and \
+          np.array_equal(a[~np.isnan(a)], b[~np.isnan(b)])
+
+
+
+### test images
+
+def smooth(nch, scale=255.0):
+   y, x = np.mgrid[0:H, 0:W]
+   a = np.dstack([(np.sin(x/(60.0+10*c))*np.cos(y/(80.0-10*c)) + 1)/2 for c in range(nch)])
+   return a*scale
+
+
+def write_pnm(filename, a, maxval):
+   magic = b'P5' if a.shape[2] == 1 else b'P6'
+   with open(filename, 'wb') as f:
+      f.write(magic + b'\n# piio test\n%d %d\n%d\n'%(a.shape[1], a.shape[0], maxval))
+      f.write(a.astype('>u2' if maxval > 255 else 'u1').tobytes())
+
+
+def write_pfm(filename, a):
+   with open(filename, 'wb') as f:
+      f.write(b'PF\n' if a.shape[2] == 3 else b'Pf\n')
+      f.write(b'%d %d\n-1\n'%(a.shape[1], a.shape[0]))
+      f.write(a[::-1].astype('<f4').tobytes())
+
+
+def write_flo(filename, a):
+   with open(filename, 'wb') as f:
+      f.write(b'PIEH' + struct.pack('<ii', a.shape[1], a.shape[0]))
+      f.write(a.astype('<f4').tobytes())
+
+
+def write_tiff(filename, a, tile=None, rows=None, endian='<'):
+   ''' an uncompressed tiff, tiled (tile x tile) or in strips of rows rows '''
+   h, w, nch = a.shape
+   fmt = {'u': 1, 'i': 2, 'f': 3}[a.dtype.kind]
+   a = a.astype(a.dtype.newbyteorder(endian))
+   blocks = []
+   if tile:
+      for y in range(0, h, tile):
+         for x in range(0, w, tile):
+            b = np.zeros((tile, tile, nch), a.dtype)
+            sub = a[y:y+tile, x:x+tile]
+            b[:sub.shape[0], :sub.shape[1]] = sub
+            blocks.append(b.tobytes())
+   else:
+      blocks = [a[y:y+rows].tobytes() for y in range(0, h, rows)]
+   offsets, data = [], b''
+   for b in blocks:
+      offsets.append(8 + len(data))
+      data += b
+   tags = [(256, 4, [w]), (257, 4, [h]), (258, 3, [a.dtype.itemsize*8]*nch),
+           (259, 3, [1]), (262, 3, [2 if nch == 3 else 1]), (277, 3, [nch]),
+           (284, 3, [1]), (339, 3, [fmt]*nch)]
+   if tile:
+      tags += [(322, 4, [tile]), (323, 4, [tile]),
+               (324, 4, offsets), (325, 4, [len(b) for b in blocks])]
+   else:
+      tags += [(273, 4, offsets), (278, 4, [rows]), (279, 4, [len(b) for b in blocks])]
+   tags.sort()
+   ifd = 8 + len(data)
+   extra = ifd + 2 + 12*len(tags) + 4
+   entries, values = b'', b''
+   for tag, typ, v in tags:
+      raw = struct.pack(endian + ('H' if typ == 3 else 'I')*len(v), *v)
+      if len(raw) <= 4:
+         entries += struct.pack(endian + 'HHI', tag, typ, len(v)) + raw.ljust(4, b'\0')
+      else:
+         entries += struct.pack(endian + 'HHII', tag, typ, len(v), extra + len(values))
+         values += raw
+   with open(filename, 'wb') as f:
+      f.write((b'II*\0' if endian == '<' else b'MM\0*') + struct.pack(endian + 'I', ifd))
+      f.write(data + struct.pack(endian + 'H', len(tags)) + entries + b'\0\0\0\0' + values)
+
+
+def make_images(d):
+   ''' (filename, native sample type or None) of the test images '''
+   u8, u16 = np.round(smooth(3)), np.round(smooth(1, 65535))
+   f = (smooth(3, 2) - 1)*1e4
+   f[5, 7, 1], f[9, 9, 0], f[700:705, 1100:1200] = np.nan, np.inf, -np.inf
+   images = []
+   piio.write(os.path.join(d, 'u8.png'), u8.astype(np.float32))
+   images.append((os.path.join(d, 'u8.png'), np.uint8))
+   piio.write(os.path.join(d, 'g8.png'), u8[:, :, :1].astype(np.float32))
+   images.append((os.path.join(d, 'g8.png'), np.uint8))
+   piio.write('PNG16:' + os.path.join(d, 'u16.png'), u16.astype(np.float32))
+   images.append((os.path.join(d, 'u16.png'), np.uint16))
+   images.append((os.path.join(os.path.dirname(os.path.abspath(__file__)), 'testimg.jpg'), np.uint8))
+   write_pnm(os.path.join(d, 'u8.ppm'), u8, 255)
+   images.append((os.path.join(d, 'u8.ppm'), np.uint8))
+   write_pnm(os.path.join(d, 'u16.pgm'), u16, 65535)
+   images.append((os.path.join(d, 'u16.pgm'), np.uint16))
+   write_pfm(os.path.join(d, 'f.pfm'), f)
+   images.append((os.path.join(d, 'f.pfm'), None))
+   write_flo(os.path.join(d, 'f.flo'), f[:, :, :2])
+   images.append((os.path.join(d, 'f.flo'), None))
+   u16[:, :, 0].astype('<u2').tofile(os.path.join(d, 'f.raw'))
+   images.append(('RAW[w%d,h%d,p1,tuint16]:%s'%(W, H, os.path.join(d, 'f.raw')), np.uint16))
+   piio.write(os.path.join(d, 'f_lzw.tif'), f.astype(np.float32))
+   images.append((os.path.join(d, 'f_lzw.tif'), None))
+   write_tiff(os.path.join(d, 'u8_strips.tif'), u8.astype(np.uint8), rows=7)
+   images.append((os.path.join(d, 'u8_strips.tif'), np.uint8))
+   write_tiff(os.path.join(d, 'u16_tiled.tif'), u16.astype(np.uint16), tile=256)
+   images.append((os.path.join(d, 'u16_tiled.tif'), np.uint16))
+   write_tiff(os.path.join(d, 'f_tiled_be.tif'), f.astype(np.float32), tile=512, endian='>')
+   images.append((os.path.join(d, 'f_tiled_be.tif'), None))
+   write_tiff(os.path.join(d, 'f_strips_be.tif'), f[:, :, :1].astype(np.float32), rows=100, endian='>')
+   images.append((os.path.join(d, 'f_strips_be.tif'), None))
+   write_tiff(os.path.join(d, 'i16_strips.tif'), (u16 - 30000).astype(np.int16), rows=64)
+   images.append((os.path.join(d, 'i16_strips.tif'), None))
+   return images
+
+
+IMAGES, REFERENCES = [], {}
+
+def images():
+   ''' the test images, written once in a temporary directory '''
+   if not IMAGES:
+      d = tempfile.mkdtemp()
+      atexit.register(shutil.rmtree, d, True)
+      IMAGES.extend(make_images(d))
+   return IMAGES
+
+
+def reference(filename):
+   ''' the samples of piio.read, as float64 '''
+   if filename not in REFERENCES:
+      REFERENCES[filename] = piio.read(filename).astype(np.float64)
+   return REFERENCES[filename]
+
+
+
+### reference results with numpy
+
+def assemble(tiles, w, h, nch):
+   a = np.full((h, w, nch), np.nan)
+   for t in tiles:
+      a[t[2]:t[2]+t[4], t[1]:t[1]+t[3]] = np.ctypeslib.as_array(t[0]).reshape(t[4], t[3], nch)
+   return a
+
+
+def downsample2(a, integer):
+   ''' the mean of the finite samples of each 2x2 block, as piio_downsample2 '''
+   h, w, nch = a.shape
+   p = np.full((h + h%2, w + w%2, nch), np.nan)
+   p[:h, :w] = a
+   blocks = [p[dy::2, dx::2] for dy in (0, 1) for dx in (0, 1)]
+   finite = [np.isfinite(b) for b in blocks]
+   n = sum(f.astype(int) for f in finite)
+   s = sum(np.where(f, b, 0) for b, f in zip(blocks, finite))
+   if integer:
+      return np.floor((s + n//2)/np.maximum(n, 1))
+   with np.errstate(invalid='ignore', divide='ignore'):
+      return np.where(n > 0, s/np.maximum(n, 1), blocks[0])
+
+
+def reference_stats(a, region):
+   ''' per channel counts of the finite and non-finite samples, minimum and
+   maximum, the 1 and 99 percentiles of all the channels and their spread '''
+   x0, y0, x1, y1 = region
+   sub = a[max(y0, 0):y1, max(x0, 0):x1].reshape(-1, a.shape[2])
+   finite = np.isfinite(sub)
+   values = sub[finite]
+   return (finite.sum(0), (~finite).sum(0),
+           [sub[finite[:, c], c].min() for c in range(a.shape[2])],
+           [sub[finite[:, c], c].max() for c in range(a.shape[2])],
+           np.percentile(values, [1, 99]), values.max() - values.min())
+
+
+def check_stats(label, st, ref, region):
+   count, nonfinite, mn, mx, p, spread = reference_stats(ref, region)
+   check(label + ' counts', list(count) == st['count'] and list(nonfinite) == st['nonfinite'],
+         (count, st['count'], nonfinite, st['nonfinite']))
+   check(label + ' range', np.allclose(mn, st['min']) and np.allclose(mx, st['max']),
+         (mn, st['min'], mx, st['max']))
+   # the histogram bins span 1/128 of their value (and 1 for integers)
+   for q, v in zip((1, 99), p):
+      tol = abs(v)/128 + 1 + spread*1e-3
+      check(label + ' percentile %d'%q, abs(st['percentiles_all'][q] - v) <= tol,
+            (v, st['percentiles_all'][q]))
+
+
+
+### the checks
+
+def test_read_tiled_buffers():
+   failed = len(FAILED)
+   for filename, native_type in images():
+      name = os.path.basename(filename)
+      ref = reference(filename)
+      h, w, nch = ref.shape
+      for native in (False, True):
+         tiles, tw, th, tnch, vmin, vmax = piio.read_tiled_buffers(filename, native=native)
+         label = '%s native=%s'%(name, native)
+         check(label + ' size', (tw, th, tnch) == (w, h, nch), (tw, th, tnch))
+         check(label + ' samples', same(assemble(tiles, w, h, nch), ref))
+         want = np.dtype(native_type if native and native_type else np.float32)
+         check(label + ' type', np.dtype(tiles[0][0]._type_) == want, tiles[0][0]._type_)
+         finite = ref[np.isfinite(ref)]
+         check(label + ' range', (vmin, vmax) == (finite.min(), finite.max()), (vmin, vmax))
+   assert len(FAILED) == failed
+
+
+
+def test_read_region():
+   # regions across the tiles and partly outside the image (filled with 0)
+   failed = len(FAILED)
+   for filename, native_type in images():
+      ref = reference(filename)
+      h, w, nch = ref.shape
+      for x, y, rw, rh in [(0, 0, 17, 9), (1000, 1010, 50, 40), (w-30, h-20, 60, 50),
+                           (-5, 3, 20, 10), (511, 0, 3, h)]:
+         r = piio.read_region(filename, x, y, rw, rh)
+         expected = np.zeros((rh, rw, nch))
+         sx, sy = max(x, 0), max(y, 0)
+         ex, ey = min(x+rw, w), min(y+rh, h)
+         expected[sy-y:ey-y, sx-x:ex-x] = ref[sy:ey, sx:ex]
+         check('%s region %s'%(os.path.basename(filename), (x, y, rw, rh)), same(r, expected))
+   assert len(FAILED) == failed
+
+
+
+def test_image_stats():
+   # the summaries of the tiles merged over the whole image
+   failed = len(FAILED)
+   for filename, native_type in images():
+      ref = reference(filename)
+      h, w, nch = ref.shape
+      for native in (False, True):
+         tiles = piio.read_tiled_buffers(filename, native=native)[0]
+         st = piio.image_stats(tiles)
+         check_stats('%s stats native=%s'%(os.path.basename(filename), native),
+                     st, ref, (0, 0, w, h))
+   assert len(FAILED) == failed
+
+
+
+def test_image_stats_region():
+   # the blocks inside a region merged from their summaries, those on its
+   # border read, for regions across the tiles and outside the image
+   failed = len(FAILED)
+   for filename, native_type in images():
+      ref = reference(filename)
+      h, w, nch = ref.shape
+      tiles = piio.read_tiled_buffers(filename, native=True)[0]
+      for region in [(0, 0, w, h), (-10, -10, w+10, h+10), (1000, 1000, 1100, 1050),
+                     (1, 2, 1023, 1025), (300, 1000, 1290, 1099), (1023, 0, 1025, h),
+                     (127, 129, 385, 257)]:
+         st = piio.image_stats(tiles, region=region)
+         check_stats('%s stats %s'%(os.path.basename(filename), region), st, ref, region)
+      check('%s stats of an empty region'%os.path.basename(filename),
+            piio.image_stats(tiles, region=(w+1, 0, w+9, h)) is None)
+   assert len(FAILED) == failed
+
+
+
+def test_build_pyramid():
+   # each level from the tiles of the previous one
+   failed = len(FAILED)
+   for filename, native_type in images():
+      ref = reference(filename)
+      h, w, nch = ref.shape
+      for native in (False, True):
+         tiles = piio.read_tiled_buffers(filename, native=native)[0]
+         levels = piio.build_pyramid(tiles, w, h, nch)
+         check('%s levels'%os.path.basename(filename), len(levels) == 1, len(levels))
+         a, lw, lh = ref, w, h
+         for k, level in enumerate(levels):
+            a, lw, lh = downsample2(a, native and native_type is not None), (lw+1)//2, (lh+1)//2
+            b = assemble(level, lw, lh, nch)
+            ok = b.shape == a.shape and np.array_equal(np.isnan(a), np.isnan(b)) and \
+                 np.allclose(b[np.isfinite(a)], a[np.isfinite(a)], rtol=1e-6, atol=1e-6)
+            check('%s native=%s pyramid level %d'%(os.path.basename(filename), native, k+1), ok)
+   assert len(FAILED) == failed
+
+
+
+def test_to_half():
+   # the float samples rounded as numpy does, the summaries of the float
+   # samples kept, and none computed from the half floats
+   failed = len(FAILED)
+   for filename, native_type in images():
+      name = os.path.basename(filename)
+      tiles, w, h, nch = piio.read_tiled_buffers(filename)[:4]
+      for t, t16 in zip(tiles, piio.to_half(tiles)):
+         a = np.ctypeslib.as_array(t[0])
+         b = np.ctypeslib.as_array(t16[0]).view(np.float16)
+         with np.errstate(over='ignore'):
+            check('%s to_half tile %d,%d'%(name, t[1], t[2]), same(b, a.astype(np.float16)))
+         check('%s to_half stats %d,%d'%(name, t[1], t[2]), t16[7] is t[7])
+         check('%s tile_stats of half floats'%name,
+               piio.tile_stats(t16[0], t[3], t[4], nch) is None)
+      # the samples on the border of a region are read as half floats
+      # (those above 65504 become inf), the others come from the summaries
+      st, st16 = piio.image_stats(tiles, region=(3, 5, 1100, 1033)), \
+                 piio.image_stats(piio.to_half(tiles), region=(3, 5, 1100, 1033))
+      if max(st['max']) < 65504:
+         check('%s stats of the half floats'%name, st['count'] == st16['count'] and
+               st['nonfinite'] == st16['nonfinite'], (st, st16))
+   assert len(FAILED) == failed
+
+
+
+def test_cache():
+   # the tiles read back from the cache, damaged files counted as misses
+   failed = len(FAILED)
+   module = getattr(piio, 'piio', piio)   # also when imported as the package
+   filename = [f for f, t in images() if f.endswith('u16.png')][0]
+   d = tempfile.mkdtemp()
+   try:
+      first = piio.read_tiled_buffers_cached(filename, d, native=True)
+      path = [os.path.join(d, f) for f in os.listdir(d)]
+      check('cache written', len(path) == 1 and path[0].endswith('.tiles'), path)
+      for damage in (None, b'{}', b'{"key": 1}', b'[]', b'{"key": "x", "nch": 1}'):
+         if damage is not None:
+            with open(path[0], 'wb') as f:
+               f.write(module.CACHE_MAGIC + ('%15d\n'%len(damage)).encode('ascii') + damage)
+         tiles, w, h, nch, vmin, vmax, levels = piio.read_tiled_buffers_cached(filename, d, native=True)
+         label = 'cache %s'%damage
+         check(label + ' image', (w, h, nch, vmin, vmax) == tuple(first[1:6]))
+         check(label + ' samples', same(assemble(tiles, w, h, nch), assemble(first[0], w, h, nch)))
+         check(label + ' stats', [list(a) for a in tiles[0][7]] == [list(a) for a in first[0][0][7]])
+         check(label + ' levels', len(levels) == len(first[6]))
+      for image in ([], piio.to_half(piio.read_tiled_buffers(filename)[0])):
+         try:
+            module.cache_store(os.path.join(d, 'x.tiles'), 'x', (image, W, H, 1, 0, 1, []))
+            check('cache_store of %d tiles not cached'%len(image), False)
+         except ValueError:
+            pass
+   finally:
+      shutil.rmtree(d)
+   assert len(FAILED) == failed
+
+
+
+if __name__ == '__main__':
+   for name in sorted(k for k in list(globals()) if k.startswith('test_')):
+      try:
+         globals()[name]()
+         print('ok', name)
+      except AssertionError:
+         print('FAIL', name)
+   print('%d failures'%len(FAILED) if FAILED else 'all ok')
+   raise SystemExit(1 if FAILED else 0)
@@ -19,25 +19,43 @@ from __future__ import print_function
 from __future__ import division
 from __future__ import unicode_literals
 
+# the startup times of --bench-startup are counted from here
+import time
+STARTUP_TIME = time.time()
+
 # Accelerate startup by preventing importing numpy, which for some 
 # reason is loaded during shader compilation but never used.
 # http://stackoverflow.com/questions/1350466/preventing-python-code-from-importing-certain-modules
+# (unless it is already there: then the caller is using it)
 import sys
-sys.modules['numpy']=None
-
+sys.modules.setdefault('numpy', None)
+import ctypes
+import os
+import collections
+
+# OpenGL.GL.shaders, piio and glsvg are imported when they are needed: the
+# shader programs may come from the cache, and the first image is decoded
+# while the window is created
 from OpenGL.GL import *
-from OpenGL.GL.shaders import *
-# TODO REMOVE GLUT: only needed for the text
-import OpenGL.GLUT as glut
 from glfw import glfw
 
 ### SYSTEM SPECIFIC STUFF
-import platform
-if platform.system() == 'Darwin':
+if sys.platform == 'darwin':
    GLOBAL_WHEEL_SCALING = 0.1
 else:
    GLOBAL_WHEEL_SCALING = 1.0
 
+# optional disk cache of the decoded tiles (-cachedir DIR -cachesize MB)
+TILE_CACHE_DIR = None
+TILE_CACHE_BYTES = 4<<30
+
+# number of images before and after the current one decoded in background (-prefetch N)
+PREFETCH_RADIUS = 2
+
+# the linked shader programs are kept here (-shadercache DIR, none to disable)
+SHADER_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+                                'pvflip', 'programs')
+
 global HELPstr
 HELPstr=""
 
@@ -411,712 +429,44 @@ By[0]= 1.; By[1]= 0.35; By[2]= 0.4 ; By[3]=0.  ; By[4]=0.;   By[5]=0.;   By[6]=0
    """
 
 
-DEM_shader = """
+lut_shader = """
    uniform sampler2D src;
-  uniform float shader_a;
-  uniform float shader_b;
-  uniform int   shader_c;
-  uniform int disableTex;
-  
-  bool isnan( float val )
-  {
-    return ( val < 0.0 || 0.0 < val || val == 0.0 ) ? false : true;
-    // important: some nVidias failed to cope with version below.
-    // Probably wrong optimization.
-    /*return ( val <= 0.0 || 0.0 <= val ) ? false : true;*/
-  }
-
+   uniform sampler1D lut;
+   uniform float shader_a;
+   uniform float shader_b;
+   uniform int   shader_c;
+   uniform int   disableTex;
+   uniform int   lut_index;
+   uniform float lut_size;
+   uniform float lut_offset;
+   uniform float lut_scale;
 
-   void main (void)
+   bool isnan( float val )
    {
-
-//http://soliton.vm.bytemark.co.uk/pub/cpt-city/td/tn/DEM_screen.png.index.html
-//float palI[8], palR[8], palG[8], palB[8];
-//int N=6;
-//palI[0]=0.00000; palR[0]=0.00000; palG[0]=0.51765; palB[0]=0.20784;  
-//palI[1]=0.12500; palR[1]=0.20000; palG[1]=0.80000; palB[1]=0.00000;
-//palI[2]=0.25000; palR[2]=0.95686; palG[2]=0.94118; palB[2]=0.44314;
-//palI[3]=0.50000; palR[3]=0.95686; palG[3]=0.74118; palB[3]=0.27059;
-//palI[4]=0.75000; palR[4]=0.60000; palG[4]=0.39216; palB[4]=0.16863;
-//palI[5]=1.00000; palR[5]=1.00000; palG[5]=1.00000; palB[5]=1.00000;
-
-////http://soliton.vm.bytemark.co.uk/pub/cpt-city/td/DEM_print.gpf
-//float palI[8], palR[8], palG[8], palB[8];
-//int N=7;
-//palI[0]=0.00000; palR[0]=0.20000; palG[0]=0.40000; palB[0]=0.00000;  
-//palI[1]=0.12500; palR[1]=0.50588; palG[1]=0.76471; palB[1]=0.12157;
-//palI[2]=0.25000; palR[2]=1.00000; palG[2]=1.00000; palB[2]=0.80000;
-//palI[3]=0.50000; palR[3]=0.95686; palG[3]=0.74118; palB[3]=0.27059;
-//palI[4]=0.62500; palR[4]=0.40000; palG[4]=0.20000; palB[4]=0.04706;
-//palI[5]=0.75000; palR[5]=0.40000; palG[5]=0.20000; palB[5]=0.00000;
-//palI[6]=1.00000; palR[6]=1.00000; palG[6]=1.00000; palB[6]=1.00000;
-   
-      
-
-//http://soliton.vm.bytemark.co.uk/pub/cpt-city/td/tn/DEM_poster.png.index.html
-float palI[8], palR[8], palG[8], palB[8];
- int N = 8;
-palI[0]=0.00000; palR[0]=0.00000; palG[0]=0.38039; palB[0]=0.27843;  
-palI[1]=0.01020; palR[1]=0.06275; palG[1]=0.47843; palB[1]=0.18431;
-palI[2]=0.10200; palR[2]=0.90980; palG[2]=0.84314; palB[2]=0.49020;
-palI[3]=0.24490; palR[3]=0.63137; palG[3]=0.26275; palB[3]=0.00000;
-palI[4]=0.34690; palR[4]=0.61961; palG[4]=0.00000; palB[4]=0.00000;
-palI[5]=0.57140; palR[5]=0.43137; palG[5]=0.43137; palB[5]=0.43137;
-palI[6]=0.81630; palR[6]=1.00000; palG[6]=1.00000; palB[6]=1.00000;
-palI[7]=1.00000; palR[7]=1.00000; palG[7]=1.00000; palB[7]=1.00000;
-
-
-       vec4 q = texture2D(src, gl_TexCoord[0].xy);
-       q = 1.0 - (q * shader_a + shader_b);
-
-       if( disableTex == 1)   q = 1.0 - gl_Color;
-
-       if (shader_c > 0)
-         q = 1.0 - q;
-
-       vec4 p;
-       p.w = 1.0;
-
-       if(isnan(q.x)) {
-           p.x = 0.0;
-           p.y = 0.0;
-           p.z = 0.0;
-       } else {
-
-          q = clamp(q, 0.0, 1.0);
-
-          p.x = palR[0]; 
-          p.y = palG[0]; 
-          p.z = palB[0]; 
-   
-          for(int i=1;i<N;i++) {
-           if(q.x >= palI[i-1] && q.x <= palI[i]){
-                  float cc = (palI[i] - q.x) / (palI[i] -  palI[i-1]);
-                  p.x = cc * palR[i-1] + (1.0 - cc)*palR[i];
-                  p.y = cc * palG[i-1] + (1.0 - cc)*palG[i];
-                  p.z = cc * palB[i-1] + (1.0 - cc)*palB[i];
-            }
-          }
-          if(q.x >= palI[N-1]){
-              p.x = palR[N-1];
-              p.y = palG[N-1];
-              p.z = palB[N-1];
-          }
-      }
-
-
-       gl_FragColor = clamp(p, 0.0, 1.0);
+     return ( val < 0.0 || 0.0 < val || val == 0.0 ) ? false : true;
    }
-   """
-
-
-
-
-
-
-
-INFERNO_shader = """
-#version 120
-   uniform sampler2D src;
-  uniform float shader_a;
-  uniform float shader_b;
-  uniform int   shader_c;
-  uniform int disableTex;
-  
-  bool isnan( float val )
-  {
-    return ( val < 0.0 || 0.0 < val || val == 0.0 ) ? false : true;
-    // important: some nVidias failed to cope with version below.
-    // Probably wrong optimization.
-    /*return ( val <= 0.0 || 0.0 <= val ) ? false : true;*/
-  }
-
-//magma
-   uniform vec4 pal[256]  = vec4[256]( 
-   vec4(0.00000, 0.05098, 0.03137, 0.52941),  
-   vec4(0.00390, 0.06275, 0.02745, 0.53333),
-   vec4(0.00780, 0.07451, 0.02745, 0.53725),
-   vec4(0.01180, 0.08627, 0.02745, 0.54118),
-   vec4(0.01570, 0.09804, 0.02353, 0.54902),
-   vec4(0.01960, 0.10588, 0.02353, 0.55294),
-   vec4(0.02350, 0.11373, 0.02353, 0.55686),
-   vec4(0.02750, 0.12549, 0.02353, 0.56078),
-   vec4(0.03140, 0.13333, 0.02353, 0.56471),
-   vec4(0.03530, 0.14118, 0.02353, 0.56863),
-   vec4(0.03920, 0.14902, 0.01961, 0.56863),
-   vec4(0.04310, 0.15686, 0.01961, 0.57255),
-   vec4(0.04710, 0.16471, 0.01961, 0.57647),
-   vec4(0.05100, 0.17255, 0.01961, 0.58039),
-   vec4(0.05490, 0.18039, 0.01961, 0.58431),
-   vec4(0.05880, 0.18431, 0.01961, 0.58824),
-   vec4(0.06270, 0.19216, 0.01961, 0.59216),
-   vec4(0.06670, 0.20000, 0.01961, 0.59216),
-   vec4(0.07060, 0.20784, 0.01569, 0.59608),
-   vec4(0.07450, 0.21569, 0.01569, 0.60000),
-   vec4(0.07840, 0.21961, 0.01569, 0.60392),
-   vec4(0.08240, 0.22745, 0.01569, 0.60392),
-   vec4(0.08630, 0.23529, 0.01569, 0.60784),
-   vec4(0.09020, 0.24314, 0.01569, 0.61176),
-   vec4(0.09410, 0.24706, 0.01569, 0.61176),
-   vec4(0.09800, 0.25490, 0.01569, 0.61569),
-   vec4(0.10200, 0.26275, 0.01176, 0.61961),
-   vec4(0.10590, 0.26667, 0.01176, 0.61961),
-   vec4(0.10980, 0.27451, 0.01176, 0.62353),
-   vec4(0.11370, 0.28235, 0.01176, 0.62353),
-   vec4(0.11760, 0.28627, 0.01176, 0.62745),
-   vec4(0.12160, 0.29412, 0.01176, 0.63137),
-   vec4(0.12550, 0.29804, 0.00784, 0.63137),
-   vec4(0.12940, 0.30588, 0.00784, 0.63529),
-   vec4(0.13330, 0.31373, 0.00784, 0.63529),
-   vec4(0.13730, 0.31765, 0.00784, 0.63922),
-   vec4(0.14120, 0.32549, 0.00784, 0.63922),
-   vec4(0.14510, 0.33333, 0.00784, 0.64314),
-   vec4(0.14900, 0.33725, 0.00392, 0.64314),
-   vec4(0.15290, 0.34510, 0.00392, 0.64314),
-   vec4(0.15690, 0.34902, 0.00392, 0.64706),
-   vec4(0.16080, 0.35686, 0.00392, 0.64706),
-   vec4(0.16470, 0.36078, 0.00392, 0.65098),
-   vec4(0.16860, 0.36863, 0.00392, 0.65098),
-   vec4(0.17250, 0.37647, 0.00392, 0.65098),
-   vec4(0.17650, 0.38039, 0.00000, 0.65490),
-   vec4(0.18040, 0.38824, 0.00000, 0.65490),
-   vec4(0.18430, 0.39216, 0.00000, 0.65490),
-   vec4(0.18820, 0.40000, 0.00000, 0.65490),
-   vec4(0.19220, 0.40392, 0.00000, 0.65882),
-   vec4(0.19610, 0.41176, 0.00000, 0.65882),
-   vec4(0.20000, 0.41569, 0.00000, 0.65882),
-   vec4(0.20390, 0.42353, 0.00000, 0.65882),
-   vec4(0.20780, 0.43137, 0.00000, 0.65882),
-   vec4(0.21180, 0.43529, 0.00000, 0.65882),
-   vec4(0.21570, 0.44314, 0.00000, 0.65882),
-   vec4(0.21960, 0.44706, 0.00392, 0.65882),
-   vec4(0.22350, 0.45490, 0.00392, 0.65882),
-   vec4(0.22750, 0.45882, 0.00392, 0.65882),
-   vec4(0.23140, 0.46667, 0.00392, 0.65882),
-   vec4(0.23530, 0.47059, 0.00392, 0.65882),
-   vec4(0.23920, 0.47843, 0.00784, 0.65882),
-   vec4(0.24310, 0.48235, 0.00784, 0.65882),
-   vec4(0.24710, 0.49020, 0.01176, 0.65882),
-   vec4(0.25100, 0.49412, 0.01176, 0.65882),
-   vec4(0.25490, 0.50196, 0.01569, 0.65882),
-   vec4(0.25880, 0.50588, 0.01569, 0.65490),
-   vec4(0.26270, 0.51373, 0.01961, 0.65490),
-   vec4(0.26670, 0.51765, 0.01961, 0.65490),
-   vec4(0.27060, 0.52549, 0.02353, 0.65098),
-   vec4(0.27450, 0.52941, 0.02745, 0.65098),
-   vec4(0.27840, 0.53333, 0.03137, 0.65098),
-   vec4(0.28240, 0.54118, 0.03529, 0.64706),
-   vec4(0.28630, 0.54510, 0.03922, 0.64706),
-   vec4(0.29020, 0.55294, 0.04314, 0.64706),
-   vec4(0.29410, 0.55686, 0.04706, 0.64314),
-   vec4(0.29800, 0.56078, 0.05098, 0.64314),
-   vec4(0.30200, 0.56863, 0.05490, 0.63922),
-   vec4(0.30590, 0.57255, 0.05882, 0.63922),
-   vec4(0.30980, 0.58039, 0.06275, 0.63529),
-   vec4(0.31370, 0.58431, 0.06667, 0.63137),
-   vec4(0.31760, 0.58824, 0.07451, 0.63137),
-   vec4(0.32160, 0.59608, 0.07843, 0.62745),
-   vec4(0.32550, 0.60000, 0.08235, 0.62353),
-   vec4(0.32940, 0.60392, 0.08627, 0.62353),
-   vec4(0.33330, 0.61176, 0.09020, 0.61961),
-   vec4(0.33730, 0.61569, 0.09412, 0.61569),
-   vec4(0.34120, 0.61961, 0.09804, 0.61569),
-   vec4(0.34510, 0.62745, 0.10196, 0.61176),
-   vec4(0.34900, 0.63137, 0.10588, 0.60784),
-   vec4(0.35290, 0.63529, 0.11373, 0.60392),
-   vec4(0.35690, 0.63922, 0.11765, 0.60392),
-   vec4(0.36080, 0.64706, 0.12157, 0.60000),
-   vec4(0.36470, 0.65098, 0.12549, 0.59608),
-   vec4(0.36860, 0.65490, 0.12941, 0.59216),
-   vec4(0.37250, 0.65882, 0.13333, 0.58824),
-   vec4(0.37650, 0.66667, 0.13725, 0.58431),
-   vec4(0.38040, 0.67059, 0.14118, 0.58039),
-   vec4(0.38430, 0.67451, 0.14902, 0.58039),
-   vec4(0.38820, 0.67843, 0.15294, 0.57647),
-   vec4(0.39220, 0.68235, 0.15686, 0.57255),
-   vec4(0.39610, 0.69020, 0.16078, 0.56863),
-   vec4(0.40000, 0.69412, 0.16471, 0.56471),
-   vec4(0.40390, 0.69804, 0.16863, 0.56078),
-   vec4(0.40780, 0.70196, 0.17255, 0.55686),
-   vec4(0.41180, 0.70588, 0.18039, 0.55294),
-   vec4(0.41570, 0.70980, 0.18431, 0.54902),
-   vec4(0.41960, 0.71373, 0.18824, 0.54510),
-   vec4(0.42350, 0.71765, 0.19216, 0.54118),
-   vec4(0.42750, 0.72157, 0.19608, 0.53725),
-   vec4(0.43140, 0.72941, 0.20000, 0.53333),
-   vec4(0.43530, 0.73333, 0.20392, 0.53333),
-   vec4(0.43920, 0.73725, 0.20784, 0.52941),
-   vec4(0.44310, 0.74118, 0.21569, 0.52549),
-   vec4(0.44710, 0.74510, 0.21961, 0.52157),
-   vec4(0.45100, 0.74902, 0.22353, 0.51765),
-   vec4(0.45490, 0.75294, 0.22745, 0.51373),
-   vec4(0.45880, 0.75686, 0.23137, 0.50980),
-   vec4(0.46270, 0.76078, 0.23529, 0.50588),
-   vec4(0.46670, 0.76471, 0.23922, 0.50196),
-   vec4(0.47060, 0.76863, 0.24314, 0.49804),
-   vec4(0.47450, 0.77255, 0.25098, 0.49412),
-   vec4(0.47840, 0.77647, 0.25490, 0.49020),
-   vec4(0.48240, 0.78039, 0.25882, 0.48627),
-   vec4(0.48630, 0.78431, 0.26275, 0.48235),
-   vec4(0.49020, 0.78824, 0.26667, 0.47843),
-   vec4(0.49410, 0.79216, 0.27059, 0.47843),
-   vec4(0.49800, 0.79608, 0.27451, 0.47451),
-   vec4(0.50200, 0.80000, 0.27843, 0.47059),
-   vec4(0.50590, 0.80000, 0.28627, 0.46667),
-   vec4(0.50980, 0.80392, 0.29020, 0.46275),
-   vec4(0.51370, 0.80784, 0.29412, 0.45882),
-   vec4(0.51760, 0.81176, 0.29804, 0.45490),
-   vec4(0.52160, 0.81569, 0.30196, 0.45098),
-   vec4(0.52550, 0.81961, 0.30588, 0.44706),
-   vec4(0.52940, 0.82353, 0.30980, 0.44314),
-   vec4(0.53330, 0.82745, 0.31765, 0.44314),
-   vec4(0.53730, 0.83137, 0.32157, 0.43922),
-   vec4(0.54120, 0.83529, 0.32549, 0.43529),
-   vec4(0.54510, 0.83529, 0.32941, 0.43137),
-   vec4(0.54900, 0.83922, 0.33333, 0.42745),
-   vec4(0.55290, 0.84314, 0.33725, 0.42353),
-   vec4(0.55690, 0.84706, 0.34118, 0.41961),
-   vec4(0.56080, 0.85098, 0.34510, 0.41569),
-   vec4(0.56470, 0.85490, 0.35294, 0.41569),
-   vec4(0.56860, 0.85490, 0.35686, 0.41176),
-   vec4(0.57250, 0.85882, 0.36078, 0.40784),
-   vec4(0.57650, 0.86275, 0.36471, 0.40392),
-   vec4(0.58040, 0.86667, 0.36863, 0.40000),
-   vec4(0.58430, 0.87059, 0.37255, 0.39608),
-   vec4(0.58820, 0.87059, 0.38039, 0.39216),
-   vec4(0.59220, 0.87451, 0.38431, 0.38824),
-   vec4(0.59610, 0.87843, 0.38824, 0.38824),
-   vec4(0.60000, 0.88235, 0.39216, 0.38431),
-   vec4(0.60390, 0.88627, 0.39608, 0.38039),
-   vec4(0.60780, 0.88627, 0.40000, 0.37647),
-   vec4(0.61180, 0.89020, 0.40784, 0.37255),
-   vec4(0.61570, 0.89412, 0.41176, 0.36863),
-   vec4(0.61960, 0.89804, 0.41569, 0.36471),
-   vec4(0.62350, 0.89804, 0.41961, 0.36471),
-   vec4(0.62750, 0.90196, 0.42353, 0.36078),
-   vec4(0.63140, 0.90588, 0.43137, 0.35686),
-   vec4(0.63530, 0.90588, 0.43529, 0.35294),
-   vec4(0.63920, 0.90980, 0.43922, 0.34902),
-   vec4(0.64310, 0.91373, 0.44314, 0.34510),
-   vec4(0.64710, 0.91373, 0.44706, 0.34118),
-   vec4(0.65100, 0.91765, 0.45490, 0.34118),
-   vec4(0.65490, 0.92157, 0.45882, 0.33725),
-   vec4(0.65880, 0.92157, 0.46275, 0.33333),
-   vec4(0.66270, 0.92549, 0.46667, 0.32941),
-   vec4(0.66670, 0.92941, 0.47451, 0.32549),
-   vec4(0.67060, 0.92941, 0.47843, 0.32157),
-   vec4(0.67450, 0.93333, 0.48235, 0.31765),
-   vec4(0.67840, 0.93725, 0.48627, 0.31765),
-   vec4(0.68240, 0.93725, 0.49412, 0.31373),
-   vec4(0.68630, 0.94118, 0.49804, 0.30980),
-   vec4(0.69020, 0.94118, 0.50196, 0.30588),
-   vec4(0.69410, 0.94510, 0.50588, 0.30196),
-   vec4(0.69800, 0.94510, 0.51373, 0.29804),
-   vec4(0.70200, 0.94902, 0.51765, 0.29412),
-   vec4(0.70590, 0.95294, 0.52157, 0.29412),
-   vec4(0.70980, 0.95294, 0.52941, 0.29020),
-   vec4(0.71370, 0.95686, 0.53333, 0.28627),
-   vec4(0.71760, 0.95686, 0.53725, 0.28235),
-   vec4(0.72160, 0.96078, 0.54510, 0.27843),
-   vec4(0.72550, 0.96078, 0.54902, 0.27451),
-   vec4(0.72940, 0.96471, 0.55294, 0.27059),
-   vec4(0.73330, 0.96471, 0.56078, 0.26667),
-   vec4(0.73730, 0.96863, 0.56471, 0.26667),
-   vec4(0.74120, 0.96863, 0.56863, 0.26275),
-   vec4(0.74510, 0.96863, 0.57647, 0.25882),
-   vec4(0.74900, 0.97255, 0.58039, 0.25490),
-   vec4(0.75290, 0.97255, 0.58431, 0.25098),
-   vec4(0.75690, 0.97647, 0.59216, 0.24706),
-   vec4(0.76080, 0.97647, 0.59608, 0.24314),
-   vec4(0.76470, 0.97647, 0.60392, 0.24314),
-   vec4(0.76860, 0.98039, 0.60784, 0.23922),
-   vec4(0.77250, 0.98039, 0.61176, 0.23529),
-   vec4(0.77650, 0.98039, 0.61961, 0.23137),
-   vec4(0.78040, 0.98431, 0.62353, 0.22745),
-   vec4(0.78430, 0.98431, 0.63137, 0.22353),
-   vec4(0.78820, 0.98431, 0.63529, 0.21961),
-   vec4(0.79220, 0.98824, 0.63922, 0.21961),
-   vec4(0.79610, 0.98824, 0.64706, 0.21569),
-   vec4(0.80000, 0.98824, 0.65098, 0.21176),
-   vec4(0.80390, 0.98824, 0.65882, 0.20784),
-   vec4(0.80780, 0.98824, 0.66275, 0.20392),
-   vec4(0.81180, 0.99216, 0.67059, 0.20000),
-   vec4(0.81570, 0.99216, 0.67451, 0.20000),
-   vec4(0.81960, 0.99216, 0.68235, 0.19608),
-   vec4(0.82350, 0.99216, 0.68627, 0.19216),
-   vec4(0.82750, 0.99216, 0.69412, 0.18824),
-   vec4(0.83140, 0.99216, 0.69804, 0.18431),
-   vec4(0.83530, 0.99216, 0.70588, 0.18431),
-   vec4(0.83920, 0.99216, 0.70980, 0.18039),
-   vec4(0.84310, 0.99608, 0.71765, 0.17647),
-   vec4(0.84710, 0.99608, 0.72157, 0.17255),
-   vec4(0.85100, 0.99608, 0.72941, 0.17255),
-   vec4(0.85490, 0.99608, 0.73333, 0.16863),
-   vec4(0.85880, 0.99608, 0.74118, 0.16471),
-   vec4(0.86270, 0.99608, 0.74510, 0.16471),
-   vec4(0.86670, 0.99608, 0.75294, 0.16078),
-   vec4(0.87060, 0.99216, 0.76078, 0.16078),
-   vec4(0.87450, 0.99216, 0.76471, 0.15686),
-   vec4(0.87840, 0.99216, 0.77255, 0.15294),
-   vec4(0.88240, 0.99216, 0.77647, 0.15294),
-   vec4(0.88630, 0.99216, 0.78431, 0.15294),
-   vec4(0.89020, 0.99216, 0.79216, 0.14902),
-   vec4(0.89410, 0.99216, 0.79608, 0.14902),
-   vec4(0.89800, 0.98824, 0.80392, 0.14510),
-   vec4(0.90200, 0.98824, 0.80784, 0.14510),
-   vec4(0.90590, 0.98824, 0.81569, 0.14510),
-   vec4(0.90980, 0.98824, 0.82353, 0.14510),
-   vec4(0.91370, 0.98431, 0.82745, 0.14118),
-   vec4(0.91760, 0.98431, 0.83529, 0.14118),
-   vec4(0.92160, 0.98431, 0.84314, 0.14118),
-   vec4(0.92550, 0.98039, 0.84706, 0.14118),
-   vec4(0.92940, 0.98039, 0.85490, 0.14118),
-   vec4(0.93330, 0.97647, 0.86275, 0.14118),
-   vec4(0.93730, 0.97647, 0.86667, 0.14510),
-   vec4(0.94120, 0.97255, 0.87451, 0.14510),
-   vec4(0.94510, 0.97255, 0.88235, 0.14510),
-   vec4(0.94900, 0.96863, 0.88627, 0.14510),
-   vec4(0.95290, 0.96863, 0.89412, 0.14510),
-   vec4(0.95690, 0.96471, 0.90196, 0.14902),
-   vec4(0.96080, 0.96471, 0.90980, 0.14902),
-   vec4(0.96470, 0.96078, 0.91373, 0.14902),
-   vec4(0.96860, 0.96078, 0.92157, 0.15294),
-   vec4(0.97250, 0.95686, 0.92941, 0.15294),
-   vec4(0.97650, 0.95294, 0.93333, 0.15294),
-   vec4(0.98040, 0.95294, 0.94118, 0.15294),
-   vec4(0.98430, 0.94902, 0.94902, 0.15294),
-   vec4(0.98820, 0.94510, 0.95686, 0.14902),
-   vec4(0.99220, 0.94510, 0.96078, 0.14510),
-   vec4(0.99610, 0.94118, 0.96863, 0.14118),
-   vec4(1.00000, 0.94118, 0.97647, 0.12941));
-
-
-//inferno
-   uniform vec4 palinferno[256]  = vec4[256](
-   vec4(0.00000, 0.00000, 0.00000, 0.01569),  
-   vec4(0.00390, 0.00392, 0.00000, 0.01961),
-   vec4(0.00780, 0.00392, 0.00392, 0.02353),
-   vec4(0.01180, 0.00392, 0.00392, 0.03137),
-   vec4(0.01570, 0.00784, 0.00392, 0.03922),
-   vec4(0.01960, 0.00784, 0.00784, 0.04706),
-   vec4(0.02350, 0.00784, 0.00784, 0.05490),
-   vec4(0.02750, 0.01176, 0.00784, 0.06275),
-   vec4(0.03140, 0.01569, 0.01176, 0.07059),
-   vec4(0.03530, 0.01569, 0.01176, 0.07843),
-   vec4(0.03920, 0.01961, 0.01569, 0.09020),
-   vec4(0.04310, 0.02353, 0.01569, 0.09804),
-   vec4(0.04710, 0.02745, 0.01961, 0.10588),
-   vec4(0.05100, 0.03137, 0.01961, 0.11373),
-   vec4(0.05490, 0.03529, 0.02353, 0.12157),
-   vec4(0.05880, 0.03922, 0.02745, 0.13333),
-   vec4(0.06270, 0.04314, 0.02745, 0.14118),
-   vec4(0.06670, 0.04706, 0.03137, 0.14902),
-   vec4(0.07060, 0.05098, 0.03137, 0.16078),
-   vec4(0.07450, 0.05490, 0.03529, 0.16863),
-   vec4(0.07840, 0.06275, 0.03529, 0.17647),
-   vec4(0.08240, 0.06667, 0.03922, 0.18824),
-   vec4(0.08630, 0.07059, 0.03922, 0.19608),
-   vec4(0.09020, 0.07843, 0.04314, 0.20392),
-   vec4(0.09410, 0.08235, 0.04314, 0.21569),
-   vec4(0.09800, 0.08627, 0.04314, 0.22353),
-   vec4(0.10200, 0.09412, 0.04706, 0.23529),
-   vec4(0.10590, 0.09804, 0.04706, 0.24314),
-   vec4(0.10980, 0.10588, 0.04706, 0.25490),
-   vec4(0.11370, 0.10980, 0.04706, 0.26275),
-   vec4(0.11760, 0.11765, 0.04706, 0.27059),
-   vec4(0.12160, 0.12157, 0.04706, 0.28235),
-   vec4(0.12550, 0.12941, 0.04706, 0.29020),
-   vec4(0.12940, 0.13725, 0.04706, 0.29804),
-   vec4(0.13330, 0.14118, 0.04706, 0.30980),
-   vec4(0.13730, 0.14902, 0.04706, 0.31765),
-   vec4(0.14120, 0.15686, 0.04314, 0.32549),
-   vec4(0.14510, 0.16078, 0.04314, 0.33333),
-   vec4(0.14900, 0.16863, 0.04314, 0.34118),
-   vec4(0.15290, 0.17647, 0.04314, 0.34902),
-   vec4(0.15690, 0.18431, 0.03922, 0.35686),
-   vec4(0.16080, 0.19216, 0.03922, 0.36078),
-   vec4(0.16470, 0.19608, 0.03922, 0.36863),
-   vec4(0.16860, 0.20392, 0.03922, 0.37255),
-   vec4(0.17250, 0.21176, 0.03529, 0.38039),
-   vec4(0.17650, 0.21961, 0.03529, 0.38431),
-   vec4(0.18040, 0.22353, 0.03529, 0.38824),
-   vec4(0.18430, 0.23137, 0.03529, 0.39216),
-   vec4(0.18820, 0.23922, 0.03529, 0.39608),
-   vec4(0.19220, 0.24314, 0.03529, 0.40000),
-   vec4(0.19610, 0.25098, 0.03922, 0.40392),
-   vec4(0.20000, 0.25882, 0.03922, 0.40784),
-   vec4(0.20390, 0.26667, 0.03922, 0.40784),
-   vec4(0.20780, 0.27059, 0.03922, 0.41176),
-   vec4(0.21180, 0.27843, 0.04314, 0.41569),
-   vec4(0.21570, 0.28627, 0.04314, 0.41569),
-   vec4(0.21960, 0.29020, 0.04706, 0.41961),
-   vec4(0.22350, 0.29804, 0.04706, 0.41961),
-   vec4(0.22750, 0.30196, 0.05098, 0.42353),
-   vec4(0.23140, 0.30980, 0.05098, 0.42353),
-   vec4(0.23530, 0.31765, 0.05490, 0.42353),
-   vec4(0.23920, 0.32157, 0.05490, 0.42745),
-   vec4(0.24310, 0.32941, 0.05882, 0.42745),
-   vec4(0.24710, 0.33333, 0.05882, 0.42745),
-   vec4(0.25100, 0.34118, 0.06275, 0.43137),
-   vec4(0.25490, 0.34902, 0.06275, 0.43137),
-   vec4(0.25880, 0.35294, 0.06667, 0.43137),
-   vec4(0.26270, 0.36078, 0.07059, 0.43137),
-   vec4(0.26670, 0.36471, 0.07059, 0.43137),
-   vec4(0.27060, 0.37255, 0.07451, 0.43137),
-   vec4(0.27450, 0.38039, 0.07451, 0.43137),
-   vec4(0.27840, 0.38431, 0.07843, 0.43137),
-   vec4(0.28240, 0.39216, 0.08235, 0.43137),
-   vec4(0.28630, 0.39608, 0.08235, 0.43137),
-   vec4(0.29020, 0.40392, 0.08627, 0.43137),
-   vec4(0.29410, 0.41176, 0.08627, 0.43137),
-   vec4(0.29800, 0.41569, 0.09020, 0.43137),
-   vec4(0.30200, 0.42353, 0.09412, 0.43137),
-   vec4(0.30590, 0.42745, 0.09412, 0.43137),
-   vec4(0.30980, 0.43529, 0.09804, 0.43137),
-   vec4(0.31370, 0.44314, 0.09804, 0.43137),
-   vec4(0.31760, 0.44706, 0.10196, 0.43137),
-   vec4(0.32160, 0.45490, 0.10196, 0.43137),
-   vec4(0.32550, 0.45882, 0.10588, 0.43137),
-   vec4(0.32940, 0.46667, 0.10980, 0.42745),
-   vec4(0.33330, 0.47059, 0.10980, 0.42745),
-   vec4(0.33730, 0.47843, 0.11373, 0.42745),
-   vec4(0.34120, 0.48627, 0.11373, 0.42745),
-   vec4(0.34510, 0.49020, 0.11765, 0.42745),
-   vec4(0.34900, 0.49804, 0.11765, 0.42353),
-   vec4(0.35290, 0.50196, 0.12157, 0.42353),
-   vec4(0.35690, 0.50980, 0.12549, 0.42353),
-   vec4(0.36080, 0.51765, 0.12549, 0.41961),
-   vec4(0.36470, 0.52157, 0.12941, 0.41961),
-   vec4(0.36860, 0.52941, 0.12941, 0.41961),
-   vec4(0.37250, 0.53333, 0.13333, 0.41569),
-   vec4(0.37650, 0.54118, 0.13333, 0.41569),
-   vec4(0.38040, 0.54902, 0.13725, 0.41176),
-   vec4(0.38430, 0.55294, 0.13725, 0.41176),
-   vec4(0.38820, 0.56078, 0.14118, 0.41176),
-   vec4(0.39220, 0.56471, 0.14510, 0.40784),
-   vec4(0.39610, 0.57255, 0.14510, 0.40784),
-   vec4(0.40000, 0.57647, 0.14902, 0.40392),
-   vec4(0.40390, 0.58431, 0.14902, 0.40392),
-   vec4(0.40780, 0.59216, 0.15294, 0.40000),
-   vec4(0.41180, 0.59608, 0.15294, 0.40000),
-   vec4(0.41570, 0.60392, 0.15686, 0.39608),
-   vec4(0.41960, 0.60784, 0.16078, 0.39216),
-   vec4(0.42350, 0.61569, 0.16078, 0.39216),
-   vec4(0.42750, 0.62353, 0.16471, 0.38824),
-   vec4(0.43140, 0.62745, 0.16471, 0.38824),
-   vec4(0.43530, 0.63529, 0.16863, 0.38431),
-   vec4(0.43920, 0.63922, 0.17255, 0.38039),
-   vec4(0.44310, 0.64706, 0.17255, 0.37647),
-   vec4(0.44710, 0.65098, 0.17647, 0.37647),
-   vec4(0.45100, 0.65882, 0.18039, 0.37255),
-   vec4(0.45490, 0.66275, 0.18039, 0.36863),
-   vec4(0.45880, 0.67059, 0.18431, 0.36863),
-   vec4(0.46270, 0.67843, 0.18824, 0.36471),
-   vec4(0.46670, 0.68235, 0.18824, 0.36078),
-   vec4(0.47060, 0.69020, 0.19216, 0.35686),
-   vec4(0.47450, 0.69412, 0.19608, 0.35294),
-   vec4(0.47840, 0.70196, 0.19608, 0.35294),
-   vec4(0.48240, 0.70588, 0.20000, 0.34902),
-   vec4(0.48630, 0.71373, 0.20392, 0.34510),
-   vec4(0.49020, 0.71765, 0.20784, 0.34118),
-   vec4(0.49410, 0.72549, 0.20784, 0.33725),
-   vec4(0.49800, 0.72941, 0.21176, 0.33333),
-   vec4(0.50200, 0.73725, 0.21569, 0.32941),
-   vec4(0.50590, 0.74118, 0.21961, 0.32549),
-   vec4(0.50980, 0.74902, 0.22353, 0.32157),
-   vec4(0.51370, 0.75294, 0.22745, 0.31765),
-   vec4(0.51760, 0.75686, 0.22745, 0.31373),
-   vec4(0.52160, 0.76471, 0.23137, 0.30980),
-   vec4(0.52550, 0.76863, 0.23529, 0.30588),
-   vec4(0.52940, 0.77647, 0.23922, 0.30196),
-   vec4(0.53330, 0.78039, 0.24314, 0.29804),
-   vec4(0.53730, 0.78431, 0.24706, 0.29412),
-   vec4(0.54120, 0.79216, 0.25098, 0.29020),
-   vec4(0.54510, 0.79608, 0.25490, 0.28627),
-   vec4(0.54900, 0.80000, 0.25882, 0.28235),
-   vec4(0.55290, 0.80784, 0.26275, 0.27843),
-   vec4(0.55690, 0.81176, 0.26667, 0.27451),
-   vec4(0.56080, 0.81569, 0.27059, 0.27059),
-   vec4(0.56470, 0.82353, 0.27451, 0.26667),
-   vec4(0.56860, 0.82745, 0.27843, 0.26275),
-   vec4(0.57250, 0.83137, 0.28235, 0.25882),
-   vec4(0.57650, 0.83529, 0.29020, 0.25490),
-   vec4(0.58040, 0.84314, 0.29412, 0.24706),
-   vec4(0.58430, 0.84706, 0.29804, 0.24314),
-   vec4(0.58820, 0.85098, 0.30196, 0.23922),
-   vec4(0.59220, 0.85490, 0.30588, 0.23529),
-   vec4(0.59610, 0.85882, 0.31373, 0.23137),
-   vec4(0.60000, 0.86667, 0.31765, 0.22745),
-   vec4(0.60390, 0.87059, 0.32157, 0.21961),
-   vec4(0.60780, 0.87451, 0.32549, 0.21569),
-   vec4(0.61180, 0.87843, 0.33333, 0.21176),
-   vec4(0.61570, 0.88235, 0.33725, 0.20784),
-   vec4(0.61960, 0.88627, 0.34118, 0.20392),
-   vec4(0.62350, 0.89020, 0.34902, 0.20000),
-   vec4(0.62750, 0.89412, 0.35294, 0.19216),
-   vec4(0.63140, 0.89804, 0.36078, 0.18824),
-   vec4(0.63530, 0.90196, 0.36471, 0.18431),
-   vec4(0.63920, 0.90588, 0.36863, 0.18039),
-   vec4(0.64310, 0.90980, 0.37647, 0.17647),
-   vec4(0.64710, 0.91373, 0.38039, 0.16863),
-   vec4(0.65100, 0.91765, 0.38824, 0.16471),
-   vec4(0.65490, 0.92157, 0.39216, 0.16078),
-   vec4(0.65880, 0.92157, 0.40000, 0.15686),
-   vec4(0.66270, 0.92549, 0.40392, 0.14902),
-   vec4(0.66670, 0.92941, 0.41176, 0.14510),
-   vec4(0.67060, 0.93333, 0.41569, 0.14118),
-   vec4(0.67450, 0.93725, 0.42353, 0.13725),
-   vec4(0.67840, 0.93725, 0.43137, 0.12941),
-   vec4(0.68240, 0.94118, 0.43529, 0.12549),
-   vec4(0.68630, 0.94510, 0.44314, 0.12157),
-   vec4(0.69020, 0.94510, 0.45098, 0.11373),
-   vec4(0.69410, 0.94902, 0.45490, 0.10980),
-   vec4(0.69800, 0.95294, 0.46275, 0.10588),
-   vec4(0.70200, 0.95294, 0.47059, 0.09804),
-   vec4(0.70590, 0.95686, 0.47451, 0.09412),
-   vec4(0.70980, 0.96078, 0.48235, 0.09020),
-   vec4(0.71370, 0.96078, 0.49020, 0.08235),
-   vec4(0.71760, 0.96471, 0.49412, 0.07843),
-   vec4(0.72160, 0.96471, 0.50196, 0.07451),
-   vec4(0.72550, 0.96863, 0.50980, 0.07059),
-   vec4(0.72940, 0.96863, 0.51765, 0.06275),
-   vec4(0.73330, 0.97255, 0.52157, 0.05882),
-   vec4(0.73730, 0.97255, 0.52941, 0.05490),
-   vec4(0.74120, 0.97255, 0.53725, 0.04706),
-   vec4(0.74510, 0.97647, 0.54510, 0.04314),
-   vec4(0.74900, 0.97647, 0.54902, 0.03922),
-   vec4(0.75290, 0.97647, 0.55686, 0.03529),
-   vec4(0.75690, 0.98039, 0.56471, 0.03137),
-   vec4(0.76080, 0.98039, 0.57255, 0.02745),
-   vec4(0.76470, 0.98039, 0.58039, 0.02745),
-   vec4(0.76860, 0.98431, 0.58824, 0.02353),
-   vec4(0.77250, 0.98431, 0.59216, 0.02353),
-   vec4(0.77650, 0.98431, 0.60000, 0.02353),
-   vec4(0.78040, 0.98431, 0.60784, 0.02353),
-   vec4(0.78430, 0.98431, 0.61569, 0.02745),
-   vec4(0.78820, 0.98824, 0.62353, 0.02745),
-   vec4(0.79220, 0.98824, 0.63137, 0.03137),
-   vec4(0.79610, 0.98824, 0.63922, 0.03529),
-   vec4(0.80000, 0.98824, 0.64706, 0.03922),
-   vec4(0.80390, 0.98824, 0.65098, 0.04706),
-   vec4(0.80780, 0.98824, 0.65882, 0.05098),
-   vec4(0.81180, 0.98824, 0.66667, 0.05882),
-   vec4(0.81570, 0.98824, 0.67451, 0.06667),
-   vec4(0.81960, 0.98824, 0.68235, 0.07059),
-   vec4(0.82350, 0.98824, 0.69020, 0.07843),
-   vec4(0.82750, 0.98824, 0.69804, 0.08627),
-   vec4(0.83140, 0.98824, 0.70588, 0.09412),
-   vec4(0.83530, 0.98431, 0.71373, 0.10196),
-   vec4(0.83920, 0.98431, 0.72157, 0.11373),
-   vec4(0.84310, 0.98431, 0.72941, 0.12157),
-   vec4(0.84710, 0.98431, 0.73725, 0.12941),
-   vec4(0.85100, 0.98431, 0.74510, 0.13725),
-   vec4(0.85490, 0.98039, 0.75294, 0.14902),
-   vec4(0.85880, 0.98039, 0.76078, 0.15686),
-   vec4(0.86270, 0.98039, 0.76863, 0.16471),
-   vec4(0.86670, 0.98039, 0.77647, 0.17647),
-   vec4(0.87060, 0.97647, 0.78039, 0.18431),
-   vec4(0.87450, 0.97647, 0.78824, 0.19608),
-   vec4(0.87840, 0.97647, 0.79608, 0.20784),
-   vec4(0.88240, 0.97255, 0.80392, 0.21569),
-   vec4(0.88630, 0.97255, 0.81176, 0.22745),
-   vec4(0.89020, 0.96863, 0.81961, 0.23922),
-   vec4(0.89410, 0.96863, 0.82745, 0.25098),
-   vec4(0.89800, 0.96471, 0.83529, 0.26275),
-   vec4(0.90200, 0.96471, 0.84314, 0.27451),
-   vec4(0.90590, 0.96078, 0.85098, 0.28627),
-   vec4(0.90980, 0.96078, 0.85882, 0.29804),
-   vec4(0.91370, 0.95686, 0.86667, 0.30980),
-   vec4(0.91760, 0.95686, 0.87451, 0.32549),
-   vec4(0.92160, 0.95686, 0.88235, 0.33725),
-   vec4(0.92550, 0.95294, 0.89020, 0.35294),
-   vec4(0.92940, 0.95294, 0.89804, 0.36471),
-   vec4(0.93330, 0.94902, 0.90196, 0.38039),
-   vec4(0.93730, 0.94902, 0.90980, 0.39608),
-   vec4(0.94120, 0.94902, 0.91765, 0.41176),
-   vec4(0.94510, 0.94510, 0.92549, 0.42745),
-   vec4(0.94900, 0.94510, 0.92941, 0.44314),
-   vec4(0.95290, 0.94510, 0.93725, 0.45882),
-   vec4(0.95690, 0.94510, 0.94510, 0.47451),
-   vec4(0.96080, 0.94902, 0.94902, 0.49020),
-   vec4(0.96470, 0.94902, 0.95686, 0.50980),
-   vec4(0.96860, 0.95294, 0.96078, 0.52549),
-   vec4(0.97250, 0.95294, 0.96471, 0.54118),
-   vec4(0.97650, 0.95686, 0.97255, 0.55686),
-   vec4(0.98040, 0.96078, 0.97647, 0.57255),
-   vec4(0.98430, 0.96471, 0.98039, 0.58824),
-   vec4(0.98820, 0.97255, 0.98431, 0.60392),
-   vec4(0.99220, 0.97647, 0.98824, 0.61569),
-   vec4(0.99610, 0.98039, 0.99216, 0.63137),
-   vec4(1.00000, 0.98824, 1.00000, 0.64314));
-   int N=256;
-
 
    void main (void)
    {
-
-
-
-       vec4 q = texture2D(src, gl_TexCoord[0].xy);
-       q = 1.0 - (q * shader_a + shader_b);
-
-       if( disableTex == 1)   q = 1.0 - gl_Color;
-
-       if (shader_c > 0)
-         q = 1.0 - q;
-
-       vec4 p;
-       p.w = 1.0;
-
-       if(isnan(q.x)) {
-           p.x = 0.0;
-           p.y = 0.0;
-           p.z = 0.0;
-       } else {
-
-          q = clamp(q, 0.0, 1.0);
-
-         int pos = int(q.x * 256.0);
-         if (pos>255) pos=255;
-          p.x = pal[pos].y; 
-          p.y = pal[pos].z; 
-          p.z = pal[pos].w; 
+      vec4 q = texture2D(src, gl_TexCoord[0].xy);
+      float t;
+      // the non-finite values are black
+      bool black = isnan(q.x);
+      if (lut_index == 1) {
+         // the values are the indices of the colors
+         black = black || abs(q.x) > 3.4e38;
+         t = (clamp(floor(q.x), 0.0, lut_size - 1.0) + 0.5) / lut_size;
+      } else {
+         t = q.x * shader_a + shader_b;
+         if( disableTex == 1)   t = gl_Color.x;
+         if (shader_c > 0)
+            t = 1.0 - t;
+         t = lut_offset + clamp(t, 0.0, 1.0) * lut_scale;
       }
-
-
-       gl_FragColor = clamp(p, 0.0, 1.0);
-   }
-   """
-
-sentinel2_shader = """
-   uniform sampler2D src;
-
-   void main (void)
-   {
-      float palette[36];
-      palette[0]  = 0.0; palette[1]  = 0.0; palette[2]  = 0.0;  // black
-      palette[3]  = 1.0; palette[4]  = 0.0; palette[5]  = 0.0;  // red
-      palette[6]  = 0.2; palette[7]  = 0.2; palette[8]  = 0.2;  // dark grey
-      palette[9]  = 0.4; palette[10] = 0.2; palette[11] = 0.2;  // brown
-      palette[12] = 0.1; palette[13] = 0.9; palette[14] = 0.1;  // green
-      palette[15] = 1.0; palette[16] = 1.0; palette[17] = 0.0;  // yellow
-      palette[18] = 0.0; palette[19] = 0.0; palette[20] = 1.0;  // blue
-      palette[21] = 0.4; palette[22] = 0.4; palette[23] = 0.4;  // medium grey
-      palette[24] = 0.6; palette[25] = 0.6; palette[26] = 0.6;  // light grey
-      palette[27] = 0.9; palette[28] = 0.9; palette[29] = 0.9;  // white
-      palette[30] = 0.0; palette[31] = 1.0; palette[32] = 1.0;  // light blue
-      palette[33] = 1.0; palette[34] = 0.0; palette[35] = 1.0;  // pink
-
-      vec4 p = texture2D(src, gl_TexCoord[0].xy);
-      float t = p.x;
-      int i = int(t);
-      if (i < 0) i = 0;
-      if (i > 11) i = 11;
-      p.x = palette[3*i+0];
-      p.y = palette[3*i+1];
-      p.z = palette[3*i+2];
-      p.w = 1.0;
-      gl_FragColor = p;
+      if (black && disableTex != 1)
+         gl_FragColor = vec4(0.0, 0.0, 0.0, 1.0);
+      else
+         gl_FragColor = vec4(texture1D(lut, t).rgb, 1.0);
    }
    """
 
@@ -1129,13 +479,284 @@ SHADERS = {
       'dhsv' : depth_shader_hsv,
       'djet' : depth_shader_jet,
       'ddirt': depth_shader_dirt,
-      'dem'  : DEM_shader,
-      'inferno'  : INFERNO_shader,
       'rgb'  : rgb_shader,
-      's2l2a': sentinel2_shader,
+      'lut'  : lut_shader,
       }
+# name -> (program, locations of its uniforms, filled by uniform_location)
 SHADER_PROGRAMS = {}
 
+
+# the colormaps of the 'lut' program, name -> (colors, mode): the colors
+# (r,g,b in [0,1]) go from the value 0 to the value 1, sampling the nearest
+# one or interpolating them ('nearest' or 'linear'), or are those of the
+# values 0,1,2... ('index')
+COLORMAPS = {}
+
+def colormap_from_hex(h):
+   c = bytearray.fromhex(h)
+   return [(c[i]/255.0, c[i+1]/255.0, c[i+2]/255.0) for i in range(0, len(c), 3)]
+
+COLORMAPS['magma'] = (colormap_from_hex(
+      '0d088710078813078916078a19068c1b068d1d068e20068f220690240691260591280592'
+      '2a05932c05942e05952f059631059733059735049837049938049a3a049a3c049b3e049c'
+      '3f049c41049d43039e44039e46039f48039f4903a04b03a14c02a14e02a25002a25102a3'
+      '5302a35502a45601a45801a45901a55b01a55c01a65e01a66001a66100a76300a76400a7'
+      '6600a76700a86900a86a00a86c00a86e00a86f00a87100a87201a87401a87501a87701a8'
+      '7801a87a02a87b02a87d03a87e03a88004a88104a78305a78405a78606a68707a68808a6'
+      '8a09a58b0aa58d0ba58e0ca48f0da4910ea3920fa39410a29511a19613a19814a099159f'
+      '9a169f9c179e9d189d9e199da01a9ca11b9ba21d9aa31e9aa51f99a62098a72197a82296'
+      'aa2395ab2494ac2694ad2793ae2892b02991b12a90b22b8fb32c8eb42e8db52f8cb6308b'
+      'b7318ab83289ba3388bb3488bc3587bd3786be3885bf3984c03a83c13b82c23c81c33d80'
+      'c43e7fc5407ec6417dc7427cc8437bc9447aca457acb4679cc4778cc4977cd4a76ce4b75'
+      'cf4c74d04d73d14e72d24f71d35171d45270d5536fd5546ed6556dd7566cd8576bd9586a'
+      'da5a6ada5b69db5c68dc5d67dd5e66de5f65de6164df6263e06363e16462e26561e26660'
+      'e3685fe4695ee56a5de56b5de66c5ce76e5be76f5ae87059e97158e97257ea7457eb7556'
+      'eb7655ec7754ed7953ed7a52ee7b51ef7c51ef7e50f07f4ff0804ef1814df1834cf2844b'
+      'f3854bf3874af48849f48948f58b47f58c46f68d45f68f44f79044f79143f79342f89441'
+      'f89540f9973ff9983ef99a3efa9b3dfa9c3cfa9e3bfb9f3afba139fba238fca338fca537'
+      'fca636fca835fca934fdab33fdac33fdae32fdaf31fdb130fdb22ffdb42ffdb52efeb72d'
+      'feb82cfeba2cfebb2bfebd2afebe2afec029fdc229fdc328fdc527fdc627fdc827fdca26'
+      'fdcb26fccd25fcce25fcd025fcd225fbd324fbd524fbd724fad824fada24f9dc24f9dd25'
+      'f8df25f8e125f7e225f7e425f6e626f6e826f5e926f5eb27f4ed27f3ee27f3f027f2f227'
+      'f1f426f1f525f0f724f0f921'), 'nearest')
+
+COLORMAPS['inferno'] = (colormap_from_hex(
+      '00000401000501010601010802010a02020c02020e030210040312040314050417060419'
+      '07051b08051d09061f0a07220b07240c08260d08290e092b10092d110a30120a32140b34'
+      '150b37160b39180c3c190c3e1b0c411c0c431e0c451f0c48210c4a230c4c240c4f260c51'
+      '280b53290b552b0b572d0b592f0a5b310a5c320a5e340a5f3609613809623909633b0964'
+      '3d09653e0966400a67420a68440a68450a69470b6a490b6a4a0c6b4c0c6b4d0d6c4f0d6c'
+      '510e6c520e6d540f6d550f6d57106e59106e5a116e5c126e5d126e5f136e61136e62146e'
+      '64156e65156e67166e69166e6a176e6c186e6d186e6f196e71196e721a6e741a6e751b6e'
+      '771c6d781c6d7a1d6d7c1d6d7d1e6d7f1e6c801f6c82206c84206b85216b87216b88226a'
+      '8a226a8c23698d23698f24699025689225689326679526679727669827669a28659b2964'
+      '9d29649f2a63a02a63a22b62a32c61a52c60a62d60a82e5fa92e5eab2f5ead305dae305c'
+      'b0315bb1325ab3325ab43359b63458b73557b93556ba3655bc3754bd3853bf3952c03a51'
+      'c13a50c33b4fc43c4ec63d4dc73e4cc83f4bca404acb4149cc4248ce4347cf4446d04545'
+      'd24644d34743d44842d54a41d74b3fd84c3ed94d3dda4e3cdb503bdd513ade5238df5337'
+      'e05536e15635e25734e35933e45a31e55c30e65d2fe75e2ee8602de9612bea632aeb6429'
+      'eb6628ec6726ed6925ee6a24ef6c23ef6e21f06f20f1711ff1731df2741cf3761bf37819'
+      'f47918f57b17f57d15f67e14f68013f78212f78410f8850ff8870ef8890cf98b0bf98c0a'
+      'f98e09fa9008fa9207fa9407fb9606fb9706fb9906fb9b06fb9d07fc9f07fca108fca309'
+      'fca50afca60cfca80dfcaa0ffcac11fcae12fcb014fcb216fcb418fbb61afbb81dfbba1f'
+      'fbbc21fbbe23fac026fac228fac42afac62df9c72ff9c932f9cb35f8cd37f8cf3af7d13d'
+      'f7d340f6d543f6d746f5d949f5db4cf4dd4ff4df53f4e156f3e35af3e55df2e661f2e865'
+      'f2ea69f1ec6df1ed71f1ef75f1f179f2f27df2f482f3f586f3f68af4f88ef5f992f6fa96'
+      'f8fb9af9fc9dfafda1fcffa4'), 'nearest')
+
+def colormap_from_knots(knots, n=1024):
+   ''' n colors interpolating the (value, r, g, b) knots '''
+   colors = []
+   for k in range(n):
+      t = k/(n-1.0)
+      i = 1
+      while i < len(knots)-1 and knots[i][0] < t:
+         i += 1
+      (t0,r0,g0,b0), (t1,r1,g1,b1) = knots[i-1], knots[i]
+      c = (t1 - t)/(t1 - t0) if t1 > t0 else 0.0
+      c = min(max(c, 0.0), 1.0)
+      colors.append((c*r0 + (1-c)*r1, c*g0 + (1-c)*g1, c*b0 + (1-c)*b1))
+   return colors
+
+# http://soliton.vm.bytemark.co.uk/pub/cpt-city/td/tn/DEM_poster.png.index.html
+COLORMAPS['dem'] = (colormap_from_knots([
+      (0.00000, 0.00000, 0.38039, 0.27843),
+      (0.01020, 0.06275, 0.47843, 0.18431),
+      (0.10200, 0.90980, 0.84314, 0.49020),
+      (0.24490, 0.63137, 0.26275, 0.00000),
+      (0.34690, 0.61961, 0.00000, 0.00000),
+      (0.57140, 0.43137, 0.43137, 0.43137),
+      (0.81630, 1.00000, 1.00000, 1.00000),
+      (1.00000, 1.00000, 1.00000, 1.00000)]), 'linear')
+
+# classes of the Sentinel-2 L2A scene classification
+COLORMAPS['s2l2a'] = ([
+      (0.0, 0.0, 0.0),  # black
+      (1.0, 0.0, 0.0),  # red
+      (0.2, 0.2, 0.2),  # dark grey
+      (0.4, 0.2, 0.2),  # brown
+      (0.1, 0.9, 0.1),  # green
+      (1.0, 1.0, 0.0),  # yellow
+      (0.0, 0.0, 1.0),  # blue
+      (0.4, 0.4, 0.4),  # medium grey
+      (0.6, 0.6, 0.6),  # light grey
+      (0.9, 0.9, 0.9),  # white
+      (0.0, 1.0, 1.0),  # light blue
+      (1.0, 0.0, 1.0)], 'index')  # pink
+
+# the colormaps after the 9 palettes of the one channel images (key 1),
+# those of -lut are added to them
+COLORMAP_CYCLE = ['inferno']
+
+
+def load_colormap(filename):
+   ''' reads a colormap from a text file with a color per line: r,g,b in
+       [0,1] or in [0,255] (separated by commas, semicolons or spaces),
+       returns its name (that of the file) '''
+   import re
+   colors = []
+   with open(filename) as f:
+      for line in f:
+         line = line.split('#')[0].strip()
+         if line:
+            colors.append([float(v) for v in re.split('[,; \t]+', line)[:3]])
+   if not colors or any(len(c) != 3 for c in colors):
+      raise ValueError('%s is not a colormap'%filename)
+   if max(max(c) for c in colors) > 1:
+      colors = [[v/255.0 for v in c] for c in colors]
+   name = os.path.splitext(os.path.basename(filename))[0]
+   COLORMAPS[name] = (colors, 'nearest' if len(colors) >= 256 else 'linear')
+   return name
+
+
+# name -> 1D texture of the colormap
+COLORMAP_TEXTURES = {}
+
+def use_colormap(name, inverse=0):
+   ''' selects the 'lut' program and binds the texture of COLORMAPS[name]
+       to its texture unit 1, the values are inverted as with shader_c '''
+   colors, mode = COLORMAPS[name]
+   n = len(colors)
+   glActiveTexture(GL_TEXTURE1)
+   if name not in COLORMAP_TEXTURES:
+      COLORMAP_TEXTURES[name] = int(glGenTextures(1))
+      glBindTexture(GL_TEXTURE_1D, COLORMAP_TEXTURES[name])
+      f = GL_LINEAR if mode == 'linear' else GL_NEAREST
+      glTexParameteri(GL_TEXTURE_1D, GL_TEXTURE_MAG_FILTER, f)
+      glTexParameteri(GL_TEXTURE_1D, GL_TEXTURE_MIN_FILTER, f)
+      glTexParameteri(GL_TEXTURE_1D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+      data = (ctypes.c_float*(3*n))(*[v for c in colors for v in c])
+      glPixelStorei(GL_UNPACK_ALIGNMENT,1)
+      glTexImage1D(GL_TEXTURE_1D, 0, GL_RGB32F, n, 0, GL_RGB, GL_FLOAT, data)
+   glBindTexture(GL_TEXTURE_1D, COLORMAP_TEXTURES[name])
+   glActiveTexture(GL_TEXTURE0)
+   use_shader_program('lut')
+   V.inv_param = inverse
+   glUniform1i(uniform_location(b"lut"), 1)
+   glUniform1i(uniform_location(b"lut_index"), mode == 'index')
+   glUniform1f(uniform_location(b"lut_size"), n)
+   # with interpolation 0 and 1 are the centers of the first and last texels
+   linear = mode == 'linear'
+   glUniform1f(uniform_location(b"lut_offset"), 0.5/n if linear else 0.0)
+   glUniform1f(uniform_location(b"lut_scale"), (n-1.0)/n if linear else 1.0)
+
+# texture2D is replaced by _tex in all the shaders.  _tex scales back the
+# 8 and 16 bit textures, which are normalized to [0,1] by the GPU, and
+# replicates the channels of the 1 and 2 channel textures (GL_R*, GL_RG*)
+# so that the shaders see the same values as with luminance(-alpha) data
+SHADER_PRELUDE = """
+   #extension GL_EXT_texture_array : enable
+   uniform float _texscale;
+   uniform int   _texnch;
+   vec4 _tex(sampler2DArray s, vec2 uv) {
+      vec4 p = texture2DArray(s, vec3(uv, gl_TexCoord[0].z)) * _texscale;
+      if (_texnch == 1) return vec4(p.rrr, 1.0);
+      if (_texnch == 2) return p.rrrg;
+      if (_texnch == 3) return vec4(p.rgb, 1.0);
+      return p;
+   }
+   """
+
+def shader_source(name):
+   src = SHADERS[name].replace('texture2D(', '_tex(').replace('uniform sampler2D src', 'uniform sampler2DArray src')
+   # the #version directive must remain the first statement
+   version = ''
+   if '#version' in src:
+      i = src.index('\n', src.index('#version')) + 1
+      version, src = src[:i], src[i:]
+   return version + SHADER_PRELUDE + src
+
+def shader_program_key(src):
+   ''' name of the cached binary of a program: it depends on the driver '''
+   import hashlib
+   driver = b'\n'.join(glGetString(s) or b'' for s in (GL_VENDOR, GL_RENDERER, GL_VERSION))
+   return hashlib.sha1(driver + b'\n' + src.encode('utf-8')).hexdigest()
+
+
+def load_program_binary(path):
+   ''' a program linked from the binary in the file, None if there is none
+       or the driver rejects it '''
+   import struct
+   if not SHADER_CACHE_DIR or not bool(glProgramBinary):
+      return None
+   try:
+      with open(path, 'rb') as f:
+         data = f.read()
+   except IOError:
+      return None
+   if len(data) < 4:
+      return None
+   p = glCreateProgram()
+   binary = ctypes.create_string_buffer(data[4:], len(data)-4)
+   glProgramBinary(p, struct.unpack('<I', data[:4])[0], binary, len(data)-4)
+   if glGetProgramiv(p, GL_LINK_STATUS) != GL_TRUE:
+      glDeleteProgram(p)
+      return None
+   return p
+
+
+def save_program_binary(p, path):
+   import struct
+   n = int(glGetProgramiv(p, GL_PROGRAM_BINARY_LENGTH))
+   if not n:
+      return
+   binary = ctypes.create_string_buffer(n)
+   length = (GLsizei*1)()
+   fmt = (GLenum*1)()
+   glGetProgramBinary(p, n, length, fmt, binary)
+   try:
+      if not os.path.isdir(SHADER_CACHE_DIR):
+         os.makedirs(SHADER_CACHE_DIR)
+      tmp = path + '.%d'%os.getpid()
+      with open(tmp, 'wb') as f:
+         f.write(struct.pack('<I', fmt[0]) + binary.raw[:length[0]])
+      os.rename(tmp, path)
+   except (IOError, OSError):
+      pass
+
+
+def shader_program(name):
+   ''' the program of SHADERS[name], compiled and linked on the first call,
+       or read from the binaries of SHADER_CACHE_DIR '''
+   global SHADER_PROGRAMS
+   if name not in SHADER_PROGRAMS:
+      src = shader_source(name)
+      path = SHADER_CACHE_DIR and os.path.join(SHADER_CACHE_DIR, shader_program_key(src) + '.bin')
+      p = load_program_binary(path)
+      if p is None:
+         from OpenGL.GL.shaders import compileShader
+         shader = compileShader(src, GL_FRAGMENT_SHADER)
+         p = glCreateProgram()
+         glAttachShader(p, shader)
+         cache = SHADER_CACHE_DIR and bool(glProgramBinary)
+         if cache:
+            glProgramParameteri(p, GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL_TRUE)
+         glLinkProgram(p)
+         if glGetProgramiv(p, GL_LINK_STATUS) != GL_TRUE:
+            raise RuntimeError(glGetProgramInfoLog(p))
+         glDeleteShader(shader)
+         if cache:
+            save_program_binary(p, path)
+      SHADER_PROGRAMS[name] = (p, {})
+   return SHADER_PROGRAMS[name]
+
+
+# the programs that could not be built by compile_next_shader_program
+SHADER_FAILED = set()
+
+def compile_next_shader_program():
+   ''' builds one of the programs that have not been used yet, so that
+       the palettes switch without delay, returns False if all are built '''
+   for name in sorted(SHADERS):
+      if name not in SHADER_PROGRAMS and name not in SHADER_FAILED:
+         try:
+            shader_program(name)
+         except RuntimeError:
+            SHADER_FAILED.add(name)
+         return True
+   return False
+
+
 def use_shader_program(name):
    ##########
    ######## SETUP FRAGMENT SHADER FOR CONTRAST CHANGE
@@ -1146,13 +767,8 @@ def use_shader_program(name):
    # http://www.lighthouse3d.com/tutorials/glsl-core-tutorial/fragment-shader/
 
    # programs, shaders, and the current program are global variables
-   global program, SHADERS, SHADER_PROGRAMS
-   if name not in SHADER_PROGRAMS:
-      SHADER_PROGRAMS[name] = compileProgram(
-            compileShader(SHADERS[name], GL_FRAGMENT_SHADER),
-            );
-      glLinkProgram( SHADER_PROGRAMS[name] )
-   program = SHADER_PROGRAMS[name]
+   global program, program_uniforms
+   program, program_uniforms = shader_program(name)
    # try to activate/enable shader program
    # handle errors wisely
    try:
@@ -1162,6 +778,13 @@ def use_shader_program(name):
       raise
 
 
+def uniform_location(name):
+   ''' location of a uniform of the current program, looked up only once '''
+   if name not in program_uniforms:
+      program_uniforms[name] = glGetUniformLocation(program, name)
+   return program_uniforms[name]
+
+
 #### INTERFACE STATE
 class ViewportState:
    winx,winy=0,0
@@ -1198,12 +821,6 @@ class ViewportState:
    #if the window has been resized by the used then automatic resize will be disabled
    window_has_been_resized_by_the_user = 0  
 
-   # mute and buffer fast events  
-   mute_keyboard=0
-   mute_sweep=0
-   mute_wheel=0
-   mute_wheel_buffer=[0,0] 
-
    # HUD info
    display_hud = 1
    txt_val='0'
@@ -1212,6 +829,11 @@ class ViewportState:
    # not clear yet
    data_min = 0
    data_max = 255
+   # robust range of the data: its 1st and 99th percentiles
+   range_min = 0
+   range_max = 255
+   range_reset = None
+   visible_range_key = None
 
    # VISUALIZE FLOW
    TOGGLE_FLOW_COLORS = 0
@@ -1230,6 +852,7 @@ class ViewportState:
       V.bias_vector[1] = (V.v_radius - V.v_center_vector[1])*V.scale_param
       V.bias_vector[2] = (V.v_radius - V.v_center_vector[2])*V.scale_param
       V.inv_param   = 0
+      V.range_reset = None
       V.redisp=1
 
    def radius_update(V, offset):
@@ -1253,14 +876,49 @@ class ViewportState:
       V.v_center_vector = centervec
       V.update_scale_and_bias()
    
-   def reset_scale_bias(V):
-      V.v_radius=(V.data_max-V.data_min)/2.0
-      V.v_center=(V.data_max+V.data_min)/2.0
+   def reset_scale_bias(V, full_range=False):
+      ''' stretch the robust range of the data (or its full range) '''
+      vmin,vmax = V.range_min,V.range_max
+      if full_range or not vmin < vmax:
+         vmin,vmax = V.data_min,V.data_max
+      V.set_range(vmin,vmax)
+      V.range_reset = 'full' if full_range else 'robust'
+
+   def set_range(V, vmin, vmax):
+      V.v_radius=(vmax-vmin)/2.0
+      V.v_center=(vmax+vmin)/2.0
       V.v_center_vector[0] = V.v_center
       V.v_center_vector[1] = V.v_center
       V.v_center_vector[2] = V.v_center
       V.update_scale_and_bias()
 
+   def visible_region(V):
+      ''' the rectangle of the image shown in the window: x0,y0,x1,y1 '''
+      from math import floor, ceil
+      x0,y0 = V.dx-V.dragdx, V.dy-V.dragdy
+      return (int(floor(x0)), int(floor(y0)),
+              int(ceil(x0 + V.winx/V.zoom_param)), int(ceil(y0 + V.winy/V.zoom_param)))
+
+   def reset_scale_bias_visible(V, D):
+      ''' stretch the robust range of the visible part of the image,
+          from the histograms of the tiles and of their blocks (piio.image_stats
+          with region), only when the view changed '''
+      import piio
+      region = V.visible_region()
+      if V.visible_range_key == (D, region):
+         return
+      V.visible_range_key = (D, region)
+      if not hasattr(piio, 'image_stats'):
+         return
+      st = piio.image_stats(D.imageBitmapTiles, region=region)
+      if st is None:
+         return
+      vmin,vmax = st['percentiles_all'][1],st['percentiles_all'][99]
+      if not vmin < vmax:
+         vmin,vmax = min(st['min']),max(st['max'])
+      if vmin <= vmax:
+         V.set_range(vmin,vmax)
+
 
    def reset_range_to_8bits(V): 
       V.v_center = 127.5
@@ -1349,21 +1007,73 @@ class ImageState:
    imageBitmapTiles=0
    v_max = 0
    v_min = 0
+   # statistics of the tiles (piio.image_stats) and 1st and 99th percentiles
+   stats = None
+   p_min = 0
+   p_max = 0
    mtime = 0
+   gpu_bytes = 0
+   host_bytes = 0
+   # see tile_vertex_buffer
+   vertex_buffer = None
+   # see tile_at
+   tile_grids = None
+
+   def __init__(self):
+      # tiles of the image reduced 2,4,8... times (piio.build_pyramid)
+      self.pyramid = []
+      # tiles to be uploaded, see start_texture_upload
+      self.upload_queue = []
+
+   def tile_grid(self, l=0):
+      ''' the tiles of the level l (0 is the image, then the pyramid)
+          indexed by (x//tile width, y//tile height): (tw,th,nx,ny,grid),
+          with the tile (i,j) in grid[i + j*nx] '''
+      if self.tile_grids is None:
+         self.tile_grids = {}
+      if l not in self.tile_grids:
+         tiles = ([self.imageBitmapTiles] + self.pyramid)[l]
+         tw,th = tiles[0][3], tiles[0][4]
+         nx = max(tile[1] for tile in tiles)//tw + 1
+         ny = max(tile[2] for tile in tiles)//th + 1
+         grid = [None] * (nx*ny)
+         for tile in tiles:
+            grid[tile[1]//tw + tile[2]//th*nx] = tile
+         self.tile_grids[l] = (tw,th,nx,ny,grid)
+      return self.tile_grids[l]
+
+   def tile_at(self,x,y):
+      ''' the tile containing the pixel (x,y) of the image '''
+      tw,th,nx,ny,grid = self.tile_grid()
+      return grid[x//tw + y//th*nx]
 
    def get_image_point(self,x,y):
       if x>=0 and y>=0 and x<self.w and y<self.h:
          #### ACCESS THE RIGHT TILE
-         for tile in self.imageBitmapTiles:
-            if tile[1] <= x and tile[2] <= y and tile[1]+tile[3] > x and tile[2]+tile[4] > y:
-               idx = (x-tile[1]+(y-tile[2])*tile[3])*tile[5]
-               return tile[0][idx:idx+tile[5]]
-         # this should never happen
-         print("this should never happen")
-         return None
+         tile = self.tile_at(x,y)
+         if tile is None:
+            # this should never happen
+            print("this should never happen")
+            return None
+         idx = (x-tile[1]+(y-tile[2])*tile[3])*tile[5]
+         if tile[0]._type_ not in TEXTURE_TYPES:
+            import piio   # float16 tiles (-halfcache)
+            return piio.half_values(tile[0], idx, tile[5])
+         return tile[0][idx:idx+tile[5]]
       else:
          return None
 
+   def get_image_points(self,points):
+      ''' the values of the pixels (x,y) of points, in an array of
+          len(points)*nch floats, nan for the pixels outside the image '''
+      from array import array
+      values = array('d')
+      nan = [float('nan')]*self.nch
+      for x,y in points:
+         v = self.get_image_point(int(x),int(y))
+         values.extend(nan if v is None else v)
+      return values
+
 
 
 ## TODO MERGE D AND DD
@@ -1373,9 +1083,78 @@ class DataBackend:
    pass
    
 
+def tile_host_bytes(tile):
+   ''' bytes of the samples of a tile and of its summary (piio.tile_stats) '''
+   stats = tile[7] if len(tile) > 7 and tile[7] else []
+   return ctypes.sizeof(tile[0]) + sum(ctypes.sizeof(a) for a in stats)
+
+
+class ImageCache:
+   ''' the images already read (ImageState) by filename, the least recently
+       used are dropped when their tiles (and the summaries of the tiles)
+       take more than max_bytes '''
+   def __init__(self, max_bytes=2<<30):
+      self.max_bytes = max_bytes
+      self.images = {}    # filename -> ImageState
+      self.order  = []    # filenames, least recently used first
+      self.nbytes = 0     # bytes of the tiles of the images, see tile_host_bytes
+      self.hits   = 0
+      self.misses = 0
+
+   def __contains__(self, filename):
+      return filename in self.images
+
+   def __len__(self):
+      return len(self.images)
+
+   def get(self, filename):
+      ''' the image read from the file (counted as a hit), or None (a miss) '''
+      T = self.images.get(filename)
+      if T is None:
+         self.misses += 1
+         return None
+      self.hits += 1
+      self.order.remove(filename)
+      self.order.append(filename)
+      return T
+
+   def put(self, filename, T, keep=(), recent=True):
+      ''' adds the image and drops the old ones, those in keep last
+          with recent=False it is added as the least recently used (an
+          image decoded in advance), and it is dropped itself if it does
+          not fit '''
+      if filename in self.images:
+         self.pop(filename)
+      T.host_bytes = sum(tile_host_bytes(tile) for tiles in [T.imageBitmapTiles] + T.pyramid for tile in tiles)
+      self.images[filename] = T
+      if recent:
+         self.order.append(filename)
+      else:
+         self.order.insert(0, filename)
+      self.nbytes += T.host_bytes
+      # the most recently used image is never dropped
+      old = self.order[:-1]
+      for f in [f for f in old if f not in keep] + [f for f in old if f in keep]:
+         if self.nbytes <= self.max_bytes:
+            break
+         self.pop(f)
+
+   def pop(self, filename):
+      ''' removes the image, and its textures from the GPU '''
+      T = self.images.pop(filename)
+      self.order.remove(filename)
+      self.nbytes -= T.host_bytes
+      release_textures(T)
+      return T
+
+   def clear(self):
+      for f in list(self.images):
+         self.pop(f)
+
+
 V = ViewportState()
 D = ImageState()
-DD = {}
+DD = ImageCache()
 current_image_idx=0
 
 
@@ -1384,17 +1163,165 @@ def load_image(imagename):
    import piio
    try:
 #      im,w,h,nch = piio.read_buffer(imagename)
-      tiles,w,h,nch,vmin,vmax = piio.read_tiled_buffers(imagename)
+      if TILE_CACHE_DIR and hasattr(piio, 'read_tiled_buffers_cached'):
+         tiles,w,h,nch,vmin,vmax,pyramid = piio.read_tiled_buffers_cached(imagename, TILE_CACHE_DIR,
+                                                                          native=True, max_bytes=TILE_CACHE_BYTES)
+      else:
+         tiles,w,h,nch,vmin,vmax = piio.read_tiled_buffers(imagename, native=True)
+         pyramid = piio.build_pyramid(tiles,w,h,nch) if hasattr(piio, 'build_pyramid') else []
 #      (im,x0,y0,w,h,nch) = tiles[0]
 #      v_min,v_max=0.0,255.0
 #      v_min,v_max = piio.minmax(im)
 #      print max(map(lambda x: float('nan') if math.isinf(x) else  x , im))
-      return tiles,w,h,nch,vmin,vmax
+      stats = piio.image_stats(tiles) if hasattr(piio, 'image_stats') else None
+      # the statistics come from the float samples, the probe reads the rounded ones
+      if HALF_CACHE and hasattr(piio, 'to_half'):
+         tiles, pyramid = piio.to_half(tiles), [piio.to_half(level) for level in pyramid]
+      return tiles,w,h,nch,vmin,vmax,stats,pyramid
    except (SystemError, IOError) as e:
       print('error reading the image: %s'%e)
       raise IOError
 
 
+def file_mtime(filename):
+   ''' modification time of the file, -1 if it cannot be read '''
+   from os import stat
+   try:
+      return stat(filename).st_mtime
+   except OSError:
+      return -1
+
+
+class Prefetcher:
+   ''' decodes images in background threads: the image being opened and
+       the ones around it (the texture upload stays on the main thread)
+       the main loop moves the decoded neighbours to DD (store_prefetched)
+   '''
+   # returned by take while the image is still being decoded
+   PENDING = 'pending'
+
+   def __init__(self, nworkers=2):
+      import threading
+      self.cond    = threading.Condition()
+      self.queue   = []   # filenames waiting for a worker, first ones first
+      self.running = set()
+      self.done    = {}   # filename -> (mtime, load_image result or None)
+      self.wanted  = set()
+      self.first   = None # the image being opened, kept until it is taken
+      for i in range(nworkers):
+         t = threading.Thread(target=self.worker)
+         t.daemon = True
+         t.start()
+
+   def request(self, filenames):
+      ''' decode these files (and forget the previous requests) '''
+      with self.cond:
+         self.wanted = set(filenames)
+         if self.first:
+            self.wanted.add(self.first)
+            filenames = [self.first] + list(filenames)
+         for f in list(self.done):
+            if f not in self.wanted:
+               self.done.pop(f)
+         self.queue = [f for f in filenames if f not in self.done and f not in self.running]
+         self.cond.notify_all()
+
+   def finished(self):
+      ''' takes the decoded images, but the one being opened: a list of
+          (filename, mtime, result of load_image or None) '''
+      with self.cond:
+         names = [f for f in self.done if f != self.first]
+         return [(f,) + self.done.pop(f) for f in names]
+
+   def cancel_first(self):
+      ''' the image being opened is not waited for anymore '''
+      with self.cond:
+         self.first = None
+
+   def take(self, filename, block=True):
+      ''' the result of load_image(filename) if it was prefetched, None
+          otherwise (or if the file changed or could not be read)
+          with block=True waits if it is being decoded, with block=False
+          returns PENDING and decodes it before anything else '''
+      with self.cond:
+         if not block and filename not in self.done:
+            self.first = filename
+            self.wanted.add(filename)
+            if filename in self.queue:
+               self.queue.remove(filename)
+            if filename not in self.running:
+               self.queue.insert(0, filename)
+            self.cond.notify_all()
+            return Prefetcher.PENDING
+         if filename in self.queue:
+            self.queue.remove(filename)
+         while filename in self.running:
+            self.cond.wait()
+         if self.first == filename:
+            self.first = None
+         mtime, r = self.done.pop(filename, (None, None))
+      if r is not None and file_mtime(filename) == mtime:
+         return r
+      return None
+
+   def worker(self):
+      while True:
+         with self.cond:
+            while not self.queue:
+               self.cond.wait()
+            filename = self.queue.pop(0)
+            self.running.add(filename)
+         mtime = file_mtime(filename)
+         try:
+            r = load_image(filename)
+         except Exception:   # change_image reports it when reading it again
+            r = None
+         with self.cond:
+            self.running.discard(filename)
+            if filename in self.wanted:
+               self.done[filename] = (mtime, r)
+            self.cond.notify_all()
+         try:
+            glfw.post_empty_event()   # wake up the main loop
+         except Exception:            # not available, or glfw terminated
+            pass
+
+PREFETCH = None
+
+
+def neighbour_files(idx):
+   ''' the files of the PREFETCH_RADIUS images after and before idx, closest first '''
+   NUM_FILES = len(sys.argv)-1
+   names = []
+   for d in range(1, PREFETCH_RADIUS+1):
+      for i in ((idx+d) % NUM_FILES, (idx-d) % NUM_FILES):
+         f = sys.argv[i+1]
+         if f != sys.argv[idx+1] and f not in names:
+            names.append(f)
+   return names
+
+
+def prefetch_neighbours(idx):
+   ''' starts decoding the images around idx that are not in DD '''
+   # pipes can only be read once
+   names = [f for f in neighbour_files(idx) if f not in DD and f != '-' and not f.startswith('/dev/')]
+   get_prefetcher().request(names)
+
+
+def get_prefetcher():
+   global PREFETCH
+   if PREFETCH is None:
+      # one worker for the image being opened and one per neighbour, up to
+      # the number of processors (each decoder is also multithreaded)
+      import multiprocessing
+      try:
+         ncpu = multiprocessing.cpu_count()
+      except NotImplementedError:
+         ncpu = 1
+      PREFETCH = Prefetcher(max(1, min(1 + 2*PREFETCH_RADIUS, ncpu)))
+   return PREFETCH
+
+
 def insert_images(filenames):
    global current_image_idx
    import sys
@@ -1419,81 +1346,154 @@ def remove_current_image():
     name = sys.argv.pop(current_image_idx+1)
     print ("Dropping %s"%name)
 
-    if current_image_idx in DD:
-       print(DD[current_image_idx])
-       DD.pop(current_image_idx)
+    if name in DD and name not in sys.argv[1:]:
+       DD.pop(name)
     return True
 
 
-def change_image(new_idx):
+# (index, filename) of the image being decoded by change_image, shown when ready
+PENDING_IMAGE = None
+
+
+def change_image(new_idx, block=False):
    '''updates D and DD: acts as a cache of the images
       returns the idx value of the next valid image
+      an image that is not in DD is decoded in background (unless block is
+      set) and replaces D when poll_pending_image finds it ready, its tiles
+      are then uploaded a few per frame by upload_textures
    '''
-   global D,DD
+   global D,DD,PENDING_IMAGE
 
-   BUFF=10  # BUFFERED IMAGES
    NUM_FILES    = (len(sys.argv)-1)
    new_idx_bak  = new_idx
    new_idx      = new_idx % NUM_FILES
    new_filename = sys.argv[new_idx+1]
 
-   from os import stat, path
    # check if the file was already read before
-   if new_idx in DD:
-      if new_filename != '-' and not new_filename.startswith('/dev/') and DD[new_idx].mtime != -1 and \
-        (DD[new_idx].mtime < stat(new_filename).st_mtime or DD[new_idx].filename != new_filename):
+   T = DD.get(new_filename)
+   if T is not None:
+      if new_filename != '-' and not new_filename.startswith('/dev/') and T.mtime != -1 and \
+        T.mtime < file_mtime(new_filename):
          print(new_filename + ' has changed. Reloading...')
-         DD.pop(new_idx)
+         DD.pop(new_filename)
+         T = None
 
    # the image seems to be there
-   if new_idx not in DD:
-      # load_image may trow an exception if the file is not readable or it doesn't exist
-      try:
-         T = DD[new_idx] = ImageState()
-
-         tic()
-         # read the image
-         T.imageBitmapTiles,T.w,T.h,T.nch,T.v_min,T.v_max = load_image(new_filename)
-         T.filename = new_filename
-         try:   # if mtime cannot be read, then set it to -1
-            T.mtime = (stat(new_filename).st_mtime)
-         except OSError:
-            T.mtime = -1
-         setupTexturesFromImageTiles(T.imageBitmapTiles,T.w,T.h,T.nch)
-         V.data_min, V.data_max =  T.v_min,T.v_max
-         toc('loadImage+data->RGBbitmap+texture setup')
-
-         D = T     # everything is ok, update the corrent image data
-      except IOError:
-         DD.pop(new_idx)
-         print(new_filename + '. Skipping...')
-         sys.argv.pop(new_idx+1)
-         if len(sys.argv) == 1: 
-            print('self destruct!\n')
-            #glfw.set_window_should_close(window,1) #window not available
-            exit(1)
-         return new_idx_bak
-
-      # tidy up memory 
-      if NUM_FILES > BUFF*2:
-         if ((new_idx-BUFF) % NUM_FILES) in DD:
-           DD.pop((new_idx-BUFF) % NUM_FILES)
-   
-         if ((new_idx+BUFF) % NUM_FILES) in DD:
-           DD.pop((new_idx+BUFF) % NUM_FILES)
-
-   else:
-      D = DD[new_idx]
+   if T is not None:
+      if PENDING_IMAGE and PREFETCH:
+         PREFETCH.cancel_first()
+      PENDING_IMAGE = None
+      D = T
 
       # setup texture 
-      #tic()
-      setupTexturesFromImageTiles(D.imageBitmapTiles,D.w,D.h,D.nch)
+      start_texture_upload(D)
       V.data_min, V.data_max=  D.v_min,D.v_max 
-      #toc('texture setup')
+      V.range_min, V.range_max=  D.p_min,D.p_max
+
+      print (new_idx,D.filename, (D.w,D.h,D.nch), (D.v_min,D.v_max))
+      prefetch_neighbours(new_idx)
+      return new_idx
+
+   # read the image, unless it was decoded in background
+   tic()
+   image = get_prefetcher().take(new_filename, block)
+   if image is Prefetcher.PENDING:
+      PENDING_IMAGE = new_idx, new_filename
+      prefetch_neighbours(new_idx)
+      return new_idx
+   PENDING_IMAGE = None
+   if not show_image(new_idx, new_filename, image):
+      return new_idx_bak
+   return new_idx
+
+
+def poll_pending_image():
+   '''shows the image requested to change_image once it is decoded,
+      returns True if it is still being decoded
+   '''
+   global current_image_idx, PENDING_IMAGE
+   store_prefetched()
+   if PENDING_IMAGE is None:
+      return False
+   new_idx, new_filename = PENDING_IMAGE
+   image = get_prefetcher().take(new_filename, block=False)
+   if image is Prefetcher.PENDING:
+      return True
+   PENDING_IMAGE = None
+   if show_image(new_idx, new_filename, image):
+      current_image_idx = new_idx
+      if V.TOGGLE_AUTOMATIC_RANGE: V.reset_scale_bias()
+   else:    # it could not be read: show the one that took its place
+      current_image_idx = change_image(new_idx)
+   V.redisp=1
+   V.resize=1
+   return PENDING_IMAGE is not None
+
+
+def store_prefetched():
+   '''moves the neighbours decoded in background to DD, where change_image
+      finds them and where they count in DD.max_bytes: they are the first
+      dropped, and they are not kept if the current image and its
+      neighbours already fill the budget
+   '''
+   if PREFETCH is None:
+      return
+   idx = PENDING_IMAGE[0] if PENDING_IMAGE else current_image_idx
+   keep = neighbour_files(idx) + [getattr(D, 'filename', None)]
+   for filename, mtime, image in PREFETCH.finished():
+      if image is None or filename in DD or file_mtime(filename) != mtime:
+         continue
+      T = image_state(filename, image)
+      T.mtime = mtime
+      DD.put(filename, T, keep=keep, recent=False)
+
+
+def image_state(filename, image):
+   '''the ImageState of the result of load_image'''
+   T = ImageState()
+   T.imageBitmapTiles,T.w,T.h,T.nch,T.v_min,T.v_max,T.stats,T.pyramid = image
+   T.p_min,T.p_max = T.v_min,T.v_max
+   if T.stats:
+      T.p_min,T.p_max = T.stats['percentiles_all'][1],T.stats['percentiles_all'][99]
+   T.filename = filename
+   return T
+
+
+def show_image(new_idx, new_filename, image):
+   '''makes the decoded image (or the one read now if image is None) the
+      current one, returns False if it cannot be read
+   '''
+   global D,DD
+
+   # load_image may trow an exception if the file is not readable or it doesn't exist
+   try:
+      if image is None:
+         image = load_image(new_filename)
+      T = image_state(new_filename, image)
+      # if mtime cannot be read, then it is -1
+      T.mtime = file_mtime(new_filename)
+      start_texture_upload(T)
+      V.data_min, V.data_max =  T.v_min,T.v_max
+      V.range_min, V.range_max =  T.p_min,T.p_max
+      toc('loadImage+data->RGBbitmap')
+
+      D = T     # everything is ok, update the corrent image data
+   except IOError:
+      print(new_filename + '. Skipping...')
+      sys.argv.pop(new_idx+1)
+      if len(sys.argv) == 1: 
+         print('self destruct!\n')
+         #glfw.set_window_should_close(window,1) #window not available
+         exit(1)
+      return False
+
+   # tidy up memory: the images around this one are dropped last
+   DD.put(new_filename, T, keep=neighbour_files(new_idx))
 
    print (new_idx,D.filename, (D.w,D.h,D.nch), (D.v_min,D.v_max))
 
-   return new_idx
+   prefetch_neighbours(new_idx)
+   return True
 
 
 ### TODO MOVE MOUSE STATE VARIABLES
@@ -1504,51 +1504,103 @@ x0=0; y0=0; w0=0; h0=0; b0state=''; b1state=''
 
 
 
-def mouseMotion_callback(window, x,y):
-    import math 
-    global V,D
+#### INPUT EVENTS
+class InputEvents:
+   ''' the input received since the last frame: the callbacks only record
+       it and apply_input handles it once per frame, so that fast mouse
+       motion, wheel scrolls and key repeats do not queue up work '''
+   def __init__(self):
+      self.title = None   # last window title
+      self.clear()
+
+   def clear(self):
+      self.cursor = None  # last cursor position, if it moved
+      self.wheel  = [0,0] # wheel offsets, added up
+      self.image  = None  # image change: 'next', 'prev' or 'remove'
+
+INPUT = InputEvents()
+
+
+def apply_input(window):
+    ''' handles the input events recorded since the last frame '''
+    import math
+    global current_image_idx
     global x0,y0,w0,h0,b0state,b1state
 
-    # compute real image coordinates
-    tx,ty = V.compute_image_coordinates(x,y)
+    if INPUT.image is not None:
+       new_current_image_idx = current_image_idx
+       if INPUT.image == 'remove':
+          if remove_current_image():
+             new_current_image_idx = change_image(current_image_idx)
+             current_image_idx = -1  #FIXME forced refresh: image index hasn't changed by the image has
+             if V.TOGGLE_AUTOMATIC_RANGE: V.reset_scale_bias()
+       else:
+          new_current_image_idx = change_image(current_image_idx + (1 if INPUT.image == 'next' else -1))
+          if V.TOGGLE_AUTOMATIC_RANGE: V.reset_scale_bias()
+
+       if not new_current_image_idx == current_image_idx:
+          current_image_idx = new_current_image_idx
+          V.redisp=1
+          V.resize=1
 
-    ### region selection
-    if b1state=='pressed' :
-       w0,h0 = tx-x0,ty-y0
-       V.redisp=1
-    if b0state=='pressed' :
-       V.dragdx,V.dragdy = tx-V.dragx0,ty-V.dragy0
-       V.redisp=1
-    # adjust bias usign concrete pixel
-    if V.shift_is_pressed and not V.mute_sweep:
+    if INPUT.cursor is not None:
+       x,y = INPUT.cursor
+
+       # compute real image coordinates
+       tx,ty = V.compute_image_coordinates(x,y)
+
+       ### region selection
+       if b1state=='pressed' :
+          w0,h0 = tx-x0,ty-y0
+       if b0state=='pressed' :
+          V.dragdx,V.dragdy = tx-V.dragx0,ty-V.dragy0
        centerval = D.get_image_point(int(tx),int(ty))
-       if not (centerval==None or math.isnan(sum(centerval)) or math.isinf(sum(centerval))):
-          V.center_update_value(sum(centerval)/len(centerval))
-          if len(centerval)==3:
-              V.center_update_vector(centerval)
-          V.mute_sweep=1
-
-
-    centerval = D.get_image_point(int(tx),int(ty))
-    V.txt_pos = '%s %s'%(int(tx),int(ty))
-    if not centerval==None:
-       if len(centerval)==1:
-          V.txt_val = '%s'%(centerval[0])
-       elif len(centerval)==2:
-          V.txt_val = '%s %s'%(centerval[0], centerval[1])
-       else:
-          V.txt_val = '%s %s %s'%(centerval[0], centerval[1], centerval[2])
-       glfw.set_window_title(window, '%s:[%s]'%(V.txt_pos,V.txt_val))
+       # adjust bias usign concrete pixel
+       if V.shift_is_pressed:
+          if not (centerval==None or math.isnan(sum(centerval)) or math.isinf(sum(centerval))):
+             V.center_update_value(sum(centerval)/len(centerval))
+             if len(centerval)==3:
+                 V.center_update_vector(centerval)
+
+       V.txt_pos = '%s %s'%(int(tx),int(ty))
+       if not centerval==None:
+          if len(centerval)==1:
+             V.txt_val = '%s'%(centerval[0])
+          elif len(centerval)==2:
+             V.txt_val = '%s %s'%(centerval[0], centerval[1])
+          else:
+             V.txt_val = '%s %s %s'%(centerval[0], centerval[1], centerval[2])
+          title = '%s:[%s]'%(V.txt_pos,V.txt_val)
+          if title != INPUT.title:
+             glfw.set_window_title(window, title)
+             INPUT.title = title
 
-    # Update viewport mouse position
-    V.mx, V.my = x, y
+       # Update viewport mouse position
+       V.mx, V.my = x, y
 
-    # this seems to be needed by the non-composed window managers
-    V.redisp = 1
+       # this seems to be needed by the non-composed window managers
+       V.redisp = 1
 
+    if INPUT.wheel != [0,0]:
+       xoffset,yoffset = INPUT.wheel
+       curr_x,curr_y = V.mx, V.my
+       # zoom
+       if V.alt_is_pressed:
+          V.zoom_update(yoffset*GLOBAL_WHEEL_SCALING*GLOBAL_WHEEL_SCALING,curr_x,curr_y)
+       # scale
+       elif V.shift_is_pressed:
+          V.radius_update(yoffset*GLOBAL_WHEEL_SCALING)
+       # bias and scale
+       else: # nothing pressed
+          V.center_update(yoffset*GLOBAL_WHEEL_SCALING)
+          V.radius_update(xoffset*GLOBAL_WHEEL_SCALING)
 
-#    title='p:%s,%s [+%s+%s %sx%s]' % (x+V.dx,y+V.dy,x0+V.dx,y0+V.dy,w0,h0)
-#    glfw.set_window_title(window, title)
+    INPUT.clear()
+
+
+def mouseMotion_callback(window, x,y):
+    # handled by apply_input
+    INPUT.cursor = (x,y)
 
 
 
@@ -1600,29 +1652,9 @@ def mouseButtons_callback(window, button, action, mods):
 
 
 def mouseWheel_callback(window, xoffset, yoffset):
-      global V,D
-      if V.mute_wheel:
-         V.mute_wheel_buffer[0]=V.mute_wheel_buffer[0]+xoffset
-         V.mute_wheel_buffer[1]=V.mute_wheel_buffer[1]+yoffset
-         return
-      else:
-         xoffset=xoffset+V.mute_wheel_buffer[0]
-         yoffset=yoffset+V.mute_wheel_buffer[1]
-         V.mute_wheel_buffer = [0,0]
-         V.mute_wheel=1
-
-      curr_x,curr_y = glfw.get_cursor_pos (window)
-
-      # zoom
-      if V.alt_is_pressed:
-         V.zoom_update(yoffset*GLOBAL_WHEEL_SCALING*GLOBAL_WHEEL_SCALING,curr_x,curr_y)
-      # scale
-      elif V.shift_is_pressed:
-         V.radius_update(yoffset*GLOBAL_WHEEL_SCALING)
-      # bias and scale
-      else: # nothing pressed
-         V.center_update(yoffset*GLOBAL_WHEEL_SCALING)
-         V.radius_update(xoffset*GLOBAL_WHEEL_SCALING)
+    # handled by apply_input
+    INPUT.wheel[0] += xoffset
+    INPUT.wheel[1] += yoffset
 
 
 
@@ -1632,9 +1664,6 @@ def keyboard_callback(window, key, scancode, action, mods):
     global V,D
     global HELPstr
 
-    if V.mute_keyboard: # only mute the spacebar event
-       return
-
     key_name = glfw.get_key_name(key, 0);
     # this the actual letter independently of the keyboard
     if type(key_name)!=type(None) and 'A' <= key_name and key_name <= 'z':
@@ -1659,11 +1688,15 @@ def keyboard_callback(window, key, scancode, action, mods):
     if key==glfw.KEY_D and (action==glfw.PRESS or action==glfw.REPEAT):
        V.radius_update(-1)
     if key==glfw.KEY_C and action==glfw.PRESS:
-       V.reset_scale_bias()
+       # a second C shows the full range of the data
+       V.reset_scale_bias(full_range = V.range_reset == 'robust' and not V.shift_is_pressed)
        if V.shift_is_pressed:
-         V.TOGGLE_AUTOMATIC_RANGE = (V.TOGGLE_AUTOMATIC_RANGE + 1) % 2
-         if V.TOGGLE_AUTOMATIC_RANGE: 
+         V.TOGGLE_AUTOMATIC_RANGE = (V.TOGGLE_AUTOMATIC_RANGE + 1) % 3
+         V.visible_range_key = None
+         if V.TOGGLE_AUTOMATIC_RANGE == 1: 
             print("automatic range enabled")
+         elif V.TOGGLE_AUTOMATIC_RANGE == 2: 
+            print("automatic range of the visible area enabled")
          else: 
             print("automatic range disabled")
          
@@ -1732,7 +1765,7 @@ def keyboard_callback(window, key, scancode, action, mods):
 
     # reset visualization
     if key==glfw.KEY_1 and action==glfw.PRESS:
-       V.TOGGLE_FLOW_COLORS = (V.TOGGLE_FLOW_COLORS + 1) % 9
+       V.TOGGLE_FLOW_COLORS = (V.TOGGLE_FLOW_COLORS + 1) % (9 + len(COLORMAP_CYCLE))
        V.redisp = 1
        HELPstr="Color palette index: %d\n"%V.TOGGLE_FLOW_COLORS + \
                "=======================\n"
@@ -1740,6 +1773,13 @@ def keyboard_callback(window, key, scancode, action, mods):
 
 
 
+    # precision of the float textures
+    if key==glfw.KEY_G and action==glfw.PRESS:
+       toggle_half_textures()
+       print("float textures stored as %s"%('half floats' if HALF_TEXTURES else 'floats'))
+       V.redisp=1
+
+
     # modifier keys
     if key==glfw.KEY_LEFT_SHIFT and action==glfw.PRESS:
        V.shift_is_pressed=1
@@ -1752,29 +1792,15 @@ def keyboard_callback(window, key, scancode, action, mods):
 
 
     # CHANGE IMAGE TODO: use DataBackend DD
-    global current_image_idx
-    new_current_image_idx = current_image_idx
+    # (one change per frame, the key repeats in between are dropped)
     if key==glfw.KEY_SPACE and (action==glfw.PRESS or action==glfw.REPEAT):
-       new_current_image_idx = change_image(current_image_idx+1)
-       if V.TOGGLE_AUTOMATIC_RANGE: V.reset_scale_bias()
-       V.mute_keyboard=1
+       INPUT.image = INPUT.image or 'next'
 
     if key==glfw.KEY_BACKSPACE and (action==glfw.PRESS or action==glfw.REPEAT):
-       new_current_image_idx = change_image(current_image_idx-1)
-       if V.TOGGLE_AUTOMATIC_RANGE: V.reset_scale_bias()
-       V.mute_keyboard=1
+       INPUT.image = INPUT.image or 'prev'
 
     if key==glfw.KEY_MINUS and (action==glfw.PRESS or action==glfw.REPEAT):
-       if remove_current_image():
-          new_current_image_idx = change_image(current_image_idx)
-          current_image_idx = -1  #FIXME forced refresh: image index hasn't changed by the image has
-          if V.TOGGLE_AUTOMATIC_RANGE: V.reset_scale_bias()
-          V.mute_keyboard=1
-
-    if not new_current_image_idx == current_image_idx:
-       current_image_idx = new_current_image_idx
-       V.redisp=1
-       V.resize=1
+       INPUT.image = INPUT.image or 'remove'
 
     # display hud
     if key==glfw.KEY_U   and action==glfw.PRESS:
@@ -1789,12 +1815,13 @@ def keyboard_callback(window, key, scancode, action, mods):
                "arrows: pan image\n" + \
                "P,M   : zoom image in/out\n" + \
                "F     : fit image to window size\n" + \
-               "C     : reset intensity range\n" + \
-               "shiftC: automatically reset range\n" + \
+               "C     : reset intensity range to 1%-99%, again: min-max\n" + \
+               "shiftC: automatically reset range: image, visible area, off\n" + \
                "B     : set range to [0:255]\n" + \
                "D,E   : range scale up/down\n" + \
                "R     : reset visualization: zoom,pan,range\n" + \
                "1     : cycle palette: optic flow,jet,negative...\n" + \
+               "G     : store float textures as half floats or floats\n" + \
                "S     : capture a snap##.png of current window\n" + \
                "-     : remove current file from view list\n" + \
                "Z     : zoom modifier for the mouse wheel\n" + \
@@ -1850,26 +1877,131 @@ def unicode_char_callback(window, codepoint):
 
 
 def drop_callback(window, filenames):
-    global V
-    global current_image_idx
-
     insert_images(filenames)
 
-    # change the image and refresh
-    new_current_image_idx = current_image_idx
-    new_current_image_idx = change_image(current_image_idx+1)
-    if V.TOGGLE_AUTOMATIC_RANGE: V.reset_scale_bias()
-    V.mute_keyboard=1
-
-    if not new_current_image_idx == current_image_idx:
-       current_image_idx = new_current_image_idx
-       V.redisp=1
-       V.resize=1
+    # change the image (to the first dropped one) and refresh
+    INPUT.image = 'next'
 
     # regain focus after drop
     glfw.focus_window(window);
 
 
+#### HUD FONT
+# the characters 32 to 126 of the X11 misc-fixed 8x13 font (the public domain
+# font of GLUT_BITMAP_8_BY_13): 14 rows of 8 pixels, from the bottom one, the
+# baseline is 3 rows above the bottom
+HUD_FONT = (
+      '0000000000000000000000000000000000100010101010101010000000000000000000'
+      '000024242400000000000024247e247e2424000000000000107814143850503c100000'
+      '000000442a2410080824522200000000003a444a304848300000000000000000000000'
+      '0000403038000000000004080810101008080400000000002010100808081010200000'
+      '000000000024187e182400000000000000000010107c10100000000000004030380000'
+      '00000000000000000000000000007e0000000000000000103810000000000000000000'
+      '000000808040201008040202000000000018244242424242241800000000007c101010'
+      '101050301000000000007e402018040242423c00000000003c4202021c0804027e0000'
+      '00000004047e444424140c0400000000003c420202625c40407e00000000003c424262'
+      '5c4040201c000000000020201010080804027e00000000003c4242423c4242423c0000'
+      '000000380402023a4642423c0000000010381000001038100000000000004030380000'
+      '10381000000000000000020408102010080402000000000000007e00007e0000000000'
+      '000000402010080408102040000000000008000808040242423c00000000003c404a56'
+      '524e42423c00000000004242427e42424224180000000000fc4242427c424242fc0000'
+      '0000003c424040404040423c0000000000fc42424242424242fc00000000007e404040'
+      '784040407e000000000040404040784040407e00000000003a46424e404040423c0000'
+      '000000424242427e4242424200000000007c101010101010107c000000000038440404'
+      '040404041f000000000042444850605048444200000000007e40404040404040400000'
+      '0000008282829292aac682820000000000424242464a5262424200000000003c424242'
+      '424242423c0000000000404040407c4242427c00000000023c4a5242424242423c0000'
+      '000000424448507c4242427c00000000003c4202023c4040423c000000000010101010'
+      '10101010fe00000000003c424242424242424200000000001028282844444482820000'
+      '00000044aa929292828282820000000000828244281028448282000000000010101010'
+      '102844828200000000007e404020100804027e00000000003c202020202020203c0000'
+      '0000000202040810204080800000000000780808080808080878000000000000000000'
+      '000044281000000000fe00000000000000000000000000000000000000000418380000'
+      '0000003a46423e023c00000000000000005c624242625c40404000000000003c424040'
+      '423c00000000000000003a464242463a02020200000000003c42407e423c0000000000'
+      '000000202020207c2020221c0000003c423c403844443a000000000000000042424242'
+      '625c40404000000000007c1010101030001000000000384444040404040c0004000000'
+      '00000042444870484440404000000000007c1010101010101030000000000082929292'
+      '92ec000000000000000042424242625c00000000000000003c424242423c0000000000'
+      '004040405c6242625c0000000000000202023a4642463a000000000000000020202020'
+      '225c00000000000000003c420c30423c00000000000000001c222020207c2020000000'
+      '0000003a44444444440000000000000000102828444444000000000000000044aa9292'
+      '828200000000000000004224181824420000000000003c42023a464242420000000000'
+      '0000007e201008047e00000000000000000e101008300810100e000000000010101010'
+      '10101010100000000000700808100c1008087000000000000000000000004854240000')
+HUD_FONT_W, HUD_FONT_H, HUD_FONT_BASE = 8, 14, 3
+HUD_LINE_SPACING = 13
+
+# alpha texture with the characters, 16 in each row (see hud_font_texture)
+HUD_FONT_TEXTURE = None
+
+def hud_font_texture():
+    global HUD_FONT_TEXTURE
+    if HUD_FONT_TEXTURE is None:
+       glyphs = bytearray.fromhex(HUD_FONT)
+       w, h = 16*HUD_FONT_W, (len(glyphs)//HUD_FONT_H + 15)//16*HUD_FONT_H
+       atlas = (ctypes.c_ubyte*(w*h))()
+       for c in range(len(glyphs)//HUD_FONT_H):
+          for i in range(HUD_FONT_H):
+             row = (c//16*HUD_FONT_H + i)*w + c%16*HUD_FONT_W
+             for b in range(HUD_FONT_W):
+                if glyphs[c*HUD_FONT_H + i] & (0x80 >> b):
+                   atlas[row + b] = 255
+       HUD_FONT_TEXTURE = (int(glGenTextures(1)), w, h)
+       glBindTexture(GL_TEXTURE_2D, HUD_FONT_TEXTURE[0])
+       glPixelStorei(GL_UNPACK_ALIGNMENT,1)
+       glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+       glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+       glTexImage2D(GL_TEXTURE_2D, 0, GL_ALPHA8, w, h, 0, GL_ALPHA, GL_UNSIGNED_BYTE, atlas)
+    return HUD_FONT_TEXTURE
+
+
+def drawHudText(items):
+    """draws the strings of items, a list of (text, color, pos), with the
+       characters of hud_font_texture: all the quads go in one call"""
+    texture, w, h = hud_font_texture()
+    quads = []
+    for text, color, pos in items:
+       r,g,b = color
+       x, y = pos[0], pos[1] + HUD_FONT_BASE
+       for c in text:
+          if c == '\n':
+             x, y = pos[0], y + HUD_LINE_SPACING
+             continue
+          c = ord(c) - 32 if ' ' <= c <= '~' else ord('?') - 32
+          u, v = c%16*HUD_FONT_W, c//16*HUD_FONT_H
+          x1, y1, u1, v1 = x + HUD_FONT_W, y - HUD_FONT_H, (u + HUD_FONT_W)/w, (v + HUD_FONT_H)/h
+          u, v = u/w, v/h
+          quads += [x ,y ,u ,v ,r,g,b,
+                    x1,y ,u1,v ,r,g,b,
+                    x1,y1,u1,v1,r,g,b,
+                    x ,y1,u ,v1,r,g,b]
+          x = x1
+    if not quads:
+       return
+    vertices = (ctypes.c_float*len(quads))(*quads)
+    stride = 7*ctypes.sizeof(ctypes.c_float)
+    address = ctypes.addressof(vertices)
+    glEnable(GL_TEXTURE_2D)
+    glBindTexture(GL_TEXTURE_2D, texture)
+    glTexEnvi(GL_TEXTURE_ENV, GL_TEXTURE_ENV_MODE, GL_MODULATE)
+    glEnable(GL_ALPHA_TEST)
+    glAlphaFunc(GL_GREATER, 0.5)
+    glEnableClientState(GL_VERTEX_ARRAY)
+    glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+    glEnableClientState(GL_COLOR_ARRAY)
+    glVertexPointer(2, GL_FLOAT, stride, ctypes.c_void_p(address))
+    glTexCoordPointer(2, GL_FLOAT, stride, ctypes.c_void_p(address + 8))
+    glColorPointer(3, GL_FLOAT, stride, ctypes.c_void_p(address + 16))
+    glDrawArrays(GL_QUADS, 0, len(quads)//7)
+    glDisableClientState(GL_COLOR_ARRAY)
+    glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+    glDisableClientState(GL_VERTEX_ARRAY)
+    glDisable(GL_ALPHA_TEST)
+    glBindTexture(GL_TEXTURE_2D, 0)
+    glDisable(GL_TEXTURE_2D)
+
+
 def display_refresh(window):
     global V
     V.redisp = 1
@@ -1879,6 +2011,8 @@ def display( window ):
 
     global D,V
     global program
+    global FRAME
+    FRAME = FRAME + 1
 
     glClear(GL_COLOR_BUFFER_BIT);
 
@@ -1890,6 +2024,10 @@ def display( window ):
     winx, winy= glfw.get_window_size(window)
     V.winx,V.winy=winx,winy
 
+    # automatic range of the visible area
+    if V.TOGGLE_AUTOMATIC_RANGE == 2:
+       V.reset_scale_bias_visible(D)
+
 
     # Query the native frame buffer resolution to honor HDPI monitors
     # https://github.com/adrianbroher/freetype-gl/commit/c8474a9f1723e013219ab871d6f40cf86159fe87
@@ -1936,53 +2074,10 @@ def display( window ):
        return
 
 
-    def drawImage(textureID,w,h,x0=0,y0=0):
-       """
-       glEnable (GL_TEXTURE_2D);
-       must be enabled before calling this function
-       """
-       glPushMatrix()
-       glBindTexture (GL_TEXTURE_2D, textureID); #/* bind to our texture, has id of 13 */
-   
-       # third operation
-       glScalef(V.zoom_param, V.zoom_param,1)
-
-       # second operation
-       glTranslate(-V.dx,-V.dy,0)
-       # second operation
-       glTranslate(V.dragdx,V.dragdy,0)
-
-       # first operation
-       glBegin( GL_QUADS );
-       glColor3f(1.0, 0.0, 0.0);
-       glTexCoord2d(0.0,1.0); glVertex3d(x0  ,y0+h ,0);
-       glTexCoord2d(1.0,1.0); glVertex3d(x0+w,y0+h ,0);
-       glTexCoord2d(1.0,0.0); glVertex3d(x0+w,y0   ,0);
-       glTexCoord2d(0.0,0.0); glVertex3d(x0  ,y0   ,0);
-       glEnd();
-
-       glPopMatrix()
-
-
+    # the text of the HUD is drawn at once by drawHudText
+    hud_text = []
     def drawHud(str,color=(0,1,0),pos=(8,13)):
-       #import OpenGL.GLUT as glut
-       #  A pointer to a font style..
-       #  Fonts supported by GLUT are: GLUT_BITMAP_8_BY_13,
-       #  GLUT_BITMAP_9_BY_15, GLUT_BITMAP_TIMES_ROMAN_10,
-       #  GLUT_BITMAP_TIMES_ROMAN_24, GLUT_BITMAP_HELVETICA_10,
-       #  GLUT_BITMAP_HELVETICA_12, and GLUT_BITMAP_HELVETICA_18.
-       font_style = glut.GLUT_BITMAP_8_BY_13
-       if display_scale>1:                  # RETINA
-          font_style = glut.GLUT_BITMAP_HELVETICA_18
-       glColor3f(color[0], color[1], color[2]);
-       line=0;
-       glRasterPos3f (pos[0], pos[1]+13*line,.5)
-       for i in str:
-          if  i=='\n':
-             line=line+1
-             glRasterPos3f (pos[0], pos[1]+13*line,.5)
-          else:
-             glut.glutBitmapCharacter(font_style, ord(i))
+       hud_text.append((str, color, pos))
     
     
     ## USE THE SHADER FOR RENDERING THE IMAGE
@@ -2005,8 +2100,7 @@ def display( window ):
           V.inv_param=1
           use_shader_program('djet')
        elif V.TOGGLE_FLOW_COLORS == 4:
-          V.inv_param=1
-          use_shader_program('dem')
+          use_colormap('dem')
        elif V.TOGGLE_FLOW_COLORS == 5:
           V.inv_param=1
           use_shader_program('rgba')
@@ -2014,11 +2108,12 @@ def display( window ):
           V.inv_param=0
           use_shader_program('bayer')
        elif V.TOGGLE_FLOW_COLORS == 7:
-          V.inv_param=0
-          use_shader_program('s2l2a')
+          use_colormap('s2l2a')
        elif V.TOGGLE_FLOW_COLORS == 8:
-          V.inv_param=0
-          use_shader_program('inferno')
+          # inverted, as the palette shaders of the depth maps
+          use_colormap('magma', 1)
+       elif V.TOGGLE_FLOW_COLORS >= 9:
+          use_colormap(COLORMAP_CYCLE[V.TOGGLE_FLOW_COLORS - 9])
        else:
           V.inv_param=0
           use_shader_program('rgba')
@@ -2041,29 +2136,86 @@ def display( window ):
 
 
     # set the values of the shader uniform variables (global)
-    shader_a= glGetUniformLocation(program, b"shader_a")
+    shader_a= uniform_location(b"shader_a")
     glUniform1f(shader_a,V.scale_param)
-    shader_b= glGetUniformLocation(program, b"shader_b")
+    shader_b= uniform_location(b"shader_b")
     glUniform1f(shader_b,V.bias_param)
-    shader_c= glGetUniformLocation(program, b"shader_c")
+    shader_c= uniform_location(b"shader_c")
     glUniform1i(shader_c,V.inv_param)
 
-    shader_B0 = glGetUniformLocation(program, b"shader_B0")
+    shader_B0 = uniform_location(b"shader_B0")
     glUniform1f(shader_B0, V.bias_vector[0])
-    shader_B1 = glGetUniformLocation(program, b"shader_B1")
+    shader_B1 = uniform_location(b"shader_B1")
     glUniform1f(shader_B1, V.bias_vector[1])
-    shader_B2 = glGetUniformLocation(program, b"shader_B2")
+    shader_B2 = uniform_location(b"shader_B2")
     glUniform1f(shader_B2, V.bias_vector[2])
 
+    _texscale = uniform_location(b"_texscale")
+    glUniform1f(_texscale, texture_type(D.imageBitmapTiles[0][0]._type_)[1])
+    _texnch = uniform_location(b"_texnch")
+    glUniform1i(_texnch, D.nch)
+
     # DRAW THE IMAGE
-    glEnable (GL_TEXTURE_2D); #/* enable texture mapping */
-    textureID=13
-    for tile in D.imageBitmapTiles:
-       _tilesz= glGetUniformLocation(program, b"_tilesz")
-       glUniform2f(_tilesz, tile[3], tile[4]);
-       drawImage(textureID,tile[3],tile[4],tile[1],tile[2])
-       textureID=textureID+1
-    glDisable (GL_TEXTURE_2D); #/* disable texture mapping */
+    # when zoomed out use the pyramid level with about one texel per screen pixel 
+    # (except for the bayer shader, which needs the actual pixels)
+    level = 0
+    if V.zoom_param < 1 and not (D.nch == 1 and V.TOGGLE_FLOW_COLORS == 6):
+       from math import floor, log
+       level = min(int(floor(log(1.0/V.zoom_param, 2) + 1e-9)), len(D.pyramid))
+    levels = [D.imageBitmapTiles] + D.pyramid
+    # only the tiles in the window are drawn, and uploaded if needed
+    visible = {level: visible_tiles(D, level)}
+    draw = [level]
+    # the missing tiles are covered by the finest level already uploaded
+    # (the coarsest level is a single tile, uploaded first)
+    missing = [tile for tile in visible[level] if tile[6] == -1]
+    if missing:
+       for l in range(level+1, len(levels)):
+          visible[l] = visible_tiles(D, l)
+          if all(tile[6] != -1 for tile in visible[l]):
+             draw.insert(0, l)
+             break
+       coarsest = len(levels)-1
+       if coarsest != level:
+          if coarsest not in visible:
+             visible[coarsest] = visible_tiles(D, coarsest)
+          missing = [tile for tile in visible[coarsest] if tile[6] == -1] + missing
+    D.upload_queue = missing[::-1]   # upload_textures pops them from the end
+    # the quads of the tiles are in a vertex buffer (x,y,u,v,layer), and
+    # their textures in the layers of a texture array: one call draws them
+    vbo, vertices, first = tile_vertex_buffer(D)
+    pool = tile_pool(D.imageBitmapTiles[0])
+    firsts = []
+    for l in draw:
+       for tile in visible[l]:
+          if tile[6] != -1:
+             touch_texture(pool, tile[6])
+             firsts.append(first[id(tile)])
+    offset = 0 if vbo else ctypes.addressof(vertices)
+    stride = VERTEX_FLOATS*ctypes.sizeof(ctypes.c_float)
+    glBindBuffer(GL_ARRAY_BUFFER, vbo)
+    glEnableClientState(GL_VERTEX_ARRAY)
+    glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+    glVertexPointer(2, GL_FLOAT, stride, ctypes.c_void_p(offset))
+    glTexCoordPointer(3, GL_FLOAT, stride, ctypes.c_void_p(offset+8))
+    glBindTexture (GL_TEXTURE_2D_ARRAY, pool.texture)
+    _tilesz= uniform_location(b"_tilesz")
+    glUniform2f(_tilesz, pool.size, pool.size);
+    glPushMatrix()
+    # third operation
+    glScalef(V.zoom_param, V.zoom_param,1)
+    # second operation
+    glTranslate(-V.dx,-V.dy,0)
+    # second operation
+    glTranslate(V.dragdx,V.dragdy,0)
+    glColor3f(1.0, 0.0, 0.0);
+    if firsts:
+       glMultiDrawArrays(GL_QUADS, (ctypes.c_int*len(firsts))(*firsts),
+                         (ctypes.c_int*len(firsts))(*[4]*len(firsts)), len(firsts))
+    glPopMatrix()
+    glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+    glDisableClientState(GL_VERTEX_ARRAY)
+    glBindBuffer(GL_ARRAY_BUFFER, 0)
 
 
     # show colorbar
@@ -2072,7 +2224,7 @@ def display( window ):
        xx0,yy0,xx1,yy1 = int(V.winx-50),int(0),int(V.winx),int(200)
 
        # signal the shader that there is no texture inside this quad
-       disableTex= glGetUniformLocation(program, b"disableTex")
+       disableTex= uniform_location(b"disableTex")
        glUniform1i(disableTex, 1);
 
        # compose transformation
@@ -2096,7 +2248,7 @@ def display( window ):
 
        glPopMatrix()
 
-       disableTex= glGetUniformLocation(program, b"disableTex")
+       disableTex= uniform_location(b"disableTex")
        glUniform1i(disableTex, 0);
 
 
@@ -2107,10 +2259,17 @@ def display( window ):
     if V.display_hud==1:
        a=D.v_max-D.v_min
        b=D.v_min
-       drawHud('%s\n%s\n%s\n%.3f %.3f %s\n%.3f %.3f'%(
+       drawHud('%s\n%s\n%s\n%.3f %.3f %s\n%.3f %.3f (1%%-99%%: %.3f %.3f)%s\nGPU %.1f MB'%(
             D.filename, V.txt_pos,V.txt_val,V.v_center,V.v_radius, 
-            'auto' if V.TOGGLE_AUTOMATIC_RANGE else '',
-            D.v_min,D.v_max)
+            ['', 'auto', 'auto visible'][V.TOGGLE_AUTOMATIC_RANGE],
+            D.v_min,D.v_max, D.p_min,D.p_max,
+            ' nan/inf %d'%sum(D.stats['nonfinite']) if D.stats and sum(D.stats['nonfinite']) else '',
+            D.gpu_bytes/1048576.0)
+            + (' float16' if HALF_TEXTURES else '')
+            + (' (%.1f MB in all)'%(GPU_BYTES/1048576.0) if GPU_BYTES != D.gpu_bytes else '')
+            + '\ncache %d images %.1f MB, %d hits %d misses'%(len(DD), DD.nbytes/1048576.0, DD.hits, DD.misses)
+            + ('\nuploading %d tiles'%len(D.upload_queue) if D.upload_queue else '')
+            + ('\ndecoding %s'%PENDING_IMAGE[1] if PENDING_IMAGE else '')
             )
     if V.display_hud==2:
        drawHud("%.2f"%(V.v_center + V.v_radius), (0,1,0), (V.winx-50, 10))
@@ -2124,6 +2283,8 @@ def display( window ):
        drawHud(HELPstr, (0,1,0), (10, 80))
        HELPstr=""
 
+    drawHudText(hud_text)
+
 
     # show RECTANGULAR region
     global x0,y0,w0,h0,b0state,b1state
@@ -2162,41 +2323,327 @@ def display( window ):
 
 
 
-def setupTexture(imageBitmap, ix,iy,nch, textureID=13):
-    """texture environment setup"""
-    glBindTexture(GL_TEXTURE_2D, textureID)
+def setupTexture(imageBitmap, ix,iy,nch, textureID, layer=0):
+    """copies the tile to a layer of the texture array textureID"""
+    glBindTexture(GL_TEXTURE_2D_ARRAY, textureID)
     glPixelStorei(GL_UNPACK_ALIGNMENT,1)
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT);
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT);
-#    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR);
-#    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR);
-    glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-    glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
-    glTexEnvf(GL_TEXTURE_ENV, GL_TEXTURE_ENV_MODE, GL_DECAL)
-
-    # THE INTERNAL FORMAT GL_RGB32F ALLOWS TO PERFORM THE CONTRAST CHANGE ON THE FRAGMENT SHADER WITHOUT PRECISION LOSS
-    # https://www.opengl.org/discussion_boards/showthread.php/170053-Shader-floating-point-precision
-    # https://www.opengl.org/sdk/docs/man/xhtml/glTexImage2D.xml
-    if nch==1:
-       glTexImage2D( GL_TEXTURE_2D, 0, GL_RGB32F, ix, iy, 0,
-         GL_LUMINANCE, GL_FLOAT, imageBitmap)
-    elif nch==2:
-       glTexImage2D( GL_TEXTURE_2D, 0, GL_RGBA32F, ix, iy, 0,
-         GL_LUMINANCE_ALPHA, GL_FLOAT, imageBitmap)
-    elif nch==4:
-       glTexImage2D( GL_TEXTURE_2D, 0, GL_RGBA32F, ix, iy, 0,
-         GL_RGBA, GL_FLOAT, imageBitmap)
+    gltype = texture_type(imageBitmap._type_)[0]
+    nch = min(max(nch,1),4)
+    nbytes = ix*iy*nch*ctypes.sizeof(imageBitmap._type_)
+    pbo = pixel_buffer_from(imageBitmap, nbytes)
+    if pbo is None:
+       glTexSubImage3D( GL_TEXTURE_2D_ARRAY, 0, 0, 0, layer, ix, iy, 1,
+         PIXEL_FORMATS[nch], gltype, imageBitmap)
     else:
-       glTexImage2D( GL_TEXTURE_2D, 0, GL_RGB32F, ix, iy, 0,
-         GL_RGB, GL_FLOAT, imageBitmap)
+       # the copy from the buffer to the texture runs asynchronously
+       glBindBuffer(GL_PIXEL_UNPACK_BUFFER, pbo)
+       glTexSubImage3D( GL_TEXTURE_2D_ARRAY, 0, 0, 0, layer, ix, iy, 1,
+         PIXEL_FORMATS[nch], gltype, ctypes.c_void_p(0))
+       glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0)
+    return nbytes
+
+
+class TilePool:
+   ''' a texture array of TILE_SIZE x TILE_SIZE layers, each one holding a
+       tile (in its lower left corner) of one of the images that have the
+       same sample type and number of channels '''
+   def __init__(self, ctype, nch, half=False):
+      import piio
+      self.size = piio.TILE_SIZE
+      self.ctype, self.nch = ctype, nch
+      gltype = texture_type(ctype)[0]
+      # float tiles may be converted to half floats by the GPU
+      self.format = TEXTURE_FORMATS[GL_HALF_FLOAT if half else gltype][nch]
+      self.layer_bytes = self.size*self.size*nch*(2 if half else ctypes.sizeof(ctype))
+      self.texture = int(glGenTextures(1))
+      self.layers = 0
+      self.free = []
+
+   def grow(self, layers):
+      ''' reallocates the array with more layers, copying the old ones if
+          possible, returns False if they are lost '''
+      gltype = texture_type(self.ctype)[0]
+      # THE INTERNAL FORMAT GL_R32F ALLOWS TO PERFORM THE CONTRAST CHANGE ON THE FRAGMENT SHADER WITHOUT PRECISION LOSS
+      # https://www.opengl.org/discussion_boards/showthread.php/170053-Shader-floating-point-precision
+      # the textures have exactly the channels and the depth of the buffer,
+      # the shaders undo the normalization and replicate the channels (see SHADER_PRELUDE)
+      texture = int(glGenTextures(1))
+      glBindTexture(GL_TEXTURE_2D_ARRAY, texture)
+      glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+      glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+      glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+      glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+      glTexImage3D(GL_TEXTURE_2D_ARRAY, 0, self.format,
+                   self.size, self.size, layers, 0, PIXEL_FORMATS[self.nch], gltype, None)
+      kept = bool(glCopyImageSubData) and self.layers > 0
+      if kept:
+         glCopyImageSubData(self.texture, GL_TEXTURE_2D_ARRAY, 0, 0, 0, 0,
+                            texture, GL_TEXTURE_2D_ARRAY, 0, 0, 0, 0,
+                            self.size, self.size, self.layers)
+      glDeleteTextures([self.texture])
+      self.texture = texture
+      self.free += list(range(layers-1, self.layers-1, -1))
+      self.layers = layers
+      return kept
+
+
+# the texture arrays, by sample type, number of channels and half float storage
+TILE_POOLS = {}
+
+def tile_pool(tile):
+    ctype = tile[0]._type_
+    key = (ctype, min(max(tile[5],1),4), HALF_TEXTURES and ctype == ctypes.c_float)
+    if key not in TILE_POOLS:
+       TILE_POOLS[key] = TilePool(*key)
+    return TILE_POOLS[key]
+
+
+# ring of pixel buffer objects used for the uploads, so that the copy of a
+# tile to the GPU overlaps with the preparation of the next ones
+PBO_RING_SIZE = 4
+PBO_RING = []
+PBO_NEXT = 0
+
+def pixel_buffer_from(imageBitmap, nbytes):
+    """copies the buffer in the next pixel buffer object of the ring and
+       returns it, or None if pixel buffer objects are not available"""
+    global PBO_RING, PBO_NEXT
+    if not PBO_RING:
+       if not (bool(glGenBuffers) and bool(glMapBufferRange)):
+          PBO_RING = [None]
+       else:
+          PBO_RING = [int(b) for b in glGenBuffers(PBO_RING_SIZE)]
+    pbo = PBO_RING[PBO_NEXT % len(PBO_RING)]
+    PBO_NEXT = PBO_NEXT + 1
+    if pbo is None:
+       return None
+
+    glBindBuffer(GL_PIXEL_UNPACK_BUFFER, pbo)
+    # orphan the previous storage: if the GPU still reads from it, the
+    # driver gives a new one instead of waiting
+    glBufferData(GL_PIXEL_UNPACK_BUFFER, nbytes, None, GL_STREAM_DRAW)
+    ptr = glMapBufferRange(GL_PIXEL_UNPACK_BUFFER, 0, nbytes,
+                           GL_MAP_WRITE_BIT | GL_MAP_INVALIDATE_BUFFER_BIT)
+    if ptr:
+       ctypes.memmove(ptr, imageBitmap, nbytes)
+    mapped = ptr and glUnmapBuffer(GL_PIXEL_UNPACK_BUFFER)
+    glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0)
+    return pbo if mapped else None
+
+
+
+# GL type and normalization factor for each type of tile buffer
+TEXTURE_TYPES = {
+      ctypes.c_uint8  : (GL_UNSIGNED_BYTE,  255.0),
+      ctypes.c_uint16 : (GL_UNSIGNED_SHORT, 65535.0),
+      ctypes.c_float  : (GL_FLOAT,          1.0),
+      }
+
+def texture_type(ctype):
+    """the entry of TEXTURE_TYPES of a tile buffer type, the tiles that are
+       not in it are those of piio.to_half"""
+    return TEXTURE_TYPES.get(ctype, (GL_HALF_FLOAT, 1.0))
+
+# internal format of the textures, by GL type and number of channels
+TEXTURE_FORMATS = {
+      GL_UNSIGNED_BYTE  : {1: GL_R8,   2: GL_RG8,   3: GL_RGB8,   4: GL_RGBA8},
+      GL_UNSIGNED_SHORT : {1: GL_R16,  2: GL_RG16,  3: GL_RGB16,  4: GL_RGBA16},
+      GL_FLOAT          : {1: GL_R32F, 2: GL_RG32F, 3: GL_RGB32F, 4: GL_RGBA32F},
+      GL_HALF_FLOAT     : {1: GL_R16F, 2: GL_RG16F, 3: GL_RGB16F, 4: GL_RGBA16F},
+      }
+
+# the float tiles are stored as half floats on the GPU (-half, or the key G),
+# and in the image cache too (-halfcache)
+HALF_TEXTURES = False
+HALF_CACHE = False
+
+PIXEL_FORMATS = {1: GL_RED, 2: GL_RG, 3: GL_RGB, 4: GL_RGBA}
 
 
 
-def setupTexturesFromImageTiles(imageBitmapTiles, ix,iy,nch, textureID=13):
-    """texture environment setup"""
-    for tile in imageBitmapTiles:
-       setupTexture(tile[0], tile[3],tile[4],tile[5], textureID)
-       textureID=textureID+1
+# time spent uploading tiles in each frame while an image streams in (seconds)
+UPLOAD_BUDGET = 0.015
+
+def visible_tiles(T, l=0):
+    """the tiles of the level l of T (reduced 2^l times) that intersect the
+       window, only the cells of the grid of the level around the window
+       are looked at"""
+    from math import floor, ceil
+    s = 2**l
+    x0,y0,x1,y1 = V.visible_region()
+    tw,th,nx,ny,grid = T.tile_grid(l)
+    i0, i1 = max(0, int(floor(x0/(s*tw)))), min(nx, int(ceil(x1/(s*tw))))
+    j0, j1 = max(0, int(floor(y0/(s*th)))), min(ny, int(ceil(y1/(s*th))))
+    cells = (grid[i + j*nx] for j in range(j0, j1) for i in range(i0, i1))
+    return [tile for tile in cells if tile and tile[1]*s < x1 and (tile[1]+tile[3])*s > x0
+                                           and tile[2]*s < y1 and (tile[2]+tile[4])*s > y0]
+
+
+def start_texture_upload(T):
+    """queues the upload of the coarsest pyramid level of T, so that the
+       whole image shows up quickly; display then queues the tiles in the
+       window that are not on the GPU (their layer is -1)"""
+    levels = [T.imageBitmapTiles] + T.pyramid
+    if not T.gpu_bytes:
+       for tiles in levels:
+          for tile in tiles:
+             tile[6] = -1
+    T.upload_queue = [tile for tile in levels[-1] if tile[6] == -1]
+
+
+def upload_textures(T, budget=None):
+    """uploads the queued tiles of T for about budget seconds (at least one
+       tile, all of them if budget is None), returns True if some are left"""
+    import time
+    t0 = time.time()
+    ntiles = sum(len(tiles) for tiles in [T.imageBitmapTiles] + T.pyramid)
+    while T.upload_queue:
+       tile = T.upload_queue.pop()
+       pool = tile_pool(tile)
+       layer = free_layer(pool, ntiles)
+       setupTexture(tile[0], tile[3],tile[4],tile[5], pool.texture, layer)
+       tile[6] = layer
+       GPU_TILES[pool, layer] = (T, tile, FRAME)
+       T.gpu_bytes += pool.layer_bytes
+       set_tile_layer(T, tile)
+       if budget is not None and time.time() - t0 > budget:
+          break
+    return len(T.upload_queue) > 0
+
+
+# the layers of the tiles on the GPU, least recently drawn first:
+# (pool, layer) -> (image, tile, last frame drawn); the pools use GPU_BYTES and
+# their layers are recycled beyond VRAM_BUDGET (-vram MB)
+GPU_TILES = collections.OrderedDict()
+GPU_BYTES = 0
+VRAM_BUDGET = 1<<30
+FRAME = 0
+
+def touch_texture(pool, layer):
+    """marks the layer as drawn in this frame"""
+    T, tile, frame = GPU_TILES.pop((pool, layer))
+    GPU_TILES[pool, layer] = (T, tile, FRAME)
+
+
+def free_layer(pool, wanted=1):
+    """a layer of the pool for a new tile: a free one, a new one if the pool
+       can grow within VRAM_BUDGET, or the one of the least recently drawn
+       tile (the tiles drawn in this frame stay, even beyond the budget)
+       wanted is the number of tiles about to be uploaded: without
+       glCopyImageSubData growing loses the layers, so the pool is then
+       allocated for all of them at once"""
+    global GPU_BYTES
+    room = lambda: (VRAM_BUDGET - GPU_BYTES)//pool.layer_bytes
+    if not pool.free and room() < 1:
+       for key in GPU_TILES:
+          if GPU_TILES[key][2] == FRAME:
+             break
+          if key[0] is pool:
+             release_texture(*key)
+             break
+    if not pool.free and room() < 1:
+       # the other pools that are not in use make room for this one
+       for other in list(TILE_POOLS.values()):
+          if other is not pool and not any(GPU_TILES[key][2] == FRAME for key in GPU_TILES if key[0] is other):
+             delete_pool(other)
+    if not pool.free:
+       # the pool doubles within the budget (and grows by one beyond it)
+       old = pool.layers
+       grow = max(old, 8) if bool(glCopyImageSubData) else wanted
+       if not pool.grow(old + max(1, min(grow, room()))):
+          for key in [key for key in GPU_TILES if key[0] is pool]:
+             release_texture(*key)
+       GPU_BYTES += (pool.layers - old)*pool.layer_bytes
+    return pool.free.pop()
+
+
+def toggle_half_textures():
+    """switches the storage of the float tiles on the GPU between floats
+       and half floats, their textures are uploaded again"""
+    global HALF_TEXTURES
+    HALF_TEXTURES = not HALF_TEXTURES
+    for key in list(TILE_POOLS):
+       if key[0] == ctypes.c_float and key in TILE_POOLS:
+          delete_pool(TILE_POOLS[key])
+    start_texture_upload(D)
+
+
+def delete_pool(pool):
+    global GPU_BYTES
+    for key in [key for key in GPU_TILES if key[0] is pool]:
+       release_texture(*key)
+    glDeleteTextures([pool.texture])
+    GPU_BYTES -= pool.layers*pool.layer_bytes
+    for key in list(TILE_POOLS):
+       if TILE_POOLS[key] is pool:
+          TILE_POOLS.pop(key)
+
+
+def release_texture(pool, layer):
+    """forgets the tile of the layer, which becomes free"""
+    T, tile, frame = GPU_TILES.pop((pool, layer))
+    tile[6] = -1
+    T.gpu_bytes -= pool.layer_bytes
+    pool.free.append(layer)
+
+
+# floats per vertex in tile_vertex_buffer
+VERTEX_FLOATS = 5
+
+def tile_vertex_buffer(T):
+    """the quads of the tiles of the image and of its pyramid levels, in
+       image coordinates: returns the vertex buffer object (0 if they are
+       not available), the vertices (x,y,u,v,layer) and the index of the
+       first vertex of each tile, by id(tile)"""
+    if T.vertex_buffer is None:
+       import piio
+       first = {}
+       quads = []
+       for l,tiles in enumerate([T.imageBitmapTiles] + T.pyramid):
+          s = 2**l
+          for tile in tiles:
+             x0,y0,w,h = tile[1]*s,tile[2]*s,tile[3]*s,tile[4]*s
+             u,v = tile[3]/float(piio.TILE_SIZE), tile[4]/float(piio.TILE_SIZE)
+             first[id(tile)] = len(quads)//VERTEX_FLOATS
+             quads += [x0  ,y0+h, 0.0,v  , tile[6],
+                       x0+w,y0+h, u  ,v  , tile[6],
+                       x0+w,y0  , u  ,0.0, tile[6],
+                       x0  ,y0  , 0.0,0.0, tile[6]]
+       vertices = (ctypes.c_float*len(quads))(*quads)
+       vbo = 0
+       if bool(glGenBuffers):
+          vbo = int(glGenBuffers(1))
+          glBindBuffer(GL_ARRAY_BUFFER, vbo)
+          glBufferData(GL_ARRAY_BUFFER, ctypes.sizeof(vertices), vertices, GL_STATIC_DRAW)
+          glBindBuffer(GL_ARRAY_BUFFER, 0)
+       T.vertex_buffer = (vbo, vertices, first)
+    return T.vertex_buffer
+
+
+def set_tile_layer(T, tile):
+    """writes the layer of the tile in its vertices"""
+    if T.vertex_buffer is None:
+       return
+    vbo, vertices, first = T.vertex_buffer
+    i = first[id(tile)]*VERTEX_FLOATS
+    for k in range(4):
+       vertices[i + k*VERTEX_FLOATS + 4] = tile[6]
+    if vbo:
+       n = 4*VERTEX_FLOATS*ctypes.sizeof(ctypes.c_float)
+       glBindBuffer(GL_ARRAY_BUFFER, vbo)
+       glBufferSubData(GL_ARRAY_BUFFER, i*ctypes.sizeof(ctypes.c_float), n,
+                       ctypes.c_void_p(ctypes.addressof(vertices) + i*ctypes.sizeof(ctypes.c_float)))
+       glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+
+def release_textures(T):
+    """frees the layers and deletes the vertex buffer of the image"""
+    if T.vertex_buffer is not None and T.vertex_buffer[0]:
+       glDeleteBuffers(1, [T.vertex_buffer[0]])
+    T.vertex_buffer = None
+    for key in [key for key in GPU_TILES if GPU_TILES[key][0] is T]:
+       release_texture(*key)
+    T.upload_queue = []
 
 
 
@@ -2221,6 +2668,25 @@ def toc(name=''):
 ##### TIC TOC 
 
 
+##### STARTUP BENCHMARK (--bench-startup)
+# (stage, time at its end) of the startup, None if not measured
+BENCH_STARTUP = None
+
+def bench_startup(stage):
+   ''' marks the end of a stage of the startup (the first time only) '''
+   if BENCH_STARTUP is not None and stage not in [s for s,t in BENCH_STARTUP]:
+      BENCH_STARTUP.append((stage, time.time()))
+
+def print_bench_startup():
+   ''' prints the time spent in each stage of the startup '''
+   t = STARTUP_TIME
+   for stage, end in BENCH_STARTUP:
+      print('%-10s %8.1f ms'%(stage, (end - t)*1000))
+      t = end
+   print('%-10s %8.1f ms'%('total', (t - STARTUP_TIME)*1000))
+##### STARTUP BENCHMARK
+
+
 
 def pick_option(argv, option, default):
    # it's a parameter or just a flag?
@@ -2249,6 +2715,40 @@ def main():
 
     # get the svg file
     svgfile = pick_option(sys.argv, 'svg', None)
+    # the tile cache
+    global TILE_CACHE_DIR, TILE_CACHE_BYTES
+    TILE_CACHE_DIR = pick_option(sys.argv, 'cachedir', None)
+    TILE_CACHE_BYTES = int(float(pick_option(sys.argv, 'cachesize', TILE_CACHE_BYTES>>20))*(1<<20))
+    # the background decoding of the neighbouring images
+    global PREFETCH_RADIUS
+    PREFETCH_RADIUS = int(pick_option(sys.argv, 'prefetch', PREFETCH_RADIUS))
+    # the GPU memory kept for the textures of the images already shown
+    global VRAM_BUDGET
+    VRAM_BUDGET = int(float(pick_option(sys.argv, 'vram', VRAM_BUDGET>>20))*(1<<20))
+    # colormaps read from files, added to the palettes of the key 1
+    lut = pick_option(sys.argv, 'lut', None)
+    while lut is not None:
+       try:
+          COLORMAP_CYCLE.append(load_colormap(lut))
+       except (IOError, ValueError) as e:
+          print('error reading the colormap: %s'%e)
+       lut = pick_option(sys.argv, 'lut', None)
+    # the cache of the shader programs
+    global SHADER_CACHE_DIR
+    SHADER_CACHE_DIR = pick_option(sys.argv, 'shadercache', SHADER_CACHE_DIR)
+    if SHADER_CACHE_DIR == 'none':
+       SHADER_CACHE_DIR = None
+    # the memory kept for the images already read
+    global DD
+    DD.max_bytes = int(float(pick_option(sys.argv, 'mem', DD.max_bytes>>20))*(1<<20))
+    # half float storage of the float images: on the GPU, and also in the cache
+    global HALF_TEXTURES, HALF_CACHE
+    HALF_CACHE = pick_option(sys.argv, 'halfcache', '') != ''
+    HALF_TEXTURES = pick_option(sys.argv, 'half', '') != '' or HALF_CACHE
+    # report the time of each stage of the startup, and quit after the first frame
+    global BENCH_STARTUP
+    if pick_option(sys.argv, '-bench-startup', '') != '':
+       BENCH_STARTUP = [('import', time.time())]
     # verify input
     if len(sys.argv) == 1:
        # check if the standard input is a tty (not a pipe)
@@ -2257,7 +2757,7 @@ def main():
           here  = path.dirname(__file__)
 
           print("Incorrect syntax, use:")
-          print('  > ' + sys.argv[0] +  " image.png [-svg shape.svg]" )
+          print('  > ' + sys.argv[0] +  " image.png [-svg shape.svg] [-cachedir dir [-cachesize MB]] [-prefetch N] [-vram MB] [-mem MB] [-half] [-halfcache] [-shadercache dir|none] [-lut colormap.csv]... [--bench-startup]" )
 
           # show a default image if exists
           sys.argv.append(here + '/uiskentuie_standing_stone.png')
@@ -2274,7 +2774,7 @@ def main():
 
 
     # globals
-    global D,V,DD,current_image_idx
+    global D,V,current_image_idx
 
 
     tic()
@@ -2282,6 +2782,10 @@ def main():
     if not glfw.init():
         sys.exit(1)
 
+    # start decoding the first image while the window is created
+    # (not before: the decoders wake up the main loop with glfw.post_empty_event)
+    get_prefetcher().take(I1, block=False)
+
     # Create a windowed mode window (hidden) and its OpenGL context
     glfw.window_hint(glfw.FOCUSED,  GL_TRUE);
     glfw.window_hint(glfw.DECORATED,  GL_TRUE);
@@ -2305,10 +2809,8 @@ def main():
     glfw.set_window_refresh_callback(window,display_refresh)
 #    glfw.set_char_callback (window, unicode_char_callback)
 
-    if not glut.INITIALIZED:
-        glut.glutInit([])
-
     toc('glfw init')
+    bench_startup('GL init')
     tic()
 
     global svg
@@ -2328,8 +2830,9 @@ def main():
     #glDisable(GL_COLOR_LOGIC_OP)
 
     # read the image: this affects the global variables DD, D, and V
-    current_image_idx = change_image(0)
+    current_image_idx = change_image(0, block=True)
     V.reset_scale_bias()
+    bench_startup('decode')
 
     # resize the window 
     glfw.set_window_size(window, D.w,D.h)
@@ -2351,24 +2854,35 @@ def main():
 
     global program 
     # set the values of the shader uniform variables (global)
-    shader_a= glGetUniformLocation(program, b"shader_a")
+    shader_a= uniform_location(b"shader_a")
     glUniform1f(shader_a,V.scale_param)
-    shader_b= glGetUniformLocation(program, b"shader_b")
+    shader_b= uniform_location(b"shader_b")
     glUniform1f(shader_b,V.bias_param)
-    shader_c= glGetUniformLocation(program, b"shader_c")
+    shader_c= uniform_location(b"shader_c")
     glUniform1i(shader_c,V.inv_param)
-    disableTex= glGetUniformLocation(program, b"disableTex")
+    disableTex= uniform_location(b"disableTex")
     glUniform1i(disableTex, 0);
 
     glDisable( GL_LIGHTING) # context lights by default
 
     toc('loadImage+data->RGBbitmap')
+    bench_startup('shaders')
 
 
     # Loop until the user closes the window
     while not glfw.window_should_close(window):
         #glfw.set_window_should_close(window,1) # only used for profiling
 
+        # the input received since the last frame
+        apply_input(window)
+
+        # show the image decoded in background, upload some of its tiles
+        loading = poll_pending_image()
+        if D.upload_queue:
+           upload_textures(D, UPLOAD_BUDGET)
+           V.redisp=1
+        bench_startup('upload')
+
         # Render here
         if V.redisp:
            # Try to resize the window if needed
@@ -2395,14 +2909,26 @@ def main():
 
            # Swap front and back buffers
            glfw.swap_buffers(window)
-           V.mute_wheel=0
-           V.mute_sweep=0
-           V.mute_keyboard=0
 
+           if BENCH_STARTUP:
+              glFinish()
+              bench_startup('first swap')
+              print_bench_startup()
+              break
+
+
+        # build the other shader programs while there is nothing else to do
+        compiling = not (D.upload_queue or loading or V.redisp) and compile_next_shader_program()
 
         # Poll for and process events
-        #glfw.poll_events()
-        glfw.wait_events()
+        # (don't wait for them while there are tiles to upload)
+        if D.upload_queue or compiling:
+           glfw.poll_events()
+        elif loading and not hasattr(glfw, 'post_empty_event'):
+           glfw.poll_events()
+           time.sleep(0.02)
+        else:
+           glfw.wait_events()
 
     glfw.terminate()
 